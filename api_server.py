@@ -0,0 +1,300 @@
+"""Local HTTP batch API for AquaGenius sizing, simulation, PFD and reports.
+
+Each POST takes many scenarios at once and fans every (scenario, technology)
+item out to a worker pool. Identical items - within a batch, across
+concurrent requests, or repeated later - are coalesced onto one computation
+and served from an in-memory cache. Everything runs on this machine; the
+design logic is the same code the Streamlit app runs.
+
+    python api_server.py --port 8502 --workers 4
+
+    POST /v1/size      {"scenarios": [{"avg_flow_input": 20000, "avg_bod": 300}], "techs": ["cas", "mbr"]}
+    POST /v1/simulate  same body; sizing and simulated performance
+    POST /v1/pfd       same body; process flow diagram DOT source
+    POST /v1/report    same body; design report PDF, base64-encoded (needs the graphviz `dot` binary)
+    GET  /v1/health    worker, cache and coalescing counters
+
+Scenario keys are the keys of process_design.DEFAULT_INPUTS; omitted keys
+take those defaults, which are also the app's sidebar defaults.
+
+    python api_server.py --self-test    # offline check on an ephemeral port
+"""
+import argparse
+import base64
+import hashlib
+import http.client
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import process_design
+
+TECHS = ('cas', 'ifas', 'mbr', 'mbbr', 'scrubber', 'solids')
+OPERATIONS = ('size', 'simulate', 'pfd', 'report')
+MAX_SCENARIOS = 1000
+MAX_BODY_BYTES = 16 * 1024 * 1024
+
+
+def to_json(value):
+    """json.dumps fallback for numpy values in sizing and results dicts."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def build_inputs(scenario):
+    """Design inputs for one scenario: DEFAULT_INPUTS overridden by the scenario's keys."""
+    if not isinstance(scenario, dict):
+        raise ValueError("each scenario must be a JSON object")
+    return process_design.build_inputs(scenario)
+
+
+def run_item(operation, tech, inputs):
+    """Computes one (operation, technology) item for one scenario; runs in a worker."""
+    sizing = getattr(process_design, f"calculate_{tech}_sizing")(inputs)
+    if operation == 'size':
+        output = {'sizing': sizing}
+    else:
+        results = process_design.simulate_process(inputs, sizing)
+        if operation == 'simulate':
+            output = {'sizing': sizing, 'results': results}
+        elif operation == 'pfd':
+            output = {'dot': process_design.generate_pfd_dot(inputs, sizing, results)}
+        else:
+            pdf = process_design.generate_detailed_pdf_report(inputs, sizing, results)
+            output = {'pdf_base64': base64.b64encode(pdf).decode('ascii')}
+    # Round-trip so workers hand back plain JSON types
+    return json.loads(json.dumps(output, default=to_json))
+
+
+class CoalescingCache:
+    """LRU cache of finished items that also shares one future between identical in-flight items."""
+
+    def __init__(self, executor, max_entries):
+        self.executor = executor
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.stats = {'cache_hits': 0, 'coalesced': 0, 'computed': 0, 'failed': 0}
+
+    def submit(self, key, fn, *args):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.stats['cache_hits'] += 1
+                future = Future()
+                future.set_result(self.entries[key])
+                return future
+            if key in self.in_flight:
+                self.stats['coalesced'] += 1
+                return self.in_flight[key]
+            future = self.executor.submit(fn, *args)
+            self.in_flight[key] = future
+            self.stats['computed'] += 1
+        future.add_done_callback(lambda done: self._finish(key, done))
+        return future
+
+    def _finish(self, key, future):
+        with self.lock:
+            self.in_flight.pop(key, None)
+            if future.cancelled() or future.exception() is not None:
+                self.stats['failed'] += 1
+                return  # Failures are not cached, so a retry recomputes
+            self.entries[key] = future.result()
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries), in_flight=len(self.in_flight))
+
+
+def item_key(operation, tech, inputs):
+    canonical = json.dumps([operation, tech, inputs], sort_keys=True, separators=(',', ':'), default=to_json)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def run_batch(cache, operation, body):
+    """Runs every scenario x technology of a batch request; per-item failures are reported inline."""
+    if not isinstance(body, dict) or not isinstance(body.get('scenarios'), list):
+        raise ValueError("body must be a JSON object with a 'scenarios' list")
+    scenarios = body['scenarios']
+    if len(scenarios) > MAX_SCENARIOS:
+        raise ValueError(f"at most {MAX_SCENARIOS} scenarios per request")
+    techs = body.get('techs', list(TECHS))
+    if not isinstance(techs, list):
+        raise ValueError(f"'techs' must be a list, e.g. [\"{TECHS[0]}\"]")
+    unknown = [t for t in techs if t not in TECHS]
+    if unknown:
+        raise ValueError(f"unknown techs: {', '.join(map(str, unknown))}; expected any of {', '.join(TECHS)}")
+
+    # Submit everything before waiting, so the whole batch runs across the pool
+    pending = []
+    for scenario in scenarios:
+        try:
+            inputs = build_inputs(scenario)
+        except (ValueError, TypeError) as e:
+            pending.append(str(e))
+            continue
+        pending.append({tech: cache.submit(item_key(operation, tech, inputs), run_item, operation, tech, inputs) for tech in techs})
+
+    results = []
+    for entry in pending:
+        if isinstance(entry, str):
+            results.append({'error': entry})
+            continue
+        row = {}
+        for tech, future in entry.items():
+            try:
+                row[tech] = future.result()
+            except Exception as e:  # One bad item must not fail the batch
+                row[tech] = {'error': f"{type(e).__name__}: {e}"}
+        results.append(row)
+    return {'results': results}
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    server_version = 'AquaGeniusAPI/1.0'
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload, default=to_json).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/v1/health':
+            self.send_json(200, {'status': 'ok', 'workers': self.server.workers, **self.server.cache.snapshot()})
+        else:
+            self.send_json(404, {'error': f"unknown path {self.path}"})
+
+    def do_POST(self):
+        operation = self.path.rstrip('/').rsplit('/', 1)[-1]
+        if not self.path.startswith('/v1/') or operation not in OPERATIONS:
+            self.send_json(404, {'error': f"unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.send_json(400, {'error': "Content-Length must be a non-negative integer"})
+            return
+        if length > MAX_BODY_BYTES:
+            self.send_json(413, {'error': f"request body exceeds {MAX_BODY_BYTES} bytes"})
+            return
+        try:
+            body = json.loads(self.rfile.read(length) or b'null')
+            self.send_json(200, run_batch(self.server.cache, operation, body))
+        except (ValueError, TypeError) as e:
+            self.send_json(400, {'error': str(e)})
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(host='127.0.0.1', port=8502, workers=1, cache_size=4096, verbose=False):
+    """Builds the server; workers=0 computes in-process on a thread pool (no spawned processes)."""
+    if workers > 0:
+        # Spawn rather than fork: the request-handling server is multi-threaded
+        executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+    else:
+        executor = ThreadPoolExecutor(1)
+    server = ThreadingHTTPServer((host, port), ApiHandler)
+    server.daemon_threads = True
+    server.executor = executor
+    server.cache = CoalescingCache(executor, cache_size)
+    server.workers = workers
+    server.verbose = verbose
+    return server
+
+
+def self_test(workers=0):
+    """Serves on an ephemeral localhost port and checks each endpoint and the request validation.
+
+    The report check is skipped when graphviz's `dot` binary is not on PATH,
+    since the report embeds a rendered process flow diagram.
+    """
+    operations = [op for op in OPERATIONS if op != 'report' or shutil.which('dot')]
+    if len(operations) < len(OPERATIONS):
+        print("graphviz 'dot' not found on PATH; skipping the /v1/report check")
+    server = make_server(port=0, workers=workers)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=120)
+
+    def request(method, path, body=None, headers=None):
+        data = body if isinstance(body, bytes) or body is None else json.dumps(body).encode('utf-8')
+        conn.request(method, path, data, headers or {})
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+
+    try:
+        status, health = request('GET', '/v1/health')
+        assert status == 200 and health['status'] == 'ok', health
+        for operation in operations:
+            status, payload = request('POST', f"/v1/{operation}", {
+                'scenarios': [{'avg_flow_input': 20000}, {'avg_flow_input': 20000}, {'bogus': 1}], 'techs': ['cas']})
+            assert status == 200, payload
+            first, repeat, bad = payload['results']
+            assert 'error' not in first['cas'] and first == repeat, payload
+            assert bad['error'] == "unknown input keys: bogus", bad
+        status, payload = request('POST', '/v1/size', {'scenarios': [{}], 'techs': 'cas'})
+        assert status == 400 and 'must be a list' in payload['error'], payload
+        status, payload = request('POST', '/v1/size', {'scenarios': [{}], 'techs': ['cas', 'xyz']})
+        assert status == 400 and 'unknown techs: xyz' in payload['error'], payload
+        status, payload = request('POST', '/v1/size', b'', {'Content-Length': '-1'})
+        assert status == 400, payload
+        status, payload = request('GET', '/v1/nothing')
+        assert status == 404, payload
+        status, health = request('GET', '/v1/health')
+        assert health['computed'] == len(operations) and health['coalesced'] + health['cache_hits'] == len(operations), health
+    finally:
+        conn.close()
+        server.shutdown()
+        server.server_close()
+        server.executor.shutdown(cancel_futures=True)
+    print(f"Self-test passed: {health}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='127.0.0.1', help="Interface to bind (default: localhost only)")
+    parser.add_argument('--port', type=int, default=8502)
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1),
+                        help="Worker processes; 0 computes in the server process")
+    parser.add_argument('--cache-size', type=int, default=4096, help="Finished items kept in the LRU cache")
+    parser.add_argument('--verbose', action='store_true', help="Log every request")
+    parser.add_argument('--self-test', action='store_true', help="Run the offline endpoint check and exit")
+    args = parser.parse_args()
+
+    if args.self_test:
+        self_test(args.workers)
+        return
+
+    server = make_server(args.host, args.port, args.workers, args.cache_size, args.verbose)
+    print(f"AquaGenius API on http://{args.host}:{server.server_address[1]} with {args.workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.executor.shutdown(cancel_futures=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""Multi-session load test for the AquaGenius Streamlit app.
+
+Each simulated engineer is a separate process that drives its own
+Streamlit AppTest session through a sidebar and slider script, so
+sessions run concurrently and their memory can be measured on their own.
+Reports rerun latency percentiles, throughput and RSS per session.
+
+Because sessions are separate processes, each starts with a cold
+st.cache_data and cross-session cache hits are not measured; the SQLite
+run store is shared, so its locking is. (AppTest sessions cannot share a
+process: concurrent sessions in threads interfere with each other.)
+
+    python load_test.py --sessions 20 --concurrency 4 --iterations 3
+"""
+import argparse
+import contextlib
+import json
+import os
+import resource
+import tempfile
+import time
+from multiprocessing import get_context
+
+import numpy as np
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wwtp_designer.py')
+RUN_BUTTON = 'Generate Design & Simulate'
+
+
+def rss_mb():
+    """Current resident set size of this process in MB."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Peak, where /proc is unavailable
+
+
+def build_script(rng):
+    """One realistic pass: set influent criteria, generate, then tune and re-run one tab."""
+    tech = str(rng.choice(['cas', 'ifas', 'mbr', 'mbbr']))
+    steps = [
+        ('number_input', 'Average Influent Flow (m³/day)', float(rng.integers(20, 400) * 100)),
+        ('number_input', 'Average Influent BOD (mg/L)', int(rng.integers(15, 35) * 10)),
+        ('number_input', 'Average Influent TKN (mg/L)', int(rng.integers(5, 12) * 5)),
+        ('slider', 'Target Dewatering Cake Solids (%)', int(rng.integers(18, 30))),
+        ('button', RUN_BUTTON, None),
+    ]
+    for key in ('air_slider', 'ras_slider', 'was_slider'):
+        steps.append(('slider', f"{tech}_{key}", int(rng.integers(14, 26) * 5)))
+    steps.append(('button', f"rerun_{tech}", None))
+    return steps
+
+
+def find_widget(at, kind, ref):
+    """Finds a widget by key, falling back to its label (sidebar widgets have no keys)."""
+    widgets = getattr(at, kind)
+    for widget in widgets:
+        if widget.key == ref or widget.label == ref:
+            return widget
+    raise LookupError(f"No {kind} with key or label {ref!r}")
+
+
+def run_session(job):
+    """Runs one session's script and returns its latency samples and memory."""
+    from streamlit.testing.v1 import AppTest
+
+    session_id, iterations, seed, timeout, app_path = job
+    rng = np.random.default_rng(seed)
+    rss_before = rss_mb()
+    latencies, errors = [], []
+
+    def rerun(action):
+        start = time.perf_counter()
+        at = action()
+        latencies.append(time.perf_counter() - start)
+        errors.extend(str(e.value) for e in at.exception)
+        return at
+
+    at = AppTest.from_file(app_path, default_timeout=timeout)
+    at = rerun(at.run)
+    for _ in range(iterations):
+        for kind, ref, value in build_script(rng):
+            try:
+                widget = find_widget(at, kind, ref)
+            except LookupError as e:
+                errors.append(str(e))
+                continue
+            at = rerun(widget.click().run if kind == 'button' else widget.set_value(value).run)
+
+    return {
+        'session': session_id, 'latencies_s': latencies, 'errors': errors,
+        'rss_before_mb': rss_before, 'rss_after_mb': rss_mb()
+    }
+
+
+def summarize(sessions, wall_time_s):
+    latencies = np.concatenate([s['latencies_s'] for s in sessions])
+    rss_after = np.array([s['rss_after_mb'] for s in sessions])
+    rss_growth = rss_after - np.array([s['rss_before_mb'] for s in sessions])
+    return {
+        'sessions': len(sessions), 'reruns': int(latencies.size),
+        'wall_time_s': wall_time_s, 'throughput_reruns_per_s': latencies.size / wall_time_s,
+        'latency_p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'latency_p95_ms': float(np.percentile(latencies, 95) * 1000),
+        'latency_p99_ms': float(np.percentile(latencies, 99) * 1000),
+        'latency_max_ms': float(latencies.max() * 1000),
+        'rss_per_session_mean_mb': float(rss_after.mean()), 'rss_per_session_max_mb': float(rss_after.max()),
+        'session_rss_growth_mean_mb': float(rss_growth.mean()),
+        'errors': sum(len(s['errors']) for s in sessions),
+        'distinct_errors': sorted({e for s in sessions for e in s['errors']})[:10]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sessions', type=int, default=8, help="Simulated user sessions in total")
+    parser.add_argument('--concurrency', type=int, default=4, help="Sessions running at the same time")
+    parser.add_argument('--iterations', type=int, default=2, help="Script passes per session")
+    parser.add_argument('--timeout', type=float, default=120, help="Per-rerun timeout (s)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--app', default=APP_PATH, help="Streamlit script to load-test")
+    parser.add_argument('--store-dir', default=None, help="Run store directory (default: a fresh temporary one)")
+    parser.add_argument('--json', dest='json_path', default=None, help="Also write the summary to this file")
+    args = parser.parse_args()
+
+    jobs = [(i, args.iterations, args.seed + i, args.timeout, args.app) for i in range(args.sessions)]
+    with contextlib.ExitStack() as stack:
+        store_dir = args.store_dir or stack.enter_context(tempfile.TemporaryDirectory(prefix='aquagenius_load_'))
+        os.environ['AQUAGENIUS_STORE_DIR'] = store_dir  # Inherited by the spawned session processes
+        start = time.perf_counter()
+        # One fresh process per session so RSS is attributable to that session alone
+        with get_context('spawn').Pool(args.concurrency, maxtasksperchild=1) as pool:
+            sessions = list(pool.imap_unordered(run_session, jobs))
+        summary = summarize(sessions, time.perf_counter() - start)
+    summary.update(concurrency=args.concurrency, iterations=args.iterations,
+                   store_dir=args.store_dir or 'temporary (removed)',
+                   isolation='process per session: st.cache_data cold in each, run store shared')
+
+    for key, value in summary.items():
+        print(f"{key:>28}: {value:.1f}" if isinstance(value, float) else f"{key:>28}: {value}")
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1199 @@
+"""Sizing, process simulation, process flow diagram and report generation.
+
+Kept out of wwtp_designer.py so the batch API and its worker processes can
+import the design logic without executing the Streamlit script.
+"""
+import functools
+import itertools
+import os
+import tempfile
+
+import numpy as np
+from fpdf import FPDF
+from graphviz import Source
+
+# ==============================================================================
+# --- Engineering Constants & Conversion Factors ---
+# ==============================================================================
+CONVERSION_FACTORS = {
+    'flow': {'MGD_to_m3_day': 3785.41, 'MLD_to_m3_day': 1000, 'm3_hr_to_gpm': 4.40287},
+    'volume': {'m3_to_gal': 264.172},
+    'area': {'m2_to_ft2': 10.7639},
+    'sor': {'m3_m2_day_to_gpd_ft2': 24.54},
+    'pressure': {'psi_to_pa': 6894.76, 'psi_to_m_water': 0.70307}
+}
+
+KINETIC_PARAMS = {
+    'Y': 0.6, 'kd': 0.06, 'fd': 0.15, 'TSS_VSS_ratio': 1.25, 'VSS_TSS_ratio': 0.8
+}
+
+AERATION_PARAMS = {
+    'O2_demand_BOD': 1.5, 'O2_demand_N': 4.57, 'SOTE': 0.30,
+    'O2_in_air_mass_fraction': 0.232, 'air_density_kg_m3': 1.225
+}
+
+CHEMICAL_FACTORS = {
+    'alum_to_p_ratio': 9.7, 'methanol_to_n_ratio': 2.86,
+    'naoh_to_h2s_ratio': 2.5,
+    'naocl_to_h2s_ratio': 4.5,
+    'h2so4_to_nh3_ratio': 0.6
+}
+
+CHEMICAL_PROPERTIES = {
+    'Sodium Hydroxide': {'mw': 40.0, 'density_kg_L': 1.52},
+    'Sodium Hypochlorite': {'mw': 74.44, 'density_kg_L': 1.21},
+    'Sulfuric Acid': {'mw': 98.07, 'density_kg_L': 1.84}
+}
+
+CONTAMINANT_PROPERTIES = {
+    'H2S': {'mw': 34.08},
+    'NH3': {'mw': 17.03}
+}
+
+SOLIDS_PARAMS = {
+    'biogas_yield_m3_kg_vsr': 0.5,
+    'methane_content_percent': 65,
+    'polymer_dose_thickening_kg_ton': 4,
+    'polymer_dose_dewatering_kg_ton': 8
+}
+
+# AOB kinetics at 20 °C with Arrhenius temperature coefficients (Metcalf & Eddy)
+NITRIFICATION_PARAMS = {
+    'mu_max_20': 0.90, 'mu_theta': 1.072,
+    'b_20': 0.17, 'b_theta': 1.029,
+    'Kn_20': 0.50, 'Kn_theta': 1.053,
+    'K_o': 0.50, 'design_do': 2.0,
+    'organic_n_mg_l': 1.5, 'design_safety_factor': 1.5,
+    'temp_grid_c': (0.0, 35.0, 0.1), 'srt_grid_days': (0.5, 60.0, 0.05), 'safety_factor_grid': (1.0, 3.0, 0.05)
+}
+
+HYDRAULIC_PARAMS = {
+    'hazen_williams_c': 120, 'design_velocity_m_s': 1.5, 'g': 9.81,
+    'weir_coefficient': 1.84, 'weir_free_fall_m': 0.15,
+    'connecting_pipe_length_m': 15, 'connecting_pipe_minor_k': 2.5,
+    'pump_pipe_length_m': 60, 'pump_pipe_minor_k': 6.0,
+    'static_lift_m': {'EQ': 5.0, 'RAS': 1.5, 'WAS': 3.0},
+    'valve_design_drop_psi': 5, 'valve_max_opening': 0.8, 'max_parallel_pumps': 6,
+    'min_weir_length_m': 0.5
+}
+
+# Multipliers on average flow for the hydraulic design conditions
+FLOW_CONDITIONS = {'Minimum': 0.4, 'Average': 1.0, 'Peak': 2.5}
+
+# Design storm and routing settings for equalization basin sizing
+EQ_PARAMS = {
+    'design_days': 7, 'step_minutes': 15, 'storm_start_day': 3, 'design_time_to_peak_hr': 6,
+    'design_outflow_factor': 1.5, 'volume_allowance': 0.2,  # Freeboard and dead storage
+    'unit_hydrograph_shape': 3.7, 'flow_paced_window_hr': 24, 'max_routing_elements': 4_000_000,
+    'max_hydrograph_values': 10_000_000  # Hydrographs x steps allowed in one tradeoff study (~80 MB per array)
+}
+
+STANDARD_PIPE_SIZES_MM = np.array([50, 80, 100, 150, 200, 250, 300, 350, 400, 450, 500, 600, 750, 900, 1050, 1200])
+
+PUMP_CATALOG = [
+    {'model': f"CP-{flow}-{head}", 'rated_flow_m3_hr': flow, 'rated_head_m': head, 'shutoff_head_m': round(head * 1.35, 1)}
+    for flow in (10, 25, 50, 100, 200, 400, 800, 1600, 3200, 6400)
+    for head in (6, 10, 15, 20, 30)
+]
+
+VALVE_CATALOG = [
+    {'model': f"BFV-{size}", 'size_mm': size, 'cv': cv}
+    for size, cv in ((50, 140), (80, 360), (100, 650), (150, 1500), (200, 2800), (250, 4500),
+                     (300, 6600), (400, 12000), (500, 19000), (600, 27000), (750, 43000), (900, 62000))
+]
+
+# Closed-loop chemical dosing: effluent setpoints by technology, undosed noise, and loop dynamics
+DOSING_CONTROL_PARAMS = {
+    'alum': {
+        'label': 'Alum (TP)', 'target_key': 'tp', 'ratio': CHEMICAL_FACTORS['alum_to_p_ratio'],
+        'setpoints': {'MBR': 0.5}, 'default_setpoint': 0.8, 'noise_mg_l': 0.2, 'floor_mg_l': 0.1,
+        'max_removal_mg_l': 3.0, 'process_lag_min': 30, 'sensor_lag_min': 10, 'dead_time_min': 15
+    },
+    'carbon': {
+        'label': 'Carbon Source (TKN/NOx)', 'target_key': 'tkn', 'ratio': CHEMICAL_FACTORS['methanol_to_n_ratio'],
+        'setpoints': {'MBR': 2.0, 'IFAS': 2.0}, 'default_setpoint': 3.0, 'noise_mg_l': 1.0, 'floor_mg_l': 0.5,
+        'max_removal_mg_l': 10.0, 'process_lag_min': 60, 'sensor_lag_min': 5, 'dead_time_min': 10
+    },
+    'compliance_margin': 0.1,  # Fraction above setpoint counted as an exceedance
+    'gain_ranges': {'kp': (0.0, 5.0), 'ki': (0.0, 2.0), 'kd': (0.0, 1.0), 'ff_gain': (0.0, 1.5)},
+    'default_gains': {'kp': (0.5, 2.0), 'ki': (0.1, 0.5), 'kd': (0.0, 0.0), 'ff_gain': (0.8, 1.0)},
+    # Gains each controller mode actually uses; the others are held at zero rather than swept
+    'mode_gains': {'PID + Feed-forward': ('kp', 'ki', 'kd', 'ff_gain'), 'PID': ('kp', 'ki', 'kd'), 'Feed-forward': ('ff_gain',)},
+    # One tuning study: steps x tuning sets (~30 ns each), and steps alone (~60 us each of per-step overhead)
+    'max_simulation_values': 20_000_000, 'max_steps': 525_600
+}
+
+FLOW_UNITS = {'m³/day': 'Metric (m³/day)', 'MGD': 'US Customary (MGD)', 'MLD': 'SI (MLD)'}
+
+# Design inputs as the sidebar starts out; the API fills omitted scenario keys from here
+DEFAULT_INPUTS = {
+    'flow_unit_short': 'm³/day', 'avg_flow_input': 10000.0,
+    'avg_bod': 250, 'avg_tss': 220, 'avg_tkn': 40, 'avg_tp': 7, 'design_temp_c': 12.0,
+    'air_flow_m3_hr': 5000.0, 'h2s_in_ppm': 50, 'nh3_in_ppm': 20,
+    'acid_chemical': 'Sulfuric Acid', 'acid_conc': 93.0,
+    'caustic_chemical': 'Sodium Hydroxide', 'caustic_conc': 12.5,
+    'target_thickened_solids': 4, 'target_cake_solids': 25, 'target_vsr': 55,
+    'use_alum': False, 'use_methanol': False, 'plant_name': 'Unnamed Plant'
+}
+
+# ==============================================================================
+# --- PDF Generation Class ---
+# ==============================================================================
+class PDF(FPDF):
+    def header(self):
+        self.set_font('Arial', 'B', 12)
+        self.cell(0, 10, 'AquaGenius - WWTP Design Report', border=0, ln=1, align='C')
+        self.ln(5)
+
+    def footer(self):
+        self.set_y(-15)
+        self.set_font('Arial', 'I', 8)
+        self.cell(0, 10, f'Page {self.page_no()}', border=0, ln=0, align='C')
+
+    def chapter_title(self, title):
+        self.set_font('Arial', 'B', 12)
+        self.cell(0, 6, title, border=0, ln=1, align='L')
+        self.ln(4)
+
+    def chapter_body(self, data):
+        self.set_font('Arial', '', 10)
+        key_width = 70
+        value_width = self.w - self.r_margin - self.l_margin - key_width
+        
+        for k, v in data.items():
+            self.set_font('Arial', 'B', 10)
+            self.cell(key_width, 5, f"- {k}:", align='L')
+            self.set_font('Arial', '', 10)
+            self.multi_cell(value_width, 5, str(v), align='L')
+            
+        self.ln()
+
+    def create_table(self, header, data, col_widths=None, row_height=6, header_height=7, font_size=9):
+        """Renders a table from any iterable of rows, consuming it page by page.
+
+        Column widths and font metrics are computed once per table and body rows
+        are written as raw PDF operators, so cost grows linearly with row count.
+        The header row is repeated after every page break.
+        """
+        rows = iter(data)
+        if col_widths is None:
+            sample = list(itertools.islice(rows, 200))
+            col_widths = self.fit_column_widths(header, sample, font_size)
+            rows = itertools.chain(sample, rows)
+
+        self.set_font('Arial', '', font_size)
+        char_widths = self.current_font.cw
+        text_scale = self.font_size / 1000
+        pad = self.c_margin
+        k, page_h = self.k, self.h
+        x_edges = [self.l_margin + sum(col_widths[:i]) for i in range(len(col_widths))]
+        baseline = 0.5 * row_height + 0.3 * self.font_size
+
+        def fit(text, width):
+            text = str(text).encode('latin-1', 'replace').decode('latin-1')
+            limit = (width - 2 * pad) / text_scale
+            if sum(char_widths.get(c, 600) for c in text) <= limit:
+                return text
+            limit -= 3 * char_widths['.']
+            total = 0
+            for i, c in enumerate(text):
+                total += char_widths.get(c, 600)
+                if total > limit:
+                    return text[:i] + '...'
+            return text
+
+        def escape(text):
+            return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+        def start_page_section():
+            if self.get_y() + header_height + row_height > self.page_break_trigger:
+                self.add_page()
+            self.set_font('Arial', 'B', font_size)
+            self.set_fill_color(220, 220, 220)
+            for i, h in enumerate(header):
+                self.cell(col_widths[i], header_height, h, border=1, ln=0, align='C', fill=1)
+            self.ln()
+            self.set_font('Arial', '', font_size)
+            # Raw rows never trigger fpdf2's lazy font selection, so select the body font on the page here
+            self._out(self._set_font_for_page(self.current_font, self.font_size_pt))
+
+        start_page_section()
+        y = self.get_y()
+        for row in rows:
+            if y + row_height > self.page_break_trigger:
+                self.set_y(y)
+                self.add_page()
+                start_page_section()
+                y = self.get_y()
+            y_top = (page_h - y) * k
+            y_text = (page_h - y - baseline) * k
+            ops = []
+            for x, w, item in zip(x_edges, col_widths, row):
+                ops.append(f"{x * k:.2f} {y_top:.2f} {w * k:.2f} {-row_height * k:.2f} re S "
+                           f"BT {(x + pad) * k:.2f} {y_text:.2f} Td ({escape(fit(item, w))}) Tj ET")
+            # Text takes the non-stroking color, which the header left at the fill grey
+            self._out(f"q {self.text_color.serialize().lower()} {' '.join(ops)} Q")
+            y += row_height
+        self.set_y(y)
+        self.ln(5)
+
+    def fit_column_widths(self, header, sample_rows, font_size=9):
+        """Column widths proportional to the widest sampled text, scaled to the page width."""
+        available = self.w - self.l_margin - self.r_margin
+        self.set_font('Arial', 'B', font_size)
+        widths = [self.get_string_width(str(h)) for h in header]
+        self.set_font('Arial', '', font_size)
+        for row in sample_rows:
+            widths = [max(w, self.get_string_width(str(item))) for w, item in zip(widths, row)]
+        widths = [w + 2 * self.c_margin for w in widths]
+        return [w * available / sum(widths) for w in widths]
+
+# ==============================================================================
+# --- Core Logic Functions ---
+# ==============================================================================
+def build_inputs(overrides=None):
+    """Design inputs from DEFAULT_INPUTS with overrides applied; derives the flow unit name and m³/day flow."""
+    overrides = overrides or {}
+    unknown = sorted(set(overrides) - set(DEFAULT_INPUTS) - {'calibrated_params'})
+    if unknown:
+        raise ValueError(f"unknown input keys: {', '.join(unknown)}")
+    inputs = dict(DEFAULT_INPUTS, **overrides)
+    unit = inputs['flow_unit_short']
+    if unit not in FLOW_UNITS:
+        raise ValueError(f"flow_unit_short must be one of {', '.join(FLOW_UNITS)}")
+    inputs['flow_unit_name'] = FLOW_UNITS[unit]
+    inputs['avg_flow_m3_day'] = float(inputs['avg_flow_input']) * CONVERSION_FACTORS['flow'].get(f"{unit}_to_m3_day", 1)
+    return inputs
+
+def get_process_params(inputs):
+    """Kinetic and aeration constants with any calibrated overrides from the inputs applied."""
+    overrides = inputs.get('calibrated_params') or {}
+    kinetic = dict(KINETIC_PARAMS, **{k: v for k, v in overrides.items() if k in KINETIC_PARAMS})
+    if 'TSS_VSS_ratio' in overrides:
+        kinetic['VSS_TSS_ratio'] = 1 / overrides['TSS_VSS_ratio']
+    aeration = dict(AERATION_PARAMS, **{k: v for k, v in overrides.items() if k in AERATION_PARAMS})
+    return kinetic, aeration
+
+def chemical_dose_target(chemical, tech):
+    """Effluent setpoint (mg/L) that alum ('alum') or carbon ('carbon') dosing aims for."""
+    params = DOSING_CONTROL_PARAMS[chemical]
+    return params['setpoints'].get(tech, params['default_setpoint'])
+
+def calculate_tank_dimensions(volume, shape='rect', depth=4.5):
+    """Calculates tank dimensions based on volume or area."""
+    if volume <= 0: return {}
+    if shape == 'rect':
+        area = volume / depth
+        width = (area / 3) ** 0.5 if area > 0 else 0
+        length = 3 * width
+        return {'Length (m)': f"{length:.1f}", 'Width (m)': f"{width:.1f}", 'Depth (m)': f"{depth:.1f}"}
+    elif shape == 'circ':
+        diameter = (4 * volume / np.pi) ** 0.5
+        return {'Diameter (m)': f"{diameter:.1f}", 'SWD (m)': f"{depth:.1f}"}
+    return {}
+
+def calculate_weir_length(volume, shape='rect', depth=4.5):
+    """Outlet weir length (m) from the unrounded tank geometry: a rectangular tank's width or a circular tank's perimeter."""
+    volume = max(volume, 0)
+    if shape == 'circ':
+        length = np.pi * (4 * volume / np.pi) ** 0.5
+    else:
+        length = (volume / depth / 3) ** 0.5
+    return max(length, HYDRAULIC_PARAMS['min_weir_length_m'])
+
+def calculate_valve_cv(flow_m3_hr, delta_p_psi=5):
+    """Calculates a required valve Cv."""
+    flow_gpm = flow_m3_hr * CONVERSION_FACTORS['flow']['m3_hr_to_gpm']
+    cv = flow_gpm * (1 / delta_p_psi) ** 0.5
+    return cv
+
+def build_catalog_index(catalog, *sort_keys):
+    """Sorts a catalog once so selections are binary searches on numpy key columns."""
+    entries = sorted(catalog, key=lambda e: tuple(e[k] for k in sort_keys))
+    index = {'entries': entries}
+    for k in sort_keys:
+        index[k] = np.array([e[k] for e in entries], dtype=float)
+    return index
+
+PUMP_INDEX = build_catalog_index(PUMP_CATALOG, 'rated_flow_m3_hr', 'rated_head_m')
+VALVE_INDEX = build_catalog_index(VALVE_CATALOG, 'cv')
+
+def select_pumps(flow_m3_hr, head_m):
+    """Selects the smallest catalog pump for each flow/head duty point.
+
+    When no single pump carries the flow, the duty is split across the fewest
+    identical pumps in parallel (returned with a 'count'). Every catalog entry
+    is checked, in (flow, head) order; duties that no pump reaches within
+    `max_parallel_pumps` get None.
+    """
+    flows = np.atleast_1d(np.asarray(flow_m3_hr, dtype=float))
+    heads = np.broadcast_to(np.asarray(head_m, dtype=float), flows.shape)
+    rated_flow = PUMP_INDEX['rated_flow_m3_hr']
+    meets_head = PUMP_INDEX['rated_head_m'] >= heads[..., None]
+    largest = np.where(meets_head, rated_flow, 0).max(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        counts = np.maximum(np.ceil(flows / largest), 1)
+    fits = meets_head & (rated_flow * counts[..., None] >= flows[..., None])
+    chosen = fits.argmax(axis=-1)
+    found = fits.any(axis=-1) & (counts <= HYDRAULIC_PARAMS['max_parallel_pumps'])
+    return [dict(PUMP_INDEX['entries'][i], count=int(n)) if ok else None
+            for i, n, ok in zip(chosen.ravel(), counts.ravel(), found.ravel())]
+
+def select_valves(required_cv):
+    """Selects the smallest catalog valve that passes each Cv below its maximum opening.
+
+    Duties beyond the largest valve are split across the fewest identical
+    valves in parallel (returned with a 'count', as select_pumps does).
+    """
+    rated_cv = np.atleast_1d(np.asarray(required_cv, dtype=float)) / HYDRAULIC_PARAMS['valve_max_opening']
+    counts = np.maximum(np.ceil(rated_cv / VALVE_INDEX['cv'][-1]), 1)
+    idx = np.searchsorted(VALVE_INDEX['cv'], rated_cv / counts, side='left')
+    return [dict(VALVE_INDEX['entries'][i], count=int(n)) for i, n in zip(idx.ravel(), counts.ravel())]
+
+def select_pipes(flow_m3_hr):
+    """Smallest standard pipe diameter (m) that keeps velocity at or below design, and the pipe count.
+
+    Flows beyond the largest standard pipe are split across the fewest
+    identical pipes in parallel; each pipe then carries flow / count.
+    """
+    flow_m3_s = np.asarray(flow_m3_hr, dtype=float) / 3600
+    largest_m3_s = np.pi * (STANDARD_PIPE_SIZES_MM[-1] / 1000) ** 2 / 4 * HYDRAULIC_PARAMS['design_velocity_m_s']
+    counts = np.maximum(np.ceil(flow_m3_s / largest_m3_s), 1)
+    min_diameter_mm = 1000 * (4 * flow_m3_s / counts / (np.pi * HYDRAULIC_PARAMS['design_velocity_m_s'])) ** 0.5
+    idx = np.minimum(np.searchsorted(STANDARD_PIPE_SIZES_MM, min_diameter_mm), len(STANDARD_PIPE_SIZES_MM) - 1)  # Rounding only
+    return STANDARD_PIPE_SIZES_MM[idx] / 1000, counts.astype(int)
+
+def calculate_pipe_headloss(flow_m3_hr, diameter_m, length_m, minor_k):
+    """Hazen-Williams friction plus minor losses (m), vectorized over flow."""
+    flow_m3_s = np.abs(np.asarray(flow_m3_hr, dtype=float)) / 3600
+    c = HYDRAULIC_PARAMS['hazen_williams_c']
+    friction = 10.67 * length_m * flow_m3_s ** 1.852 / (c ** 1.852 * diameter_m ** 4.87)
+    velocity = flow_m3_s / (np.pi * diameter_m ** 2 / 4)
+    return friction + minor_k * velocity ** 2 / (2 * HYDRAULIC_PARAMS['g'])
+
+def calculate_weir_head(flow_m3_hr, weir_length_m):
+    """Head over a sharp-crested rectangular weir (m)."""
+    flow_m3_s = np.asarray(flow_m3_hr, dtype=float) / 3600
+    return (flow_m3_s / (HYDRAULIC_PARAMS['weir_coefficient'] * weir_length_m)) ** (2 / 3)
+
+def pump_curve_head(pump, flow_m3_hr):
+    """Head (m) delivered by a catalog pump set, using a quadratic curve through shutoff and rated points."""
+    q_ratio = np.asarray(flow_m3_hr, dtype=float) / (pump['rated_flow_m3_hr'] * pump.get('count', 1))
+    return pump['shutoff_head_m'] - (pump['shutoff_head_m'] - pump['rated_head_m']) * q_ratio ** 2
+
+def solve_operating_point(pump, system_head, grid_points=256):
+    """Intersects the pump curve with a system curve (valve wide open).
+
+    Both curves are evaluated on one flow grid up to pump runout and the
+    crossing is linearly interpolated, so the system curve is called once.
+    """
+    runout = pump['rated_flow_m3_hr'] * pump.get('count', 1) * (pump['shutoff_head_m'] / (pump['shutoff_head_m'] - pump['rated_head_m'])) ** 0.5
+    q = np.linspace(0, runout, grid_points)
+    surplus = pump_curve_head(pump, q) - system_head(q)
+    if surplus[0] <= 0:
+        return 0.0, float(system_head(0.0))
+    i = min(int(np.argmax(surplus <= 0)) - 1, grid_points - 2) if (surplus <= 0).any() else grid_points - 2
+    q_op = q[i] + (q[i + 1] - q[i]) * surplus[i] / (surplus[i] - surplus[i + 1])
+    return float(q_op), float(system_head(q_op))
+
+def calculate_hydraulic_profile(inputs, sizing, flows_m3_hr):
+    """Water surface elevations (m above the effluent channel) through the treatment train.
+
+    Worked upstream from the effluent with pipe, weir and free-fall losses at
+    each unit outlet. `flows_m3_hr` may be any array shape (flow conditions, a
+    time series) and every elevation is returned in that shape.
+    """
+    flows = np.asarray(flows_m3_hr, dtype=float)
+    recycle_ratio = 0.75 if sizing['tech'] != 'MBBR' else 0
+    peak_flow_m3_hr = inputs['avg_flow_m3_day'] / 24 * FLOW_CONDITIONS['Peak'] * (1 + recycle_ratio)
+    pipe_diameter, pipe_count = select_pipes(peak_flow_m3_hr)
+    units = list(sizing['dimensions'].items())
+
+    profile = {}
+    wse = np.zeros_like(flows)
+    for i in range(len(units) - 1, -1, -1):
+        unit, dims = units[i]
+        # RAS returns from the separator, so only the last unit passes forward flow alone
+        unit_flow = flows if i == len(units) - 1 else flows * (1 + recycle_ratio)
+        if 'weir_lengths' in sizing:
+            weir_length = sizing['weir_lengths'][unit]
+        else:  # Runs stored before weir lengths were sized only have the rounded display dimensions
+            weir_length = max(np.pi * float(dims['Diameter (m)']) if 'Diameter (m)' in dims else float(dims.get('Width (m)', 0)),
+                              HYDRAULIC_PARAMS['min_weir_length_m'])
+        wse = wse + calculate_pipe_headloss(unit_flow / pipe_count, pipe_diameter, HYDRAULIC_PARAMS['connecting_pipe_length_m'], HYDRAULIC_PARAMS['connecting_pipe_minor_k']) \
+            + calculate_weir_head(unit_flow, weir_length) + HYDRAULIC_PARAMS['weir_free_fall_m']
+        profile[unit] = wse
+    return dict(reversed(list(profile.items())))
+
+def calculate_pump_system(design_flow_m3_hr, flows_m3_hr, static_head_m, downstream_head=None):
+    """Selects pipe, pump and control valve at the design flow and evaluates them at each flow.
+
+    The pump is chosen for the system head plus a design valve drop; at every
+    evaluated flow the valve absorbs the difference between pump and system
+    curves. Returns None when there is no flow to pump; when no catalog pump
+    reaches the design head, 'pump' is None and only design values are set.
+    """
+    if design_flow_m3_hr <= 0:
+        return None
+    psi_to_m = CONVERSION_FACTORS['pressure']['psi_to_m_water']
+    flows = np.asarray(flows_m3_hr, dtype=float)
+    diameter, pipe_count = select_pipes(design_flow_m3_hr)
+    diameter, pipe_count = float(diameter), int(pipe_count)
+
+    def system_head(q):
+        head = static_head_m + calculate_pipe_headloss(q / pipe_count, diameter, HYDRAULIC_PARAMS['pump_pipe_length_m'], HYDRAULIC_PARAMS['pump_pipe_minor_k'])
+        if downstream_head is not None:
+            head = head + downstream_head(q)
+        return head
+
+    design_system_head = float(system_head(design_flow_m3_hr))
+    design_tdh = design_system_head + HYDRAULIC_PARAMS['valve_design_drop_psi'] * psi_to_m
+    pump = select_pumps(design_flow_m3_hr, design_tdh)[0]
+    system = system_head(flows)
+    if pump is None:
+        design_valve_cv = float(calculate_valve_cv(design_flow_m3_hr, HYDRAULIC_PARAMS['valve_design_drop_psi']))
+        unknown = np.full_like(flows, np.nan)
+        return {
+            'pipe_diameter_m': diameter, 'pipe_count': pipe_count, 'pump': None, 'valve': select_valves(design_valve_cv)[0],
+            'design_tdh_m': design_tdh, 'design_valve_cv': design_valve_cv,
+            'operating_flow_m3_hr': np.nan, 'operating_head_m': np.nan,
+            'flows_m3_hr': flows, 'system_head_m': system, 'pump_head_m': unknown,
+            'valve_drop_psi': unknown, 'required_cv': unknown, 'valve_opening': unknown
+        }
+    design_valve_drop_psi = max(float(pump_curve_head(pump, design_flow_m3_hr)) - design_system_head, 0) / psi_to_m
+
+    pump_head = pump_curve_head(pump, flows)
+    deliverable = pump_head > system
+    valve_drop_psi = np.where(deliverable, pump_head - system, np.nan) / psi_to_m
+    required_cv = calculate_valve_cv(flows, valve_drop_psi)
+    valve = select_valves(np.nanmax(required_cv) if deliverable.any() else 0)[0]
+    operating_flow, operating_head = solve_operating_point(pump, system_head)
+
+    return {
+        'pipe_diameter_m': diameter, 'pipe_count': pipe_count, 'pump': pump, 'valve': valve,
+        'design_tdh_m': design_tdh,
+        'design_valve_cv': calculate_valve_cv(design_flow_m3_hr, design_valve_drop_psi) if design_valve_drop_psi > 0 else np.nan,
+        'operating_flow_m3_hr': operating_flow, 'operating_head_m': operating_head,
+        'flows_m3_hr': flows, 'system_head_m': system, 'pump_head_m': pump_head,
+        'valve_drop_psi': valve_drop_psi, 'required_cv': required_cv,
+        'valve_opening': required_cv / (valve['cv'] * valve['count'])
+    }
+
+def calculate_plant_hydraulics(inputs, sizing, ras_flow_m3_hr, was_flow_m3_hr, flow_factors=None):
+    """Hydraulic profile and EQ/RAS/WAS pump systems across flow conditions.
+
+    `flow_factors` are multipliers on average flow (defaults to FLOW_CONDITIONS)
+    and may be a whole time series. EQ and RAS follow the factor; WAS is
+    pumped at a constant rate.
+    """
+    if flow_factors is None:
+        flow_factors = np.array(list(FLOW_CONDITIONS.values()))
+    flow_factors = np.asarray(flow_factors, dtype=float)
+    avg_flow_m3_hr = inputs['avg_flow_m3_day'] / 24
+    eq_design_flow = sizing['eq']['peak_outflow_m3_hr'] if 'eq' in sizing else None
+    # The EQ basin holds back flow above its pump rate, so the train downstream sees at most that
+    eq_flows = avg_flow_m3_hr * flow_factors if eq_design_flow is None else np.minimum(avg_flow_m3_hr * flow_factors, eq_design_flow)
+    ras_flows = ras_flow_m3_hr * flow_factors
+    was_flows = np.full_like(flow_factors, was_flow_m3_hr)
+    static = HYDRAULIC_PARAMS['static_lift_m']
+
+    first_unit = next(iter(sizing['dimensions']))
+    head_of_train = lambda q: calculate_hydraulic_profile(inputs, sizing, q)[first_unit]
+    peak_factor = max(float(flow_factors.max()), FLOW_CONDITIONS['Peak'])
+
+    return {
+        'profile': calculate_hydraulic_profile(inputs, sizing, eq_flows),
+        'pumps': {
+            'EQ': calculate_pump_system(eq_design_flow or avg_flow_m3_hr * peak_factor, eq_flows, static['EQ'], head_of_train),
+            'RAS': calculate_pump_system(ras_flow_m3_hr * peak_factor, ras_flows, static['RAS']),
+            'WAS': calculate_pump_system(was_flow_m3_hr, was_flows, static['WAS'])
+        }
+    }
+
+def design_recycle_flows(inputs, sizing):
+    """Design RAS and WAS flows (m³/hr) from the noise-free design sludge production."""
+    if sizing['tech'] == 'MBBR':
+        return 0.0, 0.0
+    kinetic, _ = get_process_params(inputs)
+    targets = sizing['effluent_targets']
+    bod_removed_kg_day = (inputs['avg_bod'] - targets['bod']) * inputs['avg_flow_m3_day'] / 1000
+    tss_produced = kinetic['Y'] * bod_removed_kg_day / (1 + kinetic['kd'] * sizing.get('srt', 10)) * kinetic['TSS_VSS_ratio']
+    chemical_sludge = 0
+    if inputs['use_alum']:
+        chemical_sludge = max(targets['tp'] - chemical_dose_target('alum', sizing['tech']), 0) * inputs['avg_flow_m3_day'] / 1000 * 4.5
+    was_flow_m3d = (tss_produced + chemical_sludge) * 1000 / (0.8 * sizing.get('mlss', 3500))
+    return inputs['avg_flow_m3_day'] * 0.75 / 24, was_flow_m3d / 24
+
+def calculate_design_hydraulics(inputs, sizing):
+    """Design recycle flows and EQ/RAS/WAS pump design points, stored on the sizing like sizing['eq']."""
+    ras_flow_m3_hr, was_flow_m3_hr = design_recycle_flows(inputs, sizing)
+    pumps = calculate_plant_hydraulics(inputs, sizing, ras_flow_m3_hr, was_flow_m3_hr)['pumps']
+    return {
+        'ras_flow_m3_hr': ras_flow_m3_hr, 'was_flow_m3_hr': was_flow_m3_hr,
+        'pump_tdh_m': {name: float(system['design_tdh_m']) if system else 0 for name, system in pumps.items()},
+        'valve_cv': {name: float(system['design_valve_cv']) if system else 0 for name, system in pumps.items()}
+    }
+
+@functools.lru_cache(maxsize=1)
+def nitrification_design_curves():
+    """Steady-state nitrifier design curves on a dense temperature × SRT × safety-factor grid.
+
+    Computed once per process. Returns the grid axes plus minimum aerobic
+    SRT (T), design aerobic SRT (T × SF) and effluent NH3-N (T × SRT).
+    """
+    p = NITRIFICATION_PARAMS
+    grid = lambda start, stop, step: np.arange(start, stop + step / 2, step)
+    temps = grid(*p['temp_grid_c'])
+    srts = grid(*p['srt_grid_days'])
+    safety = grid(*p['safety_factor_grid'])
+
+    mu = p['mu_max_20'] * p['mu_theta'] ** (temps - 20) * p['design_do'] / (p['K_o'] + p['design_do'])
+    b = p['b_20'] * p['b_theta'] ** (temps - 20)
+    kn = p['Kn_20'] * p['Kn_theta'] ** (temps - 20)
+    srt_min = 1 / (mu - b)
+    design_srt = srt_min[:, None] * safety[None, :]
+
+    def effluent_nh3(srt, mu, b, kn):
+        growth = srt * (mu - b) - 1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Washout (growth <= 0) is reported as inf and capped by the caller at influent TKN
+            return np.where(growth > 0, kn * (1 + b * srt) / growth, np.inf)
+
+    return {
+        'temps': temps, 'srts': srts, 'safety': safety, 'srt_min': srt_min, 'design_srt': design_srt,
+        'effluent_nh3': effluent_nh3(srts[None, :], mu[:, None], b[:, None], kn[:, None])
+    }
+
+def grid_index(axis, values):
+    return np.clip(np.rint((np.asarray(values, dtype=float) - axis[0]) / (axis[1] - axis[0])).astype(int), 0, len(axis) - 1)
+
+def lookup_nitrification(temp_c, aerobic_srt_days, safety_factor=None):
+    """Minimum/design aerobic SRT and effluent NH3-N from the cached curves (nearest grid point)."""
+    curves = nitrification_design_curves()
+    safety_factor = NITRIFICATION_PARAMS['design_safety_factor'] if safety_factor is None else safety_factor
+    t = grid_index(curves['temps'], temp_c)
+    return {
+        'srt_min_days': curves['srt_min'][t],
+        'design_srt_days': curves['design_srt'][t, grid_index(curves['safety'], safety_factor)],
+        'effluent_nh3_mg_l': curves['effluent_nh3'][t, grid_index(curves['srts'], aerobic_srt_days)]
+    }
+
+def nitrification_tkn_floor(inputs, sizing):
+    """Lowest effluent TKN (mg/L) that suspended-growth nitrification supports at the design temperature.
+
+    Returns 0 for biofilm processes (IFAS, MBBR) and when no design
+    temperature is given.
+    """
+    if sizing['tech'] not in ['CAS', 'MBR'] or inputs.get('design_temp_c') is None:
+        return 0
+    aerobic_srt = sizing['srt'] * sizing['aerobic_volume'] / sizing['total_volume']
+    nh3 = lookup_nitrification(inputs['design_temp_c'], aerobic_srt)['effluent_nh3_mg_l']
+    return min(nh3 + NITRIFICATION_PARAMS['organic_n_mg_l'], inputs['avg_tkn'])
+
+def generate_eq_hydrographs(avg_flow_m3_day, storm_peak_factors, storm_time_to_peak_hr, days, step_minutes, n_diurnal=1, seed=None):
+    """Influent hydrographs (m³/hr), one row per diurnal pattern x storm peak x storm time-to-peak.
+
+    Storms use the gamma-shaped dimensionless unit hydrograph, scaled so the
+    storm alone adds (peak factor - 1) x average flow at its peak.
+    """
+    rng = np.random.default_rng(seed)
+    n_steps = int(days * 24 * 60 / step_minutes)
+    hours = np.arange(n_steps) * step_minutes / 60
+    diurnal = np.array([generate_influent_pattern(n_steps, step_minutes, rng)[0] for _ in range(n_diurnal)])
+    peaks, time_to_peak = (g.ravel() for g in np.meshgrid(np.atleast_1d(storm_peak_factors), np.atleast_1d(storm_time_to_peak_hr), indexing='ij'))
+
+    t = np.maximum(hours - EQ_PARAMS['storm_start_day'] * 24, 0)[None, :] / time_to_peak[:, None]
+    storm = (peaks[:, None] - 1) * (t * np.exp(1 - t)) ** EQ_PARAMS['unit_hydrograph_shape']
+    factors = diurnal[:, None, :] + storm[None, :, :]
+    return avg_flow_m3_day / 24 * factors.reshape(-1, n_steps)
+
+def trailing_mean(values, window_steps):
+    """Mean of the last `window_steps` samples along the last axis (shorter at the start)."""
+    cum = np.cumsum(values, axis=-1)
+    lagged = np.zeros_like(cum)
+    lagged[..., window_steps:] = cum[..., :-window_steps]
+    counts = np.minimum(np.arange(1, values.shape[-1] + 1), window_steps)
+    return (cum - lagged) / counts
+
+def route_eq_storage(inflow_m3_hr, outflow_setpoints_m3_hr, step_minutes, mode='Constant'):
+    """Mass-curve storage routing of each hydrograph for each outflow setpoint.
+
+    Storage is the cumulative net inflow above its running minimum, so the
+    basin empties whenever the pumps outrun inflow. 'Constant' pumps at the
+    setpoint; 'Flow-paced' pumps the trailing average inflow, capped at the
+    setpoint. Returns (hydrographs, setpoints) arrays.
+    """
+    inflow = np.atleast_2d(np.asarray(inflow_m3_hr, dtype=float))
+    setpoints = np.atleast_1d(np.asarray(outflow_setpoints_m3_hr, dtype=float))
+    dt_hr = step_minutes / 60
+    if mode == 'Flow-paced':
+        paced = trailing_mean(inflow, max(int(EQ_PARAMS['flow_paced_window_hr'] / dt_hr), 1))[:, None, :]
+
+    volume = np.empty((len(inflow), len(setpoints)))
+    peak_outflow = np.empty_like(volume)
+    # Route blocks of hydrographs x setpoints to bound the (hydrographs, setpoints, steps) working arrays
+    n_steps = inflow.shape[1]
+    row_block = max(EQ_PARAMS['max_routing_elements'] // n_steps, 1)
+    for rows in range(0, len(inflow), row_block):
+        rows = slice(rows, rows + row_block)
+        block_inflow = inflow[rows, None, :]
+        set_block = max(EQ_PARAMS['max_routing_elements'] // block_inflow.size, 1)
+        for cols in range(0, len(setpoints), set_block):
+            cols = slice(cols, cols + set_block)
+            chunk = setpoints[None, cols, None]
+            outflow = np.minimum(paced[rows], chunk) if mode == 'Flow-paced' else chunk
+            cumulative = np.cumsum((block_inflow - outflow) * dt_hr, axis=-1)
+            storage = cumulative - np.minimum(np.minimum.accumulate(cumulative, axis=-1), 0)
+            delivered = block_inflow - np.diff(storage, axis=-1, prepend=0) / dt_hr
+            volume[rows, cols] = storage.max(axis=-1)
+            peak_outflow[rows, cols] = delivered.max(axis=-1)
+    return {
+        'volume_m3': volume, 'peak_outflow_m3_hr': peak_outflow,
+        'attenuation_pct': (1 - peak_outflow / inflow.max(axis=-1, keepdims=True)) * 100
+    }
+
+def calculate_eq_sizing(inputs):
+    """EQ basin volume and pump rate for the design storm at the design outflow."""
+    hydrograph = generate_eq_hydrographs(inputs['avg_flow_m3_day'], FLOW_CONDITIONS['Peak'], EQ_PARAMS['design_time_to_peak_hr'],
+                                         EQ_PARAMS['design_days'], EQ_PARAMS['step_minutes'], seed=0)
+    design_outflow = inputs['avg_flow_m3_day'] / 24 * EQ_PARAMS['design_outflow_factor']
+    routed = route_eq_storage(hydrograph, design_outflow, EQ_PARAMS['step_minutes'])
+    storage = float(routed['volume_m3'][0, 0])
+    return {
+        'volume': storage * (1 + EQ_PARAMS['volume_allowance']),
+        'peak_inflow_m3_hr': float(hydrograph.max()),
+        'peak_outflow_m3_hr': float(routed['peak_outflow_m3_hr'][0, 0])
+    }
+
+def calculate_cas_sizing(inputs):
+    sizing = {'tech': 'CAS'}
+    sizing['srt'] = 10
+    if inputs.get('design_temp_c') is not None:
+        # Lengthen SRT in cold climates so the aerobic fraction still meets the nitrification design SRT
+        sizing['srt'] = max(sizing['srt'], lookup_nitrification(inputs['design_temp_c'], 0)['design_srt_days'] / 0.7)
+    sizing['mlss'] = 3500
+    effluent_bod = 10.0
+    kinetic, _ = get_process_params(inputs)
+    sizing['hrt'] = (sizing['srt'] * kinetic['Y'] * (inputs['avg_bod'] - effluent_bod)) / (sizing['mlss'] * (1 + kinetic['kd'] * sizing['srt'])) * 24
+    sizing['total_volume'] = inputs['avg_flow_m3_day'] * sizing['hrt'] / 24
+    sizing['anoxic_volume'] = sizing['total_volume'] * 0.3
+    sizing['aerobic_volume'] = sizing['total_volume'] * 0.7
+    sizing['clarifier_sor'] = 24
+    sizing['clarifier_area'] = inputs['avg_flow_m3_day'] / sizing['clarifier_sor']
+    sizing['dimensions'] = {
+        'Anoxic Basin': calculate_tank_dimensions(sizing['anoxic_volume']),
+        'Aerobic Basin': calculate_tank_dimensions(sizing['aerobic_volume']),
+        'Clarifier': calculate_tank_dimensions(sizing['clarifier_area'], shape='circ')
+    }
+    sizing['weir_lengths'] = {
+        'Anoxic Basin': calculate_weir_length(sizing['anoxic_volume']),
+        'Aerobic Basin': calculate_weir_length(sizing['aerobic_volume']),
+        'Clarifier': calculate_weir_length(sizing['clarifier_area'], shape='circ')
+    }
+    sizing['effluent_targets'] = {'bod': 10, 'tss': 12, 'tkn': 8, 'tp': 2.0}
+    sizing['eq'] = calculate_eq_sizing(inputs)
+    sizing['hydraulics'] = calculate_design_hydraulics(inputs, sizing)
+    return sizing
+
+def calculate_ifas_sizing(inputs):
+    sizing = {'tech': 'IFAS'}
+    sizing['srt'] = 8
+    sizing['mlss'] = 3000
+    sizing['hrt'] = 6
+    sizing['total_volume'] = inputs['avg_flow_m3_day'] * sizing['hrt'] / 24
+    sizing['anoxic_volume'] = sizing['total_volume'] * 0.3
+    sizing['aerobic_volume'] = sizing['total_volume'] * 0.7
+    sizing['media_volume'] = sizing['aerobic_volume'] * 0.4
+    sizing['clarifier_sor'] = 28
+    sizing['clarifier_area'] = inputs['avg_flow_m3_day'] / sizing['clarifier_sor']
+    sizing['dimensions'] = {
+        'Anoxic Basin': calculate_tank_dimensions(sizing['anoxic_volume']),
+        'IFAS Basin': calculate_tank_dimensions(sizing['aerobic_volume']),
+        'Clarifier': calculate_tank_dimensions(sizing['clarifier_area'], shape='circ')
+    }
+    sizing['weir_lengths'] = {
+        'Anoxic Basin': calculate_weir_length(sizing['anoxic_volume']),
+        'IFAS Basin': calculate_weir_length(sizing['aerobic_volume']),
+        'Clarifier': calculate_weir_length(sizing['clarifier_area'], shape='circ')
+    }
+    sizing['effluent_targets'] = {'bod': 8, 'tss': 10, 'tkn': 5, 'tp': 1.5}
+    sizing['eq'] = calculate_eq_sizing(inputs)
+    sizing['hydraulics'] = calculate_design_hydraulics(inputs, sizing)
+    return sizing
+
+def calculate_mbr_sizing(inputs):
+    sizing = {'tech': 'MBR'}
+    sizing['srt'] = 15
+    sizing['mlss'] = 8000
+    sizing['hrt'] = 5
+    sizing['total_volume'] = inputs['avg_flow_m3_day'] * sizing['hrt'] / 24
+    sizing['anoxic_volume'] = sizing['total_volume'] * 0.4
+    sizing['aerobic_volume'] = sizing['total_volume'] * 0.6
+    sizing['membrane_flux'] = 20
+    sizing['membrane_area'] = (inputs['avg_flow_m3_day'] * 1000 / 24) / sizing['membrane_flux']
+    sizing['dimensions'] = {
+        'Anoxic Tank': calculate_tank_dimensions(sizing['anoxic_volume']),
+        'MBR Tank': calculate_tank_dimensions(sizing['aerobic_volume'])
+    }
+    sizing['weir_lengths'] = {
+        'Anoxic Tank': calculate_weir_length(sizing['anoxic_volume']),
+        'MBR Tank': calculate_weir_length(sizing['aerobic_volume'])
+    }
+    sizing['effluent_targets'] = {'bod': 5, 'tss': 1, 'tkn': 4, 'tp': 1.0}
+    sizing['eq'] = calculate_eq_sizing(inputs)
+    sizing['hydraulics'] = calculate_design_hydraulics(inputs, sizing)
+    return sizing
+
+def calculate_mbbr_sizing(inputs):
+    sizing = {'tech': 'MBBR'}
+    sizing['hrt'] = 4
+    sizing['total_volume'] = inputs['avg_flow_m3_day'] * sizing['hrt'] / 24
+    sizing['aerobic_volume'] = sizing['total_volume']
+    sizing['media_volume'] = sizing['aerobic_volume'] * 0.5
+    sizing['dimensions'] = {
+        'MBBR Basin': calculate_tank_dimensions(sizing['aerobic_volume'])
+    }
+    sizing['weir_lengths'] = {'MBBR Basin': calculate_weir_length(sizing['aerobic_volume'])}
+    sizing['effluent_targets'] = {'bod': 15, 'tss': 20, 'tkn': 10, 'tp': 2.5}
+    sizing['eq'] = calculate_eq_sizing(inputs)
+    sizing['hydraulics'] = calculate_design_hydraulics(inputs, sizing)
+    return sizing
+
+def calculate_scrubber_sizing(inputs):
+    sizing = {'tech': 'Scrubber'}
+    ebrt_s = 30 # Empty Bed Residence Time in seconds
+    gas_velocity_m_s = 0.5
+    
+    air_flow_m3_s = inputs['air_flow_m3_hr'] / 3600
+    sizing['media_volume'] = air_flow_m3_s * ebrt_s
+    vessel_area = air_flow_m3_s / gas_velocity_m_s
+    vessel_diameter = (4 * vessel_area / np.pi) ** 0.5
+    media_height = sizing['media_volume'] / vessel_area
+    
+    sizing['dimensions'] = {
+        'Scrubber Vessel': calculate_tank_dimensions(vessel_area, shape='circ', depth=media_height)
+    }
+    sizing['recirculation_flow_m3_hr'] = inputs['air_flow_m3_hr'] * 0.01 # Heuristic
+    sizing['effluent_targets'] = {'removal_eff': 99.0}
+    return sizing
+
+def calculate_solids_sizing(inputs):
+    # Use CAS sludge production as basis for solids handling design
+    cas_sizing = calculate_cas_sizing(inputs)
+    cas_results = simulate_process(inputs, cas_sizing)
+    total_sludge_kg_day = cas_results['Total Sludge Production (kg TSS/day)']
+    
+    sizing = {'tech': 'Solids'}
+    # Thickener Sizing
+    gbt_loading_kg_hr_m = 500 # kg/hr/m
+    gbt_width_m = (total_sludge_kg_day / 24) / gbt_loading_kg_hr_m
+    sizing['gbt_width_m'] = gbt_width_m
+
+    # Anaerobic Digester Sizing
+    thickened_sludge_volume_m3_day = total_sludge_kg_day / (inputs['target_thickened_solids'] / 100 * 1000)
+    vs_loading_kg_day = total_sludge_kg_day * get_process_params(inputs)[0]['VSS_TSS_ratio']
+    vs_loading_rate_kg_m3_d = 2.4 # kg VS/m3/d
+    digester_volume = vs_loading_kg_day / vs_loading_rate_kg_m3_d
+    sizing['digester_volume'] = digester_volume
+    
+    sizing['dimensions'] = {
+        'Anaerobic Digester': calculate_tank_dimensions(digester_volume, shape='circ', depth=10)
+    }
+    sizing['effluent_targets'] = {
+        'cake_solids': inputs['target_cake_solids'],
+        'vsr': inputs['target_vsr']
+    }
+    return sizing
+
+def simulate_process(inputs, sizing, adjustments=None):
+    tech = sizing['tech']
+    kinetic, aeration = get_process_params(inputs)
+    
+    if tech == 'Scrubber':
+        results = {}
+        # H2S Removal
+        h2s_props = CONTAMINANT_PROPERTIES['H2S']
+        h2s_in_mg_m3 = inputs['h2s_in_ppm'] * (h2s_props['mw'] / 24.45)
+        h2s_loading_kg_day = (inputs['air_flow_m3_hr'] * 24 * h2s_in_mg_m3) / 1_000_000
+        
+        # NH3 Removal
+        nh3_props = CONTAMINANT_PROPERTIES['NH3']
+        nh3_in_mg_m3 = inputs['nh3_in_ppm'] * (nh3_props['mw'] / 24.45)
+        nh3_loading_kg_day = (inputs['air_flow_m3_hr'] * 24 * nh3_in_mg_m3) / 1_000_000
+        
+        design_removal_eff = sizing['effluent_targets']['removal_eff']
+        
+        if adjustments:
+            fan_factor = adjustments['fan_speed_slider'] / 100
+            acid_pump_factor = adjustments['acid_pump_slider'] / 100
+            caustic_pump_factor = adjustments['caustic_pump_slider'] / 100
+            
+            h2s_removal_eff = min(design_removal_eff * caustic_pump_factor * (1/fan_factor if fan_factor > 0 else 1), 99.9)
+            nh3_removal_eff = min(design_removal_eff * acid_pump_factor * (1/fan_factor if fan_factor > 0 else 1), 99.9)
+        else:
+            h2s_removal_eff = design_removal_eff
+            nh3_removal_eff = design_removal_eff
+        
+        # H2S Results
+        h2s_removed_kg_day = h2s_loading_kg_day * (h2s_removal_eff / 100)
+        results['Outlet H2S (ppm)'] = inputs['h2s_in_ppm'] * (1 - h2s_removal_eff / 100)
+        results['H2S Removal Efficiency (%)'] = h2s_removal_eff
+        
+        # NH3 Results
+        nh3_removed_kg_day = nh3_loading_kg_day * (nh3_removal_eff / 100)
+        results['Outlet NH3 (ppm)'] = inputs['nh3_in_ppm'] * (1 - nh3_removal_eff / 100)
+        results['NH3 Removal Efficiency (%)'] = nh3_removal_eff
+
+        # Caustic/Oxidation Chemical Consumption
+        caustic_chem_props = CHEMICAL_PROPERTIES[inputs['caustic_chemical']]
+        if inputs['caustic_chemical'] == 'Sodium Hydroxide':
+            caustic_stoich_ratio = CHEMICAL_FACTORS['naoh_to_h2s_ratio'] * (caustic_chem_props['mw'] / h2s_props['mw'])
+        else: # Sodium Hypochlorite
+            caustic_stoich_ratio = CHEMICAL_FACTORS['naocl_to_h2s_ratio'] * (caustic_chem_props['mw'] / h2s_props['mw'])
+        
+        pure_caustic_kg_day = h2s_removed_kg_day * caustic_stoich_ratio
+        solution_caustic_kg_day = pure_caustic_kg_day / (inputs['caustic_conc'] / 100)
+        solution_caustic_L_day = solution_caustic_kg_day / caustic_chem_props['density_kg_L']
+        
+        results[f"{inputs['caustic_chemical']} Consumption (kg/day)"] = solution_caustic_kg_day
+        results[f"{inputs['caustic_chemical']} Dosing Rate (L/day)"] = solution_caustic_L_day
+        results['Caustic Dosing Pump Capacity (L/hr)'] = (solution_caustic_L_day / 24) * 1.25
+
+        # Acid Chemical Consumption
+        acid_chem_props = CHEMICAL_PROPERTIES[inputs['acid_chemical']]
+        acid_stoich_ratio = CHEMICAL_FACTORS['h2so4_to_nh3_ratio'] * (acid_chem_props['mw'] / nh3_props['mw'])
+        pure_acid_kg_day = nh3_removed_kg_day * acid_stoich_ratio
+        solution_acid_kg_day = pure_acid_kg_day / (inputs['acid_conc'] / 100)
+        solution_acid_L_day = solution_acid_kg_day / acid_chem_props['density_kg_L']
+
+        results[f"{inputs['acid_chemical']} Consumption (kg/day)"] = solution_acid_kg_day
+        results[f"{inputs['acid_chemical']} Dosing Rate (L/day)"] = solution_acid_L_day
+        results['Acid Dosing Pump Capacity (L/hr)'] = (solution_acid_L_day / 24) * 1.25
+        
+        results['Recirculation Pump Flow (m³/hr)'] = sizing['recirculation_flow_m3_hr']
+        return results
+
+    if tech == 'Solids':
+        cas_sizing = calculate_cas_sizing(inputs)
+        cas_results = simulate_process(inputs, cas_sizing)
+        total_sludge_kg_day = cas_results['Total Sludge Production (kg TSS/day)']
+        
+        thickening_polymer_kg_day = (total_sludge_kg_day / 1000) * SOLIDS_PARAMS['polymer_dose_thickening_kg_ton']
+
+        vs_in_kg_day = total_sludge_kg_day * kinetic['VSS_TSS_ratio']
+        
+        vsr_eff = sizing['effluent_targets']['vsr']
+        if adjustments:
+            vsr_eff *= adjustments['digester_mixing_slider'] / 100
+
+        vs_destroyed_kg_day = vs_in_kg_day * (vsr_eff / 100)
+        biogas_m3_day = vs_destroyed_kg_day * SOLIDS_PARAMS['biogas_yield_m3_kg_vsr']
+        
+        digested_sludge_kg_day = total_sludge_kg_day - vs_destroyed_kg_day
+        
+        cake_solids_pct = sizing['effluent_targets']['cake_solids']
+        if adjustments:
+            cake_solids_pct *= adjustments['dewatering_polymer_slider'] / 100
+        
+        cake_solids_pct = min(cake_solids_pct, 40)
+        final_cake_kg_day = digested_sludge_kg_day / (cake_solids_pct / 100)
+        dewatering_polymer_kg_day = (digested_sludge_kg_day / 1000) * SOLIDS_PARAMS['polymer_dose_dewatering_kg_ton']
+
+        return {
+            "Biogas Production (m³/day)": biogas_m3_day,
+            "Methane Production (m³/day)": biogas_m3_day * (SOLIDS_PARAMS['methane_content_percent'] / 100),
+            "Volatile Solids Reduction (%)": vsr_eff,
+            "Dewatered Cake Production (kg/day)": final_cake_kg_day,
+            "Thickening Polymer Consumption (kg/day)": thickening_polymer_kg_day,
+            "Dewatering Polymer Consumption (kg/day)": dewatering_polymer_kg_day
+        }
+
+    # --- Wastewater Simulation ---
+    effluent_targets = sizing['effluent_targets']
+    effluent_tkn = effluent_targets['tkn'] + (np.random.random() - 0.5) * 1
+    effluent_tp = effluent_targets['tp'] + (np.random.random() - 0.5) * 0.2
+    methanol_dose_kg = 0
+    alum_dose_kg = 0
+
+    # Carbon addition cannot make up for incomplete nitrification, so it is only dosed down to this floor
+    tkn_floor = nitrification_tkn_floor(inputs, sizing)
+    if inputs['use_methanol']:
+        target_tkn = max(chemical_dose_target('carbon', sizing['tech']), tkn_floor)
+        n_to_remove = (effluent_tkn - target_tkn) * inputs['avg_flow_m3_day'] / 1000
+        if n_to_remove > 0:
+            methanol_dose_kg = n_to_remove * CHEMICAL_FACTORS['methanol_to_n_ratio']
+            effluent_tkn = target_tkn
+    effluent_tkn = max(effluent_tkn, tkn_floor)
+    
+    if inputs['use_alum']:
+        target_tp = chemical_dose_target('alum', sizing['tech'])
+        p_to_remove = (effluent_tp - target_tp) * inputs['avg_flow_m3_day'] / 1000
+        if p_to_remove > 0:
+            alum_dose_kg = p_to_remove * CHEMICAL_FACTORS['alum_to_p_ratio']
+            effluent_tp = target_tp
+            
+    effluent_bod = max(0, effluent_targets['bod'] + (np.random.random() - 0.5) * 3)
+    effluent_tss = max(0, effluent_targets['tss'] + (np.random.random() - 0.5) * 4)
+
+    bod_removed_kg_day = (inputs['avg_bod'] - effluent_bod) * inputs['avg_flow_m3_day'] / 1000
+    vss_produced = (kinetic['Y'] * bod_removed_kg_day) / (1 + kinetic['kd'] * sizing.get('srt', 10))
+    tss_produced = vss_produced * kinetic['TSS_VSS_ratio']
+    
+    p_removed_chemically_kg_day = alum_dose_kg / CHEMICAL_FACTORS['alum_to_p_ratio'] if alum_dose_kg > 0 else 0
+    chemical_sludge = p_removed_chemically_kg_day * 4.5
+    total_sludge = tss_produced + chemical_sludge
+
+    # Pumps are sized once per design; runs stored before that fall back to sizing them here
+    hydraulics = sizing['hydraulics'] if 'hydraulics' in sizing else calculate_design_hydraulics(inputs, sizing)
+    was_flow_m3d_design = (total_sludge * 1000) / (0.8 * sizing.get('mlss', 3500)) if sizing['tech'] != 'MBBR' else 0
+    ras_flow_m3d_design = hydraulics['ras_flow_m3_hr'] * 24
+    # Runs stored before EQ sizing existed fall back to the raw peaking factor
+    peak_flow_m3_hr_design = sizing['eq']['peak_outflow_m3_hr'] if 'eq' in sizing else inputs['avg_flow_m3_day'] * FLOW_CONDITIONS['Peak'] / 24
+
+    if adjustments:
+        current_mlss = adjustments.get('adj_mlss', sizing.get('mlss', 3500))
+        was_flow_m3d_design = (total_sludge * 1000) / (0.8 * current_mlss)
+        was_flow_m3d = was_flow_m3d_design * (adjustments['was_flow_slider'] / 100)
+        ras_flow_m3d = ras_flow_m3d_design * (adjustments['ras_flow_slider'] / 100)
+    else:
+        was_flow_m3d = was_flow_m3d_design
+        ras_flow_m3d = ras_flow_m3d_design
+
+    n_removed_bio_kg_day = (inputs['avg_tkn'] - effluent_tkn) * inputs['avg_flow_m3_day'] / 1000
+    
+    oxygen_demand_kg_day = (bod_removed_kg_day * aeration['O2_demand_BOD']) + (n_removed_bio_kg_day * aeration['O2_demand_N'])
+    required_air_m3_day_design = oxygen_demand_kg_day / (aeration['SOTE'] * aeration['O2_in_air_mass_fraction'] * aeration['air_density_kg_m3'])
+    
+    if adjustments:
+        required_air_m3_day = required_air_m3_day_design * (adjustments['air_flow_slider'] / 100)
+    else:
+        required_air_m3_day = required_air_m3_day_design
+
+    flow_conv_factor = (CONVERSION_FACTORS['flow'].get(f"{inputs['flow_unit_short']}_to_m3_day", 1) or 1)
+
+    valve_cv, pump_tdh = hydraulics['valve_cv'], hydraulics['pump_tdh_m']
+
+    return {
+        'Effluent BOD (mg/L)': effluent_bod, 'Effluent TSS (mg/L)': effluent_tss,
+        'Effluent TKN (mg/L)': effluent_tkn, 'Effluent TP (mg/L)': effluent_tp,
+        f'RAS Flow ({inputs["flow_unit_short"]})': ras_flow_m3d / flow_conv_factor,
+        f'WAS Flow ({inputs["flow_unit_short"]})': was_flow_m3d / flow_conv_factor,
+        'Alum Dose (kg/day)': alum_dose_kg, 'Carbon Source Dose (kg/day)': methanol_dose_kg,
+        'Total Sludge Production (kg TSS/day)': total_sludge,
+        'Required Airflow (m³/hr)': required_air_m3_day / 24,
+        'EQ Peak Pump Rate (m³/hr)': peak_flow_m3_hr_design,
+        'RAS Design Flow (m³/hr)': hydraulics['ras_flow_m3_hr'],
+        'WAS Design Flow (m³/hr)': hydraulics['was_flow_m3_hr'],
+        'EQ Pump TDH (m)': pump_tdh['EQ'],
+        'RAS Pump TDH (m)': pump_tdh['RAS'],
+        'WAS Pump TDH (m)': pump_tdh['WAS'],
+        'EQ Valve Cv': valve_cv['EQ'],
+        'RAS Valve Cv': valve_cv['RAS'],
+        'WAS Valve Cv': valve_cv['WAS']
+    }
+
+# ==============================================================================
+# --- Influent Pattern ---
+# ==============================================================================
+def generate_influent_pattern(n_steps, step_minutes, rng):
+    """Diurnal, weekly and seasonal multipliers on average flow and influent load."""
+    hours = np.arange(n_steps) * step_minutes / 60
+    diurnal = 1 + 0.35 * np.sin(2 * np.pi * (hours - 8) / 24) + 0.1 * np.sin(4 * np.pi * (hours - 5) / 24)
+    weekend = np.where((hours // 24) % 7 >= 5, 0.95, 1.0)
+    seasonal = 1 + 0.1 * np.sin(2 * np.pi * hours / 8760)
+    flow_factor = diurnal * weekend * seasonal * (1 + 0.05 * rng.standard_normal(n_steps))
+    load_factor = 1 + 0.15 * np.sin(2 * np.pi * (hours - 10) / 24) + 0.05 * rng.standard_normal(n_steps)
+    return np.clip(flow_factor, 0.2, None), np.clip(load_factor, 0.3, None)
+
+# ==============================================================================
+# --- Process Flow Diagram & Report ---
+# ==============================================================================
+def generate_pfd_dot(inputs, sizing, results):
+    """Generates a DOT string for the process flow diagram."""
+    tech = sizing['tech']
+    
+    if tech == 'Scrubber':
+        inlet_label = f"Inlet Air\\n{inputs['air_flow_m3_hr']:.0f} m³/hr\\n{inputs['h2s_in_ppm']} ppm H2S\\n{inputs['nh3_in_ppm']} ppm NH3"
+        outlet_label = f"Treated Air\\n{results['Outlet H2S (ppm)']:.1f} ppm H2S\\n{results['Outlet NH3 (ppm)']:.1f} ppm NH3"
+        acid_rate_key = f"{inputs['acid_chemical']} Dosing Rate (L/day)"
+        caustic_rate_key = f"{inputs['caustic_chemical']} Dosing Rate (L/day)"
+        dot = f"""
+        digraph G {{
+            rankdir=LR;
+            graph [fontname="Inter"];
+            node [shape=box, style="rounded,filled", fillcolor="#EBF4FF", fontname="Inter"];
+            edge [fontname="Inter", fontsize=10];
+            
+            InletAir [label="{inlet_label}"];
+            Scrubber [label="2-Stage Scrubber Vessel"];
+            TreatedAir [label="{outlet_label}"];
+            AcidChem [shape=oval, fillcolor="#D1FAE5", label="{inputs['acid_chemical']}\\n{results[acid_rate_key]:.1f} L/day"];
+            CausticChem [shape=oval, fillcolor="#FEF3C7", label="{inputs['caustic_chemical']}\\n{results[caustic_rate_key]:.1f} L/day"];
+            
+            InletAir -> Scrubber;
+            Scrubber -> TreatedAir;
+            AcidChem -> Scrubber;
+            CausticChem -> Scrubber;
+        }}
+        """
+        return dot
+    
+    if tech == 'Solids':
+        dot = f"""
+        digraph G {{
+            rankdir=LR;
+            graph [fontname="Inter"];
+            node [shape=box, style="rounded,filled", fillcolor="#EBF4FF", fontname="Inter"];
+            edge [fontname="Inter", fontsize=10];
+            
+            SludgeIn [label="Sludge from WWTP"];
+            Thickener [label="Sludge Thickener"];
+            Digester [label="Anaerobic Digester"];
+            Dewatering [label="Dewatering"];
+            Biosolids [label="Final Biosolids\\n{results['Dewatered Cake Production (kg/day)']:.0f} kg/day"];
+            Biogas [shape=oval, fillcolor="#FEF3C7", label="Biogas\\n{results['Biogas Production (m³/day)']:.0f} m³/day"];
+            ThickeningPolymer [shape=oval, fillcolor="#D1FAE5", label="Polymer\\n{results['Thickening Polymer Consumption (kg/day)']:.1f} kg/day"];
+            DewateringPolymer [shape=oval, fillcolor="#D1FAE5", label="Polymer\\n{results['Dewatering Polymer Consumption (kg/day)']:.1f} kg/day"];
+
+            SludgeIn -> Thickener;
+            Thickener -> Digester;
+            Digester -> Dewatering;
+            Dewatering -> Biosolids;
+            Digester -> Biogas;
+            ThickeningPolymer -> Thickener;
+            DewateringPolymer -> Dewatering;
+        }}
+        """
+        return dot
+
+    flow_unit_label = inputs['flow_unit_short']
+    influent_label = (f"Influent\\nQ={inputs['avg_flow_input']:.1f} {flow_unit_label}")
+    effluent_label = (f"Effluent\\nQ={inputs['avg_flow_input']:.1f} {flow_unit_label}")
+
+    dot = f"""
+    digraph G {{
+        rankdir=LR;
+        graph [fontname="Inter"];
+        node [shape=box, style="rounded,filled", fillcolor="#EBF4FF", fontname="Inter"];
+        edge [fontname="Inter", fontsize=10];
+        
+        Influent [label="{influent_label}"];
+    """
+    
+    process_train = "EQ -> Anoxic -> Aerobic;" if tech != 'MBBR' else "EQ -> Aerobic;"
+    
+    dot += f"""
+        subgraph cluster_main {{
+            label = "{tech.upper()} Process";
+            style=filled;
+            color=lightgrey;
+            {process_train}
+        }}
+    """
+    
+    separator = "Clarifier" if tech != 'MBR' else "Membrane Tank"
+    
+    if tech != 'MBBR':
+        ras_flow = results[f'RAS Flow ({flow_unit_label})']
+        was_flow = results[f'WAS Flow ({flow_unit_label})']
+        dot += f'Aerobic -> {separator};'
+        dot += f'{separator} -> Effluent [label="{effluent_label}"];'
+        dot += f'{separator} -> WAS [style=dashed, label="WAS\\n{was_flow:.2f} {flow_unit_label}"];'
+        dot += f'{separator} -> RAS [style=dashed]; RAS -> Anoxic [style=dashed, label="RAS\\n{ras_flow:.1f} {flow_unit_label}"];'
+    else:
+        dot += f'Aerobic -> {separator}; {separator} -> Effluent [label="{effluent_label}"];'
+
+    if inputs['use_alum'] and results['Alum Dose (kg/day)'] > 0:
+        alum_dose = results['Alum Dose (kg/day)']
+        dot += f'Alum [shape=oval, fillcolor="#FEF3C7", label="Alum Dose\\n{alum_dose:.1f} kg/d"]; Alum -> Aerobic;'
+    
+    if inputs['use_methanol'] and results['Carbon Source Dose (kg/day)'] > 0:
+        methanol_dose = results['Carbon Source Dose (kg/day)']
+        dot += f'Methanol [shape=oval, fillcolor="#D1FAE5", label="Carbon Dose\\n{methanol_dose:.1f} kg/d"]; Methanol -> Anoxic;'
+        
+    dot += f"Influent -> EQ [label=\"Q={inputs['avg_flow_input']:.1f} {flow_unit_label}\"];"
+    dot += "}}"
+    return dot
+
+def generate_detailed_pdf_report(inputs, sizing, results, appendix=None):
+    """Builds the design report PDF; `appendix` is an optional dict with title, header and rows."""
+    pdf = PDF()
+    pdf.add_page()
+
+    pdf.chapter_title("1. Influent Design Criteria")
+    criteria_data = {
+        f"Average Influent Flow": f"{inputs['avg_flow_input']:.2f} {inputs['flow_unit_short']}",
+        "Average Influent BOD": f"{inputs['avg_bod']} mg/L", "Average Influent TSS": f"{inputs['avg_tss']} mg/L",
+        "Average Influent TKN": f"{inputs['avg_tkn']} mg/L", "Average Influent TP": f"{inputs['avg_tp']} mg/L",
+    }
+    if sizing['tech'] == 'Scrubber':
+        criteria_data = {
+            "Airflow to Treat": f"{inputs['air_flow_m3_hr']:.0f} m³/hr",
+            "Inlet H2S Concentration": f"{inputs['h2s_in_ppm']} ppm",
+            "Inlet NH3 Concentration": f"{inputs['nh3_in_ppm']} ppm",
+            "Acid Stage Chemical": inputs['acid_chemical'],
+            "Acid Concentration": f"{inputs['acid_conc']} %",
+            "Caustic Stage Chemical": inputs['caustic_chemical'],
+            "Caustic Concentration": f"{inputs['caustic_conc']} %"
+        }
+    pdf.chapter_body(criteria_data)
+
+    pdf.chapter_title("2. Equipment Sizing and Dimensions")
+    sizing_header = ["Unit", "Parameter", "Value", "Units"]
+    sizing_data = []
+    if sizing['tech'] != 'Scrubber' and sizing['tech'] != 'Solids':
+        sizing_data.extend([
+            ["Equalization", "Basin Volume", f"{sizing['eq']['volume']:,.0f}" if 'eq' in sizing else "-", "m³"],
+            ["Equalization", "Peak Pump Rate", f"{results['EQ Peak Pump Rate (m³/hr)']:.1f}", "m³/hr"],
+            ["Equalization", "Control Valve Cv", f"{results['EQ Valve Cv']:.1f}", ""],
+            ["RAS", "Design Flow", f"{results['RAS Design Flow (m³/hr)']:.1f}", "m³/hr"],
+            ["RAS", "Control Valve Cv", f"{results['RAS Valve Cv']:.1f}", ""],
+            ["WAS", "Design Flow", f"{results['WAS Design Flow (m³/hr)']:.1f}", "m³/hr"],
+            ["WAS", "Control Valve Cv", f"{results['WAS Valve Cv']:.1f}", ""],
+        ])
+    if sizing['tech'] == 'Scrubber':
+        sizing_data.extend([
+            ["Acid Dosing Pump", "Capacity", f"{results['Acid Dosing Pump Capacity (L/hr)']:.2f}", "L/hr"],
+            ["Caustic Dosing Pump", "Capacity", f"{results['Caustic Dosing Pump Capacity (L/hr)']:.2f}", "L/hr"]
+        ])
+    if sizing['tech'] == 'Solids':
+        sizing_data.extend([
+            ["Thickener", "GBT Width", f"{sizing['gbt_width_m']:.1f}", "m"]
+        ])
+    for tank_name, dims in sizing['dimensions'].items():
+        vol_key = [k for k in sizing if tank_name.split(' ')[0].lower() in k and 'volume' in k]
+        if vol_key:
+            sizing_data.append([tank_name, "Volume", f"{sizing[vol_key[0]]:,.0f}", "m³"])
+        for dim_name, dim_val in dims.items():
+            sizing_data.append([tank_name, dim_name.split(' ')[0], dim_val, dim_name.split(' ')[1].replace('(', '').replace(')', '')])
+    pdf.create_table(sizing_header, sizing_data, col_widths=[45, 45, 45, 45])
+
+    pdf.chapter_title("3. Process Flow Diagram")
+    dot_string = generate_pfd_dot(inputs, sizing, results)
+    s = Source(dot_string, format="png")
+    
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_file:
+        s.render(os.path.splitext(tmp_file.name)[0], cleanup=True)
+        image_path = tmp_file.name
+    
+    pdf.image(image_path, x=10, w=pdf.w - 20)
+    os.remove(image_path)
+    
+    pdf.ln(5)
+
+    pdf.chapter_title("4. Performance & Operational Summary")
+    perf_header = ["Parameter", "Value", "Units"]
+    perf_data = []
+    for key, val in results.items():
+        if isinstance(val, (int, float)) and val > 0.01:
+            unit = key.split('(')[-1].replace(')', '') if '(' in key else 'kg/day'
+            param = key.split('(')[0].strip()
+            perf_data.append([param, f"{val:.2f}", unit])
+    pdf.create_table(perf_header, perf_data, col_widths=[90, 45, 45])
+
+    if appendix:
+        pdf.add_page()
+        pdf.chapter_title(f"5. Appendix - {appendix['title']}")
+        pdf.create_table(appendix['header'], appendix['rows'], col_widths=appendix.get('col_widths'))
+
+    return bytes(pdf.output())
@@ -0,0 +1,20 @@
+import importlib
+import logging
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def designer(tmp_path_factory):
+    """The Streamlit script imported in bare mode, with its run store in a temporary directory."""
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv('AQUAGENIUS_STORE_DIR', str(tmp_path_factory.mktemp('store')))
+        logging.disable(logging.WARNING)  # Bare-mode "missing ScriptRunContext" noise
+        try:
+            return importlib.import_module('wwtp_designer')
+        finally:
+            logging.disable(logging.NOTSET)
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+import process_design as pdz
+
+
+def test_npv_with_zero_discount_rate_is_undiscounted(designer):
+    opex = {'energy_kwh_yr': [0.0], 'chemicals_usd_yr': [1000.0], 'other_usd_yr': [500.0]}
+    npv = designer.calculate_npv([10_000.0], opex, [0.0], [1.0], [1.0], [20])
+    assert npv.shape == (1, 1, 1, 1, 1)
+    assert npv.item() == pytest.approx(10_000 + 1500 * 20)
+
+
+def test_npv_discounts_and_broadcasts_scenarios(designer):
+    opex = {'energy_kwh_yr': [1e6, 2e6], 'chemicals_usd_yr': [0.0, 0.0], 'other_usd_yr': [0.0, 0.0]}
+    npv = designer.calculate_npv([0.0, 0.0], opex, [0.0, 0.05], [1.0, 2.0], [1.0], [10, 20])
+    assert npv.shape == (2, 2, 2, 1, 2)
+    annual = 1e6 * designer.COST_PARAMS['unit_prices']['energy_usd_kwh']
+    assert npv[0, 1, 0, 0, 1] == pytest.approx(annual * (1 - 1.05 ** -20) / 0.05)
+    assert npv[1, 1, 1, 0, 1] == pytest.approx(4 * npv[0, 1, 0, 0, 1])
+
+
+@pytest.mark.parametrize('method', ['lttb_indices', 'minmax_indices'])
+def test_downsampling_empty_and_short_series(designer, method):
+    downsample = getattr(designer, method)
+    assert len(downsample(np.array([]), 100)) == 0
+    np.testing.assert_array_equal(downsample(np.arange(50.0), 100), np.arange(50))
+    np.testing.assert_array_equal(downsample(np.arange(100.0), 100), np.arange(100))
+
+
+def test_lttb_keeps_endpoints_and_budget(designer):
+    y = np.sin(np.linspace(0, 20, 10_001))
+    idx = designer.lttb_indices(y, 500)
+    assert len(idx) == 500 and idx[0] == 0 and idx[-1] == len(y) - 1
+    assert (np.diff(idx) > 0).all()
+
+
+def test_minmax_keeps_spikes_within_budget(designer):
+    y = np.zeros(10_000)
+    y[1234], y[8765] = 50, -50
+    idx = designer.minmax_indices(y, 200)
+    assert len(idx) <= 200 and {1234, 8765} <= set(idx)
+
+
+def test_input_hash_ignores_key_order(designer):
+    a = {'avg_bod': 250, 'avg_flow_m3_day': 10000.0}
+    assert designer.canonical_input_hash(a) == designer.canonical_input_hash(dict(reversed(list(a.items()))))
+    assert designer.canonical_input_hash(a) != designer.canonical_input_hash(dict(a, avg_bod=251))
+
+
+def test_input_hash_changes_with_model_version(designer, monkeypatch):
+    inputs = {'avg_bod': 250}
+    before = designer.canonical_input_hash(inputs)
+    monkeypatch.setitem(designer.RUN_STORE_PARAMS, 'model_version', designer.RUN_STORE_PARAMS['model_version'] + 1)
+    assert designer.canonical_input_hash(inputs) != before
+
+
+def test_trend_series_rejects_steps_over_limit(designer):
+    inputs = pdz.build_inputs({})
+    with pytest.raises(ValueError, match='step limit'):
+        designer.load_trend_series(None, 'cas', inputs, pdz.calculate_cas_sizing(inputs), 3650, 1)
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+import calibration
+
+TRUE_PARAMS = [0.6, 0.06, 1.3, 0.3]
+
+
+def plant_data(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    bod = rng.uniform(1000, 3000, n_rows)
+    data = {'bod_removed_kg_day': bod, 'srt_days': rng.uniform(5, 15, n_rows),
+            'o2_demand_kg_day': bod * 1.1 + 300, 'air_o2_kg_m3': 0.28}
+    sludge, airflow = calibration.predict(np.array([TRUE_PARAMS]), data)
+    return dict(data, sludge_kg_day=sludge[0], airflow_m3_hr=airflow[0],
+                sludge_scale=sludge.mean(), airflow_scale=airflow.mean())
+
+
+def test_calibration_recovers_identifiable_parameters():
+    result = calibration.calibrate(plant_data(50), [0.5, 0.08, 1.4, 0.25], n_starts=8, prior_weight=1e-4)
+    assert result['params']['kd'] == pytest.approx(0.06, rel=0.05)
+    assert result['params']['SOTE'] == pytest.approx(0.3, rel=0.01)
+    assert result['params']['Y'] * result['params']['TSS_VSS_ratio'] == pytest.approx(0.78, rel=0.01)
+
+
+def test_small_fits_stay_in_process(monkeypatch):
+    def no_pool(*args, **kwargs):
+        raise AssertionError("spawned a pool below POOL_MIN_START_ROWS")
+    monkeypatch.setattr(calibration, 'ProcessPoolExecutor', no_pool)
+    result = calibration.calibrate(plant_data(100), TRUE_PARAMS, n_starts=16, workers=4)
+    assert result['n_starts'] == 16
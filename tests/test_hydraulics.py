@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+import process_design as pdz
+from process_design import HYDRAULIC_PARAMS, STANDARD_PIPE_SIZES_MM, VALVE_CATALOG
+
+
+def test_select_pumps_tiny_flow_takes_smallest_pump():
+    [pump] = pdz.select_pumps(0.1, 5)
+    assert pump['model'] == 'CP-10-6' and pump['count'] == 1
+
+
+def test_select_pumps_splits_large_duty_across_parallel_pumps():
+    [pump] = pdz.select_pumps(20000, 10)
+    assert pump['count'] == 4
+    assert pump['rated_flow_m3_hr'] * pump['count'] >= 20000 and pump['rated_head_m'] >= 10
+
+
+def test_select_pumps_returns_none_beyond_catalog():
+    too_much_flow = 6400 * HYDRAULIC_PARAMS['max_parallel_pumps'] + 1
+    assert pdz.select_pumps([too_much_flow, 100], [10, 50]) == [None, None]
+
+
+def test_select_pumps_is_vectorized():
+    pumps = pdz.select_pumps([10, 100, 1000], 10)
+    assert [p['rated_flow_m3_hr'] for p in pumps] == [10, 100, 1600]
+
+
+@pytest.mark.parametrize('required_cv', [0, 100, 49600, 49601, 1e6])
+def test_select_valves_stay_within_max_opening(required_cv):
+    [valve] = pdz.select_valves(required_cv)
+    assert valve['cv'] * valve['count'] * HYDRAULIC_PARAMS['valve_max_opening'] >= required_cv
+    if valve['count'] > 1:
+        assert valve['cv'] == VALVE_CATALOG[-1]['cv'] or valve['count'] == pdz.select_valves(required_cv)[0]['count']
+
+
+def test_select_valves_tiny_duty_takes_smallest_valve():
+    assert pdz.select_valves(0)[0] == dict(VALVE_CATALOG[0], count=1)
+
+
+@pytest.mark.parametrize('flow_m3_hr', [0.01, 1, 500, 6000, 6200, 2_000_000 / 24 * 2.5 * 1.75])
+def test_select_pipes_keep_design_velocity(flow_m3_hr):
+    diameter, count = pdz.select_pipes(flow_m3_hr)
+    velocity = flow_m3_hr / 3600 / count / (np.pi * diameter ** 2 / 4)
+    assert velocity <= HYDRAULIC_PARAMS['design_velocity_m_s'] + 1e-9
+    assert diameter * 1000 in STANDARD_PIPE_SIZES_MM
+
+
+def test_select_pipes_only_parallel_beyond_largest_size():
+    diameters, counts = pdz.select_pipes([100, 6000, 6200])
+    assert list(counts) == [1, 1, 2]
+    assert diameters[1] == STANDARD_PIPE_SIZES_MM[-1] / 1000
+
+
+def test_weir_length_has_a_floor():
+    assert pdz.calculate_weir_length(0) == HYDRAULIC_PARAMS['min_weir_length_m']
+    assert pdz.calculate_weir_length(1e-6, shape='circ') == HYDRAULIC_PARAMS['min_weir_length_m']
+
+
+@pytest.mark.parametrize('flow', [0.1, 10_000, 2_000_000])
+@pytest.mark.parametrize('tech', ['cas', 'ifas', 'mbr', 'mbbr'])
+def test_pump_design_points_are_finite(flow, tech):
+    inputs = pdz.build_inputs({'avg_flow_input': flow})
+    results = pdz.simulate_process(inputs, getattr(pdz, f"calculate_{tech}_sizing")(inputs))
+    for name in ('EQ', 'RAS', 'WAS'):
+        assert np.isfinite(results[f"{name} Pump TDH (m)"])
+    assert results['EQ Pump TDH (m)'] < 50
@@ -0,0 +1,40 @@
+import pytest
+
+from process_design import PDF
+
+pymupdf = pytest.importorskip('pymupdf')
+
+HEADER = ['Timestamp', 'Flow (m3/hr)', 'Note']
+
+
+def render(rows, **kwargs):
+    pdf = PDF()
+    pdf.add_page()
+    pdf.create_table(HEADER, rows, **kwargs)
+    return pymupdf.open(stream=bytes(pdf.output()), filetype='pdf')
+
+
+def test_multi_page_table_repeats_header_and_keeps_text():
+    rows = ((f"2026-01-01 {i:05d}", f"{i * 1.5:,.1f}", f"row {i} (check) back\\slash") for i in range(300))
+    doc = render(rows, col_widths=[50, 40, 90])
+    pages = [page.get_text() for page in doc]
+    assert len(pages) > 3
+    for text in pages:
+        assert all(h in text for h in HEADER) and 'AquaGenius - WWTP Design Report' in text
+    text = ''.join(pages)
+    positions = [text.index(f"2026-01-01 {i:05d}") for i in range(300)]
+    assert positions == sorted(positions)
+    assert 'row 299 (check) back\\slash' in text
+
+
+def test_overlong_cells_are_truncated_with_ellipsis():
+    doc = render([('short', '1.0', 'x' * 500)])
+    text = doc[0].get_text()
+    assert 'x' * 20 + '...' in text and 'x' * 500 not in text
+
+
+def test_fitted_column_widths_span_the_page():
+    pdf = PDF()
+    widths = pdf.fit_column_widths(HEADER, [('2026-01-01 00:00', '10.0', 'a much longer note column')])
+    assert sum(widths) == pytest.approx(pdf.w - pdf.l_margin - pdf.r_margin)
+    assert widths[2] > widths[1]
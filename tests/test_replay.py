@@ -0,0 +1,57 @@
+import json
+import socket
+
+import pytest
+
+
+@pytest.fixture
+def replay(designer, tmp_path, monkeypatch):
+    monkeypatch.setitem(designer.REPLAY_PARAMS, 'data_dir', str(tmp_path))
+    monkeypatch.setitem(designer.REPLAY_PARAMS, 'max_read_bytes', 64)
+    return designer
+
+
+def new_state():
+    return {'offset': 0, 'header': None, 'sequence': 0, 'discarding': False, 'skipped_lines': 0}
+
+
+def line(i):
+    return json.dumps({'timestamp': i}) + '\n'
+
+
+def test_file_tail_skips_line_longer_than_read_limit(replay, tmp_path):
+    path = tmp_path / 'plant.jsonl'
+    path.write_text(line(1) + '{"x": "' + 'a' * 200 + '"}\n' + line(2))
+    state = new_state()
+    seen = []
+    for _ in range(10):
+        seen += replay.tail_plant_file('plant.jsonl', state)
+    assert [r['timestamp'] for r in seen] == [1, 2]
+    assert state['skipped_lines'] == 1 and state['offset'] == path.stat().st_size
+
+
+def test_file_tail_waits_for_end_of_oversized_line(replay, tmp_path):
+    path = tmp_path / 'plant.jsonl'
+    path.write_text('b' * 100)
+    state = new_state()
+    assert replay.tail_plant_file('plant.jsonl', state) == [] and state['discarding']
+    with path.open('a') as f:
+        f.write('b' * 10 + '\n' + line(3))
+    assert [r['timestamp'] for r in replay.tail_plant_file('plant.jsonl', state)] == [3]
+    assert state['skipped_lines'] == 1 and not state['discarding']
+
+
+def test_socket_drops_oversized_partial_line(replay):
+    server, client = socket.socketpair()
+    try:
+        state = dict(new_state(), socket=client)
+        client.settimeout(0.05)
+        server.sendall(('c' * 100).encode())
+        assert replay.read_plant_socket('unused', state) == []
+        assert state['partial'] == b'' and state['discarding']
+        server.sendall(b'ccc\n' + line(4).encode())
+        assert [r['timestamp'] for r in replay.read_plant_socket('unused', state)] == [4]
+        assert state['skipped_lines'] == 1
+    finally:
+        server.close()
+        client.close()
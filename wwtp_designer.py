@@ -1,12 +1,25 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-from fpdf import FPDF
-from fpdf.enums import XPos, YPos
-from graphviz import Source
-import io
+import contextlib
 import os
-import tempfile
+import csv
+import json
+import socket
+import ipaddress
+import sqlite3
+import hashlib
+import datetime
+from concurrent.futures.process import BrokenProcessPool
+import calibration
+import process_design
+from process_design import (
+    CONVERSION_FACTORS, KINETIC_PARAMS, AERATION_PARAMS, NITRIFICATION_PARAMS, FLOW_CONDITIONS, EQ_PARAMS,
+    DOSING_CONTROL_PARAMS, FLOW_UNITS, DEFAULT_INPUTS, get_process_params, chemical_dose_target,
+    calculate_plant_hydraulics, nitrification_design_curves, grid_index, lookup_nitrification,
+    nitrification_tkn_floor, generate_eq_hydrographs, route_eq_storage, simulate_process,
+    generate_influent_pattern, generate_pfd_dot, generate_detailed_pdf_report
+)
 
 # ==============================================================================
 # --- Page Configuration & Styling ---
@@ -44,46 +57,61 @@ st.markdown("""
 # ==============================================================================
 # --- Engineering Constants & Conversion Factors ---
 # ==============================================================================
-CONVERSION_FACTORS = {
-    'flow': {'MGD_to_m3_day': 3785.41, 'MLD_to_m3_day': 1000, 'm3_hr_to_gpm': 4.40287},
-    'volume': {'m3_to_gal': 264.172},
-    'area': {'m2_to_ft2': 10.7639},
-    'sor': {'m3_m2_day_to_gpd_ft2': 24.54},
-    'pressure': {'psi_to_pa': 6894.76}
+COST_PARAMS = {
+    'capex': {
+        'basin_usd_m3': 900, 'clarifier_usd_m2': 1800, 'membrane_usd_m2': 60,
+        'media_usd_m3': 750, 'digester_usd_m3': 1100, 'gbt_usd_m': 350000,
+        'scrubber_media_usd_m3': 2500
+    },
+    'unit_prices': {
+        'energy_usd_kwh': 0.12, 'alum_usd_kg': 0.35, 'carbon_usd_kg': 0.45, 'polymer_usd_kg': 3.5,
+        'Sodium Hydroxide_usd_kg': 0.6, 'Sodium Hypochlorite_usd_kg': 0.4, 'Sulfuric Acid_usd_kg': 0.2,
+        'sludge_disposal_usd_wet_tonne': 60
+    },
+    'blower_specific_energy_kwh_m3': 0.02, 'pump_efficiency': 0.7,
+    'mbr_scour_air_m3_m2_hr': 0.3, 'membrane_life_years': 10,
+    'maintenance_fraction_of_capex': 0.015
 }
 
-KINETIC_PARAMS = {
-    'Y': 0.6, 'kd': 0.06, 'fd': 0.15, 'TSS_VSS_ratio': 1.25, 'VSS_TSS_ratio': 0.8
+# Base-case economic scenario and the ranges offered for scenario sweeps
+NPV_DEFAULTS = {
+    'discount_rate': 0.05, 'energy_multiplier': 1.0, 'chemical_multiplier': 1.0, 'lifetime_years': 20
 }
 
-AERATION_PARAMS = {
-    'O2_demand_BOD': 1.5, 'O2_demand_N': 4.57, 'SOTE': 0.30,
-    'O2_in_air_mass_fraction': 0.232, 'air_density_kg_m3': 1.225
+TREND_PARAMS = {
+    'default_days': 365, 'step_minutes_options': [1, 5, 15, 60], 'default_step_minutes': 15,
+    'max_points_options': [500, 1000, 2000, 5000], 'default_max_points': 2000,
+    'max_steps': 1_051_200  # 10 years at 5 minutes; ~60 MB per stored series
 }
 
-CHEMICAL_FACTORS = {
-    'alum_to_p_ratio': 9.7, 'methanol_to_n_ratio': 2.86,
-    'naoh_to_h2s_ratio': 2.5,
-    'naocl_to_h2s_ratio': 4.5,
-    'h2so4_to_nh3_ratio': 0.6
+# Column order of stored simulation time series
+TREND_FIELDS = [
+    'Influent Flow (m³/hr)', 'Required Airflow (m³/hr)', 'Effluent BOD (mg/L)', 'Effluent TSS (mg/L)',
+    'Effluent TKN (mg/L)', 'Effluent TP (mg/L)', 'Total Sludge Production (kg TSS/day)'
+]
+
+REPLAY_PARAMS = {
+    'buffer_capacity': 2880,  # 30 days of 15-minute readings
+    'socket_timeout_s': 0.2, 'max_read_bytes': 1_048_576,
+    'data_dir': os.environ.get('AQUAGENIUS_REPLAY_DIR', 'plant_data')  # Replay files are only read from here
 }
 
-CHEMICAL_PROPERTIES = {
-    'Sodium Hydroxide': {'mw': 40.0, 'density_kg_L': 1.52},
-    'Sodium Hypochlorite': {'mw': 74.44, 'density_kg_L': 1.21},
-    'Sulfuric Acid': {'mw': 98.07, 'density_kg_L': 1.84}
+RUN_STORE_PARAMS = {
+    'directory': os.environ.get('AQUAGENIUS_STORE_DIR', 'aquagenius_store'),
+    'history_limit': 500,
+    'max_array_bytes': 2 * 1024 ** 3,  # Least recently used .npy arrays are deleted beyond this
+    'model_version': 5  # Part of the input hash; bump whenever a calculation change alters results for the same inputs
 }
 
-CONTAMINANT_PROPERTIES = {
-    'H2S': {'mw': 34.08},
-    'NH3': {'mw': 17.03}
+# Plant data column -> simulation input key (Flow is in the selected unit system)
+REPLAY_INFLUENT_FIELDS = {
+    'Flow': 'avg_flow_m3_day', 'BOD': 'avg_bod', 'TSS': 'avg_tss', 'TKN': 'avg_tkn', 'TP': 'avg_tp'
 }
 
-SOLIDS_PARAMS = {
-    'biogas_yield_m3_kg_vsr': 0.5,
-    'methane_content_percent': 65,
-    'polymer_dose_thickening_kg_ton': 4,
-    'polymer_dose_dewatering_kg_ton': 8
+# Plant data column -> simulate_process result key
+REPLAY_EFFLUENT_FIELDS = {
+    'Eff_BOD': 'Effluent BOD (mg/L)', 'Eff_TSS': 'Effluent TSS (mg/L)',
+    'Eff_TKN': 'Effluent TKN (mg/L)', 'Eff_TP': 'Effluent TP (mg/L)'
 }
 # ==============================================================================
 # --- Session State Initialization ---
@@ -92,6 +120,12 @@ if 'simulation_data' not in st.session_state:
     st.session_state.simulation_data = None
 if 'rerun_results' not in st.session_state:
     st.session_state.rerun_results = {}
+if 'rerun_adjustments' not in st.session_state:
+    st.session_state.rerun_adjustments = {}
+if 'replay_state' not in st.session_state:
+    st.session_state.replay_state = {}
+if 'calibration' not in st.session_state:
+    st.session_state.calibration = None
 
 
 # ==============================================================================
@@ -121,7 +155,8 @@ TP,7
 
     # --- Initialize default values ---
     default_values = {
-        'Flow': 10000.0, 'BOD': 250, 'TSS': 220, 'TKN': 40, 'TP': 7
+        'Flow': DEFAULT_INPUTS['avg_flow_input'], 'BOD': DEFAULT_INPUTS['avg_bod'], 'TSS': DEFAULT_INPUTS['avg_tss'],
+        'TKN': DEFAULT_INPUTS['avg_tkn'], 'TP': DEFAULT_INPUTS['avg_tp']
     }
 
     # --- Read from CSV if uploaded ---
@@ -136,9 +171,11 @@ TP,7
         except Exception as e:
             st.error(f"Error reading CSV file: {e}")
     
+    plant_name = st.text_input("Plant Name", value=str(default_values.get('Plant', DEFAULT_INPUTS['plant_name'])))
+
     flow_unit_name = st.selectbox(
         "Unit System",
-        ('Metric (m³/day)', 'US Customary (MGD)', 'SI (MLD)'),
+        tuple(FLOW_UNITS.values()),
         key='flow_unit_select'
     )
 
@@ -155,25 +192,26 @@ TP,7
     avg_tss = st.number_input("Average Influent TSS (mg/L)", 50, value=int(default_values['TSS']), step=10)
     avg_tkn = st.number_input("Average Influent TKN (mg/L)", 10, value=int(default_values['TKN']), step=5)
     avg_tp = st.number_input("Average Influent TP (mg/L)", 1, value=int(default_values['TP']), step=1)
+    design_temp_c = st.number_input("Design Minimum Temperature (°C)", 0.0, 35.0, value=float(default_values.get('Temperature', DEFAULT_INPUTS['design_temp_c'])), step=0.5)
 
     st.markdown("---")
     st.header("💨 Air Treatment Criteria")
-    air_flow_m3_hr = st.number_input("Airflow to Treat (m³/hr)", min_value=100.0, value=5000.0, step=100.0)
-    h2s_in_ppm = st.number_input("Inlet H2S Concentration (ppm)", min_value=0, value=50, step=5)
-    nh3_in_ppm = st.number_input("Inlet NH3 Concentration (ppm)", min_value=0, value=20, step=5)
+    air_flow_m3_hr = st.number_input("Airflow to Treat (m³/hr)", min_value=100.0, value=DEFAULT_INPUTS['air_flow_m3_hr'], step=100.0)
+    h2s_in_ppm = st.number_input("Inlet H2S Concentration (ppm)", min_value=0, value=DEFAULT_INPUTS['h2s_in_ppm'], step=5)
+    nh3_in_ppm = st.number_input("Inlet NH3 Concentration (ppm)", min_value=0, value=DEFAULT_INPUTS['nh3_in_ppm'], step=5)
     
     st.subheader("Chemical Selection")
     acid_chemical = st.selectbox("Acid Stage Chemical (for NH3)", ['Sulfuric Acid'])
-    acid_conc = st.number_input("Acid Concentration (%)", min_value=1.0, value=93.0, step=0.5)
+    acid_conc = st.number_input("Acid Concentration (%)", min_value=1.0, value=DEFAULT_INPUTS['acid_conc'], step=0.5)
     
     caustic_chemical = st.selectbox("Caustic/Oxidation Stage Chemical (for H2S)", ['Sodium Hydroxide', 'Sodium Hypochlorite'])
-    caustic_conc = st.number_input("Caustic/Oxidation Conc. (%)", min_value=1.0, value=12.5, step=0.5)
+    caustic_conc = st.number_input("Caustic/Oxidation Conc. (%)", min_value=1.0, value=DEFAULT_INPUTS['caustic_conc'], step=0.5)
 
     st.markdown("---")
     st.header("🧱 Solids Handling Criteria")
-    target_thickened_solids = st.slider("Target Thickened Solids (%)", 2, 8, 4, 1)
-    target_cake_solids = st.slider("Target Dewatering Cake Solids (%)", 15, 35, 25, 1)
-    target_vsr = st.slider("Target Digester VSR (%)", 40, 70, 55, 1)
+    target_thickened_solids = st.slider("Target Thickened Solids (%)", 2, 8, DEFAULT_INPUTS['target_thickened_solids'], 1)
+    target_cake_solids = st.slider("Target Dewatering Cake Solids (%)", 15, 35, DEFAULT_INPUTS['target_cake_solids'], 1)
+    target_vsr = st.slider("Target Digester VSR (%)", 40, 70, DEFAULT_INPUTS['target_vsr'], 1)
 
 
     st.markdown("---")
@@ -181,56 +219,12 @@ TP,7
     use_alum = st.checkbox("Use Alum for P Removal")
     use_methanol = st.checkbox("Use Carbon Source for N Removal")
 
-    run_button = st.button("Generate Design & Simulate", use_container_width=True)
+    st.markdown("---")
+    st.header("🔬 Kinetic Calibration")
+    use_calibration = st.checkbox("Use Calibrated Kinetic Parameters", disabled=st.session_state.calibration is None)
 
-# ==============================================================================
-# --- PDF Generation Class ---
-# ==============================================================================
-class PDF(FPDF):
-    def header(self):
-        self.set_font('Arial', 'B', 12)
-        self.cell(0, 10, 'AquaGenius - WWTP Design Report', border=0, ln=1, align='C')
-        self.ln(5)
-
-    def footer(self):
-        self.set_y(-15)
-        self.set_font('Arial', 'I', 8)
-        self.cell(0, 10, f'Page {self.page_no()}', border=0, ln=0, align='C')
-
-    def chapter_title(self, title):
-        self.set_font('Arial', 'B', 12)
-        self.cell(0, 6, title, border=0, ln=1, align='L')
-        self.ln(4)
-
-    def chapter_body(self, data):
-        self.set_font('Arial', '', 10)
-        key_width = 70
-        value_width = self.w - self.r_margin - self.l_margin - key_width
-        
-        for k, v in data.items():
-            self.set_font('Arial', 'B', 10)
-            self.cell(key_width, 5, f"- {k}:", align='L')
-            self.set_font('Arial', '', 10)
-            self.multi_cell(value_width, 5, str(v), align='L')
-            
-        self.ln()
-
-    def create_table(self, header, data, col_widths):
-        self.set_font('Arial', 'B', 9)
-        self.set_fill_color(220, 220, 220)
-        for i, h in enumerate(header):
-            self.cell(col_widths[i], 7, h, border=1, ln=0, align='C', fill=1)
-        self.ln()
-        self.set_font('Arial', '', 9)
-        for row in data:
-            for i, item in enumerate(row):
-                self.cell(col_widths[i], 6, str(item), border=1, ln=0)
-            self.ln()
-        self.ln(5)
+    run_button = st.button("Generate Design & Simulate", use_container_width=True)
 
-# ==============================================================================
-# --- Core Logic Functions ---
-# ==============================================================================
 def get_inputs():
     """Gathers and processes all inputs from the sidebar."""
     if 'MGD' in flow_unit_name:
@@ -243,509 +237,791 @@ def get_inputs():
         avg_flow_m3_day = avg_flow_input
         flow_unit_short = 'm³/day'
 
-    return {
+    inputs = {
         'flow_unit_name': flow_unit_name, 'flow_unit_short': flow_unit_short,
         'avg_flow_input': avg_flow_input, 'avg_flow_m3_day': avg_flow_m3_day,
         'avg_bod': avg_bod, 'avg_tss': avg_tss, 'avg_tkn': avg_tkn, 'avg_tp': avg_tp,
+        'design_temp_c': design_temp_c,
         'air_flow_m3_hr': air_flow_m3_hr, 'h2s_in_ppm': h2s_in_ppm, 'nh3_in_ppm': nh3_in_ppm,
         'acid_chemical': acid_chemical, 'acid_conc': acid_conc,
         'caustic_chemical': caustic_chemical, 'caustic_conc': caustic_conc,
         'target_thickened_solids': target_thickened_solids,
         'target_cake_solids': target_cake_solids, 'target_vsr': target_vsr,
         'use_alum': use_alum, 'use_methanol': use_methanol,
+        'plant_name': plant_name,
     }
+    # Only present when used, so uncalibrated inputs keep their run-store hash
+    if use_calibration and st.session_state.calibration:
+        inputs['calibrated_params'] = st.session_state.calibration['params']
+    return inputs
 
-def calculate_tank_dimensions(volume, shape='rect', depth=4.5):
-    """Calculates tank dimensions based on volume or area."""
-    if volume <= 0: return {}
-    if shape == 'rect':
-        area = volume / depth
-        width = (area / 3) ** 0.5 if area > 0 else 0
-        length = 3 * width
-        return {'Length (m)': f"{length:.1f}", 'Width (m)': f"{width:.1f}", 'Depth (m)': f"{depth:.1f}"}
-    elif shape == 'circ':
-        diameter = (4 * volume / np.pi) ** 0.5
-        return {'Diameter (m)': f"{diameter:.1f}", 'SWD (m)': f"{depth:.1f}"}
-    return {}
-
-def calculate_valve_cv(flow_m3_hr, delta_p_psi=5):
-    """Calculates a required valve Cv."""
-    flow_gpm = flow_m3_hr * CONVERSION_FACTORS['flow']['m3_hr_to_gpm']
-    cv = flow_gpm * (1 / delta_p_psi) ** 0.5
-    return cv
-
-def calculate_cas_sizing(inputs):
-    sizing = {'tech': 'CAS'}
-    sizing['srt'] = 10
-    sizing['mlss'] = 3500
-    effluent_bod = 10.0
-    sizing['hrt'] = (sizing['srt'] * KINETIC_PARAMS['Y'] * (inputs['avg_bod'] - effluent_bod)) / (sizing['mlss'] * (1 + KINETIC_PARAMS['kd'] * sizing['srt'])) * 24
-    sizing['total_volume'] = inputs['avg_flow_m3_day'] * sizing['hrt'] / 24
-    sizing['anoxic_volume'] = sizing['total_volume'] * 0.3
-    sizing['aerobic_volume'] = sizing['total_volume'] * 0.7
-    sizing['clarifier_sor'] = 24
-    sizing['clarifier_area'] = inputs['avg_flow_m3_day'] / sizing['clarifier_sor']
-    sizing['dimensions'] = {
-        'Anoxic Basin': calculate_tank_dimensions(sizing['anoxic_volume']),
-        'Aerobic Basin': calculate_tank_dimensions(sizing['aerobic_volume']),
-        'Clarifier': calculate_tank_dimensions(sizing['clarifier_area'], shape='circ')
-    }
-    sizing['effluent_targets'] = {'bod': 10, 'tss': 12, 'tkn': 8, 'tp': 2.0}
-    return sizing
-
-def calculate_ifas_sizing(inputs):
-    sizing = {'tech': 'IFAS'}
-    sizing['srt'] = 8
-    sizing['mlss'] = 3000
-    sizing['hrt'] = 6
-    sizing['total_volume'] = inputs['avg_flow_m3_day'] * sizing['hrt'] / 24
-    sizing['anoxic_volume'] = sizing['total_volume'] * 0.3
-    sizing['aerobic_volume'] = sizing['total_volume'] * 0.7
-    sizing['media_volume'] = sizing['aerobic_volume'] * 0.4
-    sizing['clarifier_sor'] = 28
-    sizing['clarifier_area'] = inputs['avg_flow_m3_day'] / sizing['clarifier_sor']
-    sizing['dimensions'] = {
-        'Anoxic Basin': calculate_tank_dimensions(sizing['anoxic_volume']),
-        'IFAS Basin': calculate_tank_dimensions(sizing['aerobic_volume']),
-        'Clarifier': calculate_tank_dimensions(sizing['clarifier_area'], shape='circ')
-    }
-    sizing['effluent_targets'] = {'bod': 8, 'tss': 10, 'tkn': 5, 'tp': 1.5}
-    return sizing
-
-def calculate_mbr_sizing(inputs):
-    sizing = {'tech': 'MBR'}
-    sizing['srt'] = 15
-    sizing['mlss'] = 8000
-    sizing['hrt'] = 5
-    sizing['total_volume'] = inputs['avg_flow_m3_day'] * sizing['hrt'] / 24
-    sizing['anoxic_volume'] = sizing['total_volume'] * 0.4
-    sizing['aerobic_volume'] = sizing['total_volume'] * 0.6
-    sizing['membrane_flux'] = 20
-    sizing['membrane_area'] = (inputs['avg_flow_m3_day'] * 1000 / 24) / sizing['membrane_flux']
-    sizing['dimensions'] = {
-        'Anoxic Tank': calculate_tank_dimensions(sizing['anoxic_volume']),
-        'MBR Tank': calculate_tank_dimensions(sizing['aerobic_volume'])
-    }
-    sizing['effluent_targets'] = {'bod': 5, 'tss': 1, 'tkn': 4, 'tp': 1.0}
-    return sizing
-
-def calculate_mbbr_sizing(inputs):
-    sizing = {'tech': 'MBBR'}
-    sizing['hrt'] = 4
-    sizing['total_volume'] = inputs['avg_flow_m3_day'] * sizing['hrt'] / 24
-    sizing['aerobic_volume'] = sizing['total_volume']
-    sizing['media_volume'] = sizing['aerobic_volume'] * 0.5
-    sizing['dimensions'] = {
-        'MBBR Basin': calculate_tank_dimensions(sizing['aerobic_volume'])
-    }
-    sizing['effluent_targets'] = {'bod': 15, 'tss': 20, 'tkn': 10, 'tp': 2.5}
-    return sizing
+# ==============================================================================
+# --- Time-Series Simulation & Trend Downsampling ---
+# ==============================================================================
+def simulate_process_timeseries(inputs, sizing, n_steps, step_minutes, seed=None):
+    """Vectorized time-series counterpart of the wastewater branch of simulate_process.
 
-def calculate_scrubber_sizing(inputs):
-    sizing = {'tech': 'Scrubber'}
-    ebrt_s = 30 # Empty Bed Residence Time in seconds
-    gas_velocity_m_s = 0.5
-    
-    air_flow_m3_s = inputs['air_flow_m3_hr'] / 3600
-    sizing['media_volume'] = air_flow_m3_s * ebrt_s
-    vessel_area = air_flow_m3_s / gas_velocity_m_s
-    vessel_diameter = (4 * vessel_area / np.pi) ** 0.5
-    media_height = sizing['media_volume'] / vessel_area
-    
-    sizing['dimensions'] = {
-        'Scrubber Vessel': calculate_tank_dimensions(vessel_area, shape='circ', depth=media_height)
-    }
-    sizing['recirculation_flow_m3_hr'] = inputs['air_flow_m3_hr'] * 0.01 # Heuristic
-    sizing['effluent_targets'] = {'removal_eff': 99.0}
-    return sizing
-
-def calculate_solids_sizing(inputs):
-    # Use CAS sludge production as basis for solids handling design
-    cas_sizing = calculate_cas_sizing(inputs)
-    cas_results = simulate_process(inputs, cas_sizing)
-    total_sludge_kg_day = cas_results['Total Sludge Production (kg TSS/day)']
-    
-    sizing = {'tech': 'Solids'}
-    # Thickener Sizing
-    gbt_loading_kg_hr_m = 500 # kg/hr/m
-    gbt_width_m = (total_sludge_kg_day / 24) / gbt_loading_kg_hr_m
-    sizing['gbt_width_m'] = gbt_width_m
-
-    # Anaerobic Digester Sizing
-    thickened_sludge_volume_m3_day = total_sludge_kg_day / (inputs['target_thickened_solids'] / 100 * 1000)
-    vs_loading_kg_day = total_sludge_kg_day * KINETIC_PARAMS['VSS_TSS_ratio']
-    vs_loading_rate_kg_m3_d = 2.4 # kg VS/m3/d
-    digester_volume = vs_loading_kg_day / vs_loading_rate_kg_m3_d
-    
-    sizing['dimensions'] = {
-        'Anaerobic Digester': calculate_tank_dimensions(digester_volume, shape='circ', depth=10)
-    }
-    sizing['effluent_targets'] = {
-        'cake_solids': inputs['target_cake_solids'],
-        'vsr': inputs['target_vsr']
+    Returns an (n_steps, len(TREND_FIELDS)) float array.
+    """
+    kinetic, aeration = get_process_params(inputs)
+    rng = np.random.default_rng(seed)
+    flow_factor, load_factor = generate_influent_pattern(n_steps, step_minutes, rng)
+    flow_m3_day = inputs['avg_flow_m3_day'] * flow_factor
+    targets = sizing['effluent_targets']
+
+    effluent_tkn = targets['tkn'] + (rng.random(n_steps) - 0.5) * 1
+    effluent_tp = targets['tp'] + (rng.random(n_steps) - 0.5) * 0.2
+    chemical_sludge = np.zeros(n_steps)
+    if inputs['use_methanol']:
+        effluent_tkn = np.minimum(effluent_tkn, chemical_dose_target('carbon', sizing['tech']))
+    effluent_tkn = np.maximum(effluent_tkn, nitrification_tkn_floor(inputs, sizing))
+    if inputs['use_alum']:
+        target_tp = chemical_dose_target('alum', sizing['tech'])
+        chemical_sludge = np.maximum(effluent_tp - target_tp, 0) * flow_m3_day / 1000 * 4.5
+        effluent_tp = np.minimum(effluent_tp, target_tp)
+    effluent_bod = np.maximum(0, targets['bod'] + (rng.random(n_steps) - 0.5) * 3)
+    effluent_tss = np.maximum(0, targets['tss'] + (rng.random(n_steps) - 0.5) * 4)
+
+    bod_removed_kg_day = np.maximum(inputs['avg_bod'] * load_factor - effluent_bod, 0) * flow_m3_day / 1000
+    vss_produced = (kinetic['Y'] * bod_removed_kg_day) / (1 + kinetic['kd'] * sizing.get('srt', 10))
+    total_sludge = vss_produced * kinetic['TSS_VSS_ratio'] + chemical_sludge
+
+    n_removed_kg_day = np.maximum(inputs['avg_tkn'] * load_factor - effluent_tkn, 0) * flow_m3_day / 1000
+    oxygen_demand_kg_day = bod_removed_kg_day * aeration['O2_demand_BOD'] + n_removed_kg_day * aeration['O2_demand_N']
+    required_air_m3_day = oxygen_demand_kg_day / (aeration['SOTE'] * aeration['O2_in_air_mass_fraction'] * aeration['air_density_kg_m3'])
+
+    return np.column_stack([flow_m3_day / 24, required_air_m3_day / 24, effluent_bod, effluent_tss,
+                            effluent_tkn, effluent_tp, total_sludge])
+
+def minmax_indices(y, n_out):
+    """Indices of the min and max of each bucket, in order; keeps every spike."""
+    n = len(y)
+    if n <= n_out:
+        return np.arange(n)
+    buckets = max(n_out // 2, 1)
+    size = -(-n // buckets)
+    padded = np.full(buckets * size, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(buckets, size)
+    valid = ~np.isnan(padded).all(axis=1)
+    offsets = np.arange(buckets)[valid] * size
+    lows = offsets + np.nanargmin(padded[valid], axis=1)
+    highs = offsets + np.nanargmax(padded[valid], axis=1)
+    return np.unique(np.concatenate([lows, highs]))
+
+def lttb_indices(y, n_out):
+    """Largest-Triangle-Three-Buckets indices for a uniformly sampled series."""
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    y = np.asarray(y, dtype=float)
+    x = np.arange(n, dtype=float)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    # Bucket means from cumulative sums, so each step only scans its own bucket
+    cum_y = np.concatenate([[0], np.cumsum(y)])
+    counts = np.maximum(edges[1:] - edges[:-1], 1)
+    mean_y = np.append((cum_y[edges[1:]] - cum_y[edges[:-1]]) / counts, y[-1])
+    mean_x = np.append((edges[1:] + edges[:-1] - 1) / 2, n - 1)
+
+    indices = np.empty(n_out, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+        area = np.abs((x[a] - mean_x[i + 1]) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (mean_y[i + 1] - y[a]))
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    return indices
+
+def downsample_series(y, n_out, method='LTTB'):
+    return lttb_indices(y, n_out) if method == 'LTTB' else minmax_indices(y, n_out)
+
+def load_trend_series(run_id, tech_key, inputs, sizing, days, step_minutes):
+    """Returns the simulated time series, memory-mapped from the run store when available."""
+    n_steps = int(days * 24 * 60 / step_minutes)
+    if n_steps > TREND_PARAMS['max_steps']:
+        raise ValueError(f"{n_steps:,} steps exceeds the {TREND_PARAMS['max_steps']:,}-step limit")
+    name = f"{tech_key}_trends_{days}d_{step_minutes}min"
+    series = load_run_array(run_id, name) if run_id is not None else None
+    if series is None:
+        seed = int(canonical_input_hash(inputs)[:8], 16)
+        series = simulate_process_timeseries(inputs, sizing, n_steps, step_minutes, seed)
+        if run_id is not None:
+            save_run_array(run_id, name, series)
+            stored = load_run_array(run_id, name)
+            series = series if stored is None else stored
+    return series
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def nitrification_chart_frames(temp_c, safety_factor, avg_tkn):
+    """Plot-ready effluent NH3-N and design SRT curves around the design temperature and safety factor."""
+    curves = nitrification_design_curves()
+    plot_temps = [t for t in (5, 10, 15, 20, 25) if t != round(temp_c)] + [round(temp_c, 1)]
+    srt_mask = curves['srts'] <= 30
+    nh3_df = pd.DataFrame({f"{t:g} °C": np.minimum(curves['effluent_nh3'][grid_index(curves['temps'], t), srt_mask], avg_tkn)
+                           for t in sorted(plot_temps)}, index=pd.Index(curves['srts'][srt_mask], name='Aerobic SRT (days)'))
+
+    sf_idx = grid_index(curves['safety'], [1.0, 1.5, 2.0, safety_factor])
+    srt_df = pd.DataFrame({f"SF {curves['safety'][i]:.2f}": curves['design_srt'][:, i] for i in sorted(set(sf_idx))},
+                          index=pd.Index(curves['temps'], name='Temperature (°C)'))
+    return nh3_df.iloc[::10], srt_df[srt_df.index >= 5].iloc[::5].clip(upper=60)
+
+def display_nitrification_check(inputs, sizing, rerun_key_prefix):
+    """Checks the aerobic SRT against temperature-corrected nitrification design curves."""
+    with st.expander("Nitrification Design Check"):
+        temp_c = inputs.get('design_temp_c', 12.0)
+        safety_factor = st.slider("Safety Factor", 1.0, 3.0, NITRIFICATION_PARAMS['design_safety_factor'], 0.05, key=f"{rerun_key_prefix}_nit_sf")
+        aerobic_srt = sizing['srt'] * sizing['aerobic_volume'] / sizing['total_volume']
+        check = lookup_nitrification(temp_c, aerobic_srt, safety_factor)
+
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Min. Aerobic SRT", f"{check['srt_min_days']:.1f} days")
+        col2.metric("Design Aerobic SRT", f"{check['design_srt_days']:.1f} days")
+        col3.metric("Provided Aerobic SRT", f"{aerobic_srt:.1f} days")
+        nh3 = check['effluent_nh3_mg_l']
+        col4.metric("Effluent NH3-N", "Washout" if not nh3 < inputs['avg_tkn'] else f"{nh3:.2f} mg/L")
+        if aerobic_srt >= check['design_srt_days']:
+            st.success(f"Aerobic SRT meets the nitrification design SRT at {temp_c:.1f} °C.")
+        else:
+            st.warning(f"Aerobic SRT is below the nitrification design SRT at {temp_c:.1f} °C.")
+        if sizing['tech'] == 'IFAS':
+            st.caption("Suspended-growth check only; nitrification on IFAS media is not credited.")
+
+        if st.toggle("Show Design Curves", key=f"{rerun_key_prefix}_nit_curves"):
+            nh3_df, srt_df = nitrification_chart_frames(temp_c, safety_factor, inputs['avg_tkn'])
+            st.subheader("Effluent NH3-N vs Aerobic SRT")
+            st.line_chart(nh3_df, height=250)
+            st.subheader("Design Aerobic SRT vs Temperature")
+            st.line_chart(srt_df, height=250)
+
+def display_eq_basin(inputs, sizing, rerun_key_prefix):
+    """Volume-versus-attenuation tradeoff of the EQ basin across storms and outflow setpoints."""
+    with st.expander("Equalization Basin Sizing"):
+        if 'eq' in sizing:
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Design EQ Volume", f"{sizing['eq']['volume']:,.0f} m³")
+            col2.metric("Design Storm Peak Inflow", f"{sizing['eq']['peak_inflow_m3_hr']:,.0f} m³/hr")
+            col3.metric("EQ Pump Rate", f"{sizing['eq']['peak_outflow_m3_hr']:,.0f} m³/hr")
+            st.caption(f"Design storm: {FLOW_CONDITIONS['Peak']:g}x average flow peaking after {EQ_PARAMS['design_time_to_peak_hr']} h, "
+                       f"constant outflow at {EQ_PARAMS['design_outflow_factor']:g}x average, plus {EQ_PARAMS['volume_allowance']:.0%} volume allowance.")
+
+        col1, col2, col3, col4 = st.columns(4)
+        mode = col1.selectbox("Outflow Control", ['Constant', 'Flow-paced'], key=f"{rerun_key_prefix}_eq_mode",
+                              help=f"Flow-paced pumps the trailing {EQ_PARAMS['flow_paced_window_hr']}-h average inflow, capped at the setpoint.")
+        days = col2.number_input("Record Length (days)", 2, 3650, EQ_PARAMS['design_days'], key=f"{rerun_key_prefix}_eq_days")
+        step_minutes = col3.selectbox("Resolution (min)", TREND_PARAMS['step_minutes_options'],
+                                      index=TREND_PARAMS['step_minutes_options'].index(EQ_PARAMS['step_minutes']),
+                                      key=f"{rerun_key_prefix}_eq_step")
+        n_diurnal = col4.number_input("Diurnal Patterns", 1, 20, 3, key=f"{rerun_key_prefix}_eq_diurnal")
+        col1, col2, col3 = st.columns(3)
+        peaks = col1.slider("Storm Peak Factors", 1.0, 6.0, (1.5, 4.0), 0.1, key=f"{rerun_key_prefix}_eq_peaks")
+        time_to_peak = col2.slider("Storm Time to Peak (h)", 1, 48, (3, 12), key=f"{rerun_key_prefix}_eq_ttp")
+        outflows = col3.slider("Outflow Setpoints (x Average)", 0.8, 3.0, (1.0, 2.5), 0.05, key=f"{rerun_key_prefix}_eq_outflows")
+
+        storm_peaks = np.linspace(peaks[0], peaks[1], 6)
+        storm_ttp = np.unique(np.linspace(time_to_peak[0], time_to_peak[1], 3))
+        factors = np.linspace(outflows[0], outflows[1], 31)
+        n_hydrographs = n_diurnal * len(storm_peaks) * len(storm_ttp)
+        n_steps = int(days * 24 * 60 / step_minutes)
+        study_key = f"{rerun_key_prefix}_eq_study"
+
+        if n_hydrographs * n_steps > EQ_PARAMS['max_hydrograph_values']:
+            st.warning(f"{n_hydrographs} hydrographs x {n_steps:,} steps is too large to route; "
+                       "shorten the record, coarsen the resolution or use fewer diurnal patterns.")
+        elif st.button(f"Route {n_hydrographs} Hydrographs", key=f"{rerun_key_prefix}_eq_run"):
+            with st.spinner("Routing hydrographs..."):
+                hydrographs = generate_eq_hydrographs(inputs['avg_flow_m3_day'], storm_peaks, storm_ttp, days, step_minutes, n_diurnal,
+                                                      seed=int(canonical_input_hash(inputs)[:8], 16))
+                routed = route_eq_storage(hydrographs, factors * inputs['avg_flow_m3_day'] / 24, step_minutes, mode)
+            # Envelope over diurnal patterns and storm durations, one curve per storm peak
+            shape = (n_diurnal, len(storm_peaks), len(storm_ttp), len(factors))
+            index = pd.Index(factors.round(2), name='Outflow Setpoint (x Average)')
+            columns = [f"Peak {p:.1f}x" for p in storm_peaks]
+            st.session_state[study_key] = {
+                'volume': pd.DataFrame(routed['volume_m3'].reshape(shape).max(axis=(0, 2)).T, index=index, columns=columns),
+                'attenuation': pd.DataFrame(routed['attenuation_pct'].reshape(shape).min(axis=(0, 2)).T, index=index, columns=columns),
+                'caption': f"{mode} outflow: {n_hydrographs} hydrographs x {len(factors)} setpoints routed over {n_steps:,} steps; "
+                           "worst case over diurnal patterns and storm durations."
+            }
+
+        study = st.session_state.get(study_key)
+        if study:
+            st.subheader("Required EQ Volume (m³)")
+            st.line_chart(study['volume'], height=250)
+            st.subheader("Peak Attenuation (%)")
+            st.line_chart(study['attenuation'], height=250)
+            st.caption(study['caption'])
+
+def build_timeseries_appendix(series, step_minutes):
+    """PDF appendix spec for a simulated time series; rows are generated lazily."""
+    start = pd.Timestamp(datetime.date.today().year, 1, 1)
+    step = pd.Timedelta(minutes=step_minutes)
+    rows = ([f"{start + step * i:%Y-%m-%d %H:%M}"] + [f"{v:,.2f}" for v in series[i]] for i in range(len(series)))
+    header = ['Time', 'Flow (m³/hr)', 'Air (m³/hr)', 'BOD (mg/L)', 'TSS (mg/L)', 'TKN (mg/L)', 'TP (mg/L)', 'Sludge (kg/d)']
+    return {
+        'title': f"Simulated Time Series ({step_minutes}-min)",
+        'header': header,
+        'rows': rows,
+        'col_widths': [32] + [158 / (len(header) - 1)] * (len(header) - 1)
     }
-    return sizing
 
-def simulate_process(inputs, sizing, adjustments=None):
-    tech = sizing['tech']
-    
-    if tech == 'Scrubber':
-        results = {}
-        # H2S Removal
-        h2s_props = CONTAMINANT_PROPERTIES['H2S']
-        h2s_in_mg_m3 = inputs['h2s_in_ppm'] * (h2s_props['mw'] / 24.45)
-        h2s_loading_kg_day = (inputs['air_flow_m3_hr'] * 24 * h2s_in_mg_m3) / 1_000_000
-        
-        # NH3 Removal
-        nh3_props = CONTAMINANT_PROPERTIES['NH3']
-        nh3_in_mg_m3 = inputs['nh3_in_ppm'] * (nh3_props['mw'] / 24.45)
-        nh3_loading_kg_day = (inputs['air_flow_m3_hr'] * 24 * nh3_in_mg_m3) / 1_000_000
-        
-        design_removal_eff = sizing['effluent_targets']['removal_eff']
-        
-        if adjustments:
-            fan_factor = adjustments['fan_speed_slider'] / 100
-            acid_pump_factor = adjustments['acid_pump_slider'] / 100
-            caustic_pump_factor = adjustments['caustic_pump_slider'] / 100
-            
-            h2s_removal_eff = min(design_removal_eff * caustic_pump_factor * (1/fan_factor if fan_factor > 0 else 1), 99.9)
-            nh3_removal_eff = min(design_removal_eff * acid_pump_factor * (1/fan_factor if fan_factor > 0 else 1), 99.9)
-        else:
-            h2s_removal_eff = design_removal_eff
-            nh3_removal_eff = design_removal_eff
-        
-        # H2S Results
-        h2s_removed_kg_day = h2s_loading_kg_day * (h2s_removal_eff / 100)
-        results['Outlet H2S (ppm)'] = inputs['h2s_in_ppm'] * (1 - h2s_removal_eff / 100)
-        results['H2S Removal Efficiency (%)'] = h2s_removal_eff
-        
-        # NH3 Results
-        nh3_removed_kg_day = nh3_loading_kg_day * (nh3_removal_eff / 100)
-        results['Outlet NH3 (ppm)'] = inputs['nh3_in_ppm'] * (1 - nh3_removal_eff / 100)
-        results['NH3 Removal Efficiency (%)'] = nh3_removal_eff
-
-        # Caustic/Oxidation Chemical Consumption
-        caustic_chem_props = CHEMICAL_PROPERTIES[inputs['caustic_chemical']]
-        if inputs['caustic_chemical'] == 'Sodium Hydroxide':
-            caustic_stoich_ratio = CHEMICAL_FACTORS['naoh_to_h2s_ratio'] * (caustic_chem_props['mw'] / h2s_props['mw'])
-        else: # Sodium Hypochlorite
-            caustic_stoich_ratio = CHEMICAL_FACTORS['naocl_to_h2s_ratio'] * (caustic_chem_props['mw'] / h2s_props['mw'])
-        
-        pure_caustic_kg_day = h2s_removed_kg_day * caustic_stoich_ratio
-        solution_caustic_kg_day = pure_caustic_kg_day / (inputs['caustic_conc'] / 100)
-        solution_caustic_L_day = solution_caustic_kg_day / caustic_chem_props['density_kg_L']
-        
-        results[f"{inputs['caustic_chemical']} Consumption (kg/day)"] = solution_caustic_kg_day
-        results[f"{inputs['caustic_chemical']} Dosing Rate (L/day)"] = solution_caustic_L_day
-        results['Caustic Dosing Pump Capacity (L/hr)'] = (solution_caustic_L_day / 24) * 1.25
-
-        # Acid Chemical Consumption
-        acid_chem_props = CHEMICAL_PROPERTIES[inputs['acid_chemical']]
-        acid_stoich_ratio = CHEMICAL_FACTORS['h2so4_to_nh3_ratio'] * (acid_chem_props['mw'] / nh3_props['mw'])
-        pure_acid_kg_day = nh3_removed_kg_day * acid_stoich_ratio
-        solution_acid_kg_day = pure_acid_kg_day / (inputs['acid_conc'] / 100)
-        solution_acid_L_day = solution_acid_kg_day / acid_chem_props['density_kg_L']
-
-        results[f"{inputs['acid_chemical']} Consumption (kg/day)"] = solution_acid_kg_day
-        results[f"{inputs['acid_chemical']} Dosing Rate (L/day)"] = solution_acid_L_day
-        results['Acid Dosing Pump Capacity (L/hr)'] = (solution_acid_L_day / 24) * 1.25
-        
-        results['Recirculation Pump Flow (m³/hr)'] = sizing['recirculation_flow_m3_hr']
-        return results
+def display_trend_charts(inputs, sizing, rerun_key_prefix):
+    """Interactive trends of a simulated time series, downsampled server-side to the visible window."""
+    with st.expander("Simulation Trends"):
+        col1, col2, col3, col4 = st.columns(4)
+        days = col1.number_input("Duration (days)", 1, 3650, TREND_PARAMS['default_days'], key=f"{rerun_key_prefix}_trend_days")
+        step_minutes = col2.selectbox("Resolution (min)", TREND_PARAMS['step_minutes_options'],
+                                      index=TREND_PARAMS['step_minutes_options'].index(TREND_PARAMS['default_step_minutes']),
+                                      key=f"{rerun_key_prefix}_trend_step")
+        method = col3.selectbox("Downsampling", ['LTTB', 'Min-Max'], key=f"{rerun_key_prefix}_trend_method")
+        max_points = col4.selectbox("Points per Series", TREND_PARAMS['max_points_options'],
+                                    index=TREND_PARAMS['max_points_options'].index(TREND_PARAMS['default_max_points']),
+                                    key=f"{rerun_key_prefix}_trend_points")
+        fields = st.multiselect("Series", TREND_FIELDS, default=['Required Airflow (m³/hr)'], key=f"{rerun_key_prefix}_trend_fields")
+        n_steps = int(days * 24 * 60 / step_minutes)
+        if n_steps > TREND_PARAMS['max_steps']:
+            st.warning(f"{n_steps:,} steps is too long to simulate (limit {TREND_PARAMS['max_steps']:,}); "
+                       "shorten the duration or coarsen the resolution.")
+            return
+        # Simulating, downsampling and charting are the expensive part, so they only run while shown
+        if not st.toggle("Show Trends", key=f"{rerun_key_prefix}_trend_show") or not fields:
+            return
 
-    if tech == 'Solids':
-        cas_sizing = calculate_cas_sizing(inputs)
-        cas_results = simulate_process(inputs, cas_sizing)
-        total_sludge_kg_day = cas_results['Total Sludge Production (kg TSS/day)']
-        
-        thickening_polymer_kg_day = (total_sludge_kg_day / 1000) * SOLIDS_PARAMS['polymer_dose_thickening_kg_ton']
+        try:
+            series = load_trend_series(st.session_state.simulation_data.get('run_id'), rerun_key_prefix, inputs, sizing, days, step_minutes)
+        except (OSError, sqlite3.Error) as e:
+            st.error(f"Error loading simulation time series: {e}")
+            return
+        start = pd.Timestamp(datetime.date.today().year, 1, 1)
+        step = pd.Timedelta(minutes=step_minutes)
+        end = start + step * (len(series) - 1)
+
+        # Zooming re-slices the full-resolution series, so detail increases as the window narrows
+        window = st.slider("Visible Window", min_value=start.to_pydatetime(), max_value=end.to_pydatetime(),
+                           value=(start.to_pydatetime(), end.to_pydatetime()), step=step.to_pytimedelta(),
+                           format="YYYY-MM-DD HH:mm", key=f"{rerun_key_prefix}_trend_window")
+        lo = int((pd.Timestamp(window[0]) - start) / step)
+        hi = int((pd.Timestamp(window[1]) - start) / step) + 1
+
+        for field in fields:
+            column = series[lo:hi, TREND_FIELDS.index(field)]
+            idx = downsample_series(column, max_points, method)
+            chart_df = pd.DataFrame({field: np.asarray(column[idx])}, index=start + step * (lo + idx))
+            st.line_chart(chart_df, height=220)
+        st.caption(f"{hi - lo:,} samples in window; up to {max_points:,} plotted per series.")
 
-        vs_in_kg_day = total_sludge_kg_day * KINETIC_PARAMS['VSS_TSS_ratio']
-        
-        vsr_eff = sizing['effluent_targets']['vsr']
-        if adjustments:
-            vsr_eff *= adjustments['digester_mixing_slider'] / 100
+# ==============================================================================
+# --- Chemical Dosing Control Simulation ---
+# ==============================================================================
+def dosing_tuning_grid(kp, ki, kd, ff_gain):
+    """Every combination of the given gain values, as flat arrays (one entry per tuning set)."""
+    grids = np.meshgrid(*(np.atleast_1d(np.asarray(v, dtype=float)) for v in (kp, ki, kd, ff_gain)), indexing='ij')
+    return dict(zip(('kp', 'ki', 'kd', 'ff_gain'), (g.ravel() for g in grids)))
+
+def simulate_dosing_control(inputs, sizing, chemical, tuning, mode, n_steps, step_minutes, seed=None, keep_traces=False):
+    """Closed-loop alum or carbon dosing over a time series, vectorized across tuning sets.
+
+    The controller output is the removal requested in mg/L (flow-paced), so
+    gains carry over between plant sizes: PID on the lagged, dead-timed
+    analyzer reading plus feed-forward on the predicted undosed effluent.
+    The dosing pump clips the resulting kg/hr at its capacity, and the
+    integral is held while the pump is saturated (anti-windup).
+    """
+    params = DOSING_CONTROL_PARAMS[chemical]
+    kp, ki, kd, ff_gain = (np.asarray(tuning[k], dtype=float) for k in ('kp', 'ki', 'kd', 'ff_gain'))
+    if mode == 'Feed-forward':
+        kp, ki, kd = np.zeros_like(kp), np.zeros_like(ki), np.zeros_like(kd)
+    elif mode == 'PID':
+        ff_gain = np.zeros_like(ff_gain)
+    n_sets = len(kp)
+
+    rng = np.random.default_rng(seed)
+    flow_factor, load_factor = generate_influent_pattern(n_steps, step_minutes, rng)
+    flow_m3_hr = inputs['avg_flow_m3_day'] * flow_factor / 24
+    biological = sizing['effluent_targets'][params['target_key']] * load_factor
+    undosed = biological + (rng.random(n_steps) - 0.5) * params['noise_mg_l']
+    floor = params['floor_mg_l']
+    if chemical == 'carbon':
+        floor = max(floor, nitrification_tkn_floor(inputs, sizing))
+    floor = np.minimum(floor, undosed)
+    setpoint = chemical_dose_target(chemical, sizing['tech'])
+    # Feed-forward sees the influent load but not the unmeasured noise
+    predicted_excess = np.maximum(biological - setpoint, 0)
+    # mg/L removed -> kg/hr of chemical
+    dose_per_mg_l = flow_m3_hr * params['ratio'] / 1000
+    pump_max_kg_hr = params['max_removal_mg_l'] * inputs['avg_flow_m3_day'] * FLOW_CONDITIONS['Peak'] / 24 * params['ratio'] / 1000
+
+    dt_hr = step_minutes / 60
+    process_alpha = 1 - np.exp(-step_minutes / params['process_lag_min'])
+    sensor_alpha = 1 - np.exp(-step_minutes / params['sensor_lag_min'])
+    delay_line = np.full((int(round(params['dead_time_min'] / step_minutes)) + 1, n_sets), undosed[0])
+    effluent = np.full(n_sets, undosed[0])
+    measured = effluent.copy()
+    previous = measured.copy()
+    integral = np.zeros(n_sets)
+    limit = setpoint * (1 + DOSING_CONTROL_PARAMS['compliance_margin'])
+    totals = {name: np.zeros(n_sets) for name in ('dose', 'effluent', 'abs_error', 'exceed', 'saturated')}
+    if keep_traces:
+        traces = {name: np.empty((n_steps, n_sets)) for name in ('effluent', 'measured', 'dose_kg_hr')}
+
+    for t in range(n_steps):
+        error = measured - setpoint
+        request = ff_gain * predicted_excess[t] + kp * error + integral + kd * (measured - previous) / dt_hr
+        dose = np.minimum(np.maximum(request * dose_per_mg_l[t], 0), pump_max_kg_hr)
+        winding = (dose >= pump_max_kg_hr) & (error > 0) | (dose <= 0) & (error < 0)
+        integral += ki * error * (dt_hr * ~winding)
+
+        effluent += process_alpha * (np.maximum(undosed[t] - dose / dose_per_mg_l[t], floor[t]) - effluent)
+        delay_line[t % len(delay_line)] = effluent
+        previous = measured
+        measured = measured + sensor_alpha * (delay_line[(t + 1) % len(delay_line)] - measured)
+
+        totals['dose'] += dose
+        totals['effluent'] += effluent
+        totals['abs_error'] += np.abs(effluent - setpoint)
+        totals['exceed'] += effluent > limit
+        totals['saturated'] += dose >= pump_max_kg_hr
+        if keep_traces:
+            traces['effluent'][t], traces['measured'][t], traces['dose_kg_hr'][t] = effluent, measured, dose
+
+    hours = n_steps * dt_hr
+    summary = {
+        'Annual Chemical Use (kg/yr)': totals['dose'] * dt_hr * 8760 / hours,
+        'Mean Effluent (mg/L)': totals['effluent'] / n_steps,
+        'Mean Abs. Error (mg/L)': totals['abs_error'] / n_steps,
+        'Time Above Limit (%)': totals['exceed'] / n_steps * 100,
+        'Pump Saturated (%)': totals['saturated'] / n_steps * 100
+    }
+    sim = {'summary': summary, 'setpoint': setpoint, 'limit': limit, 'pump_max_kg_hr': pump_max_kg_hr, 'undosed': undosed}
+    if keep_traces:
+        sim['traces'] = traces
+    return sim
+
+def display_dosing_control(inputs, sizing, results, rerun_key_prefix):
+    """Tunes closed-loop alum/carbon dosing over a grid of controller gains."""
+    chemicals = [c for c, used in (('alum', inputs['use_alum']), ('carbon', inputs['use_methanol'])) if used]
+    if not chemicals:
+        return
+    with st.expander("Chemical Dosing Control"):
+        col1, col2, col3, col4 = st.columns(4)
+        chemical = col1.selectbox("Chemical", chemicals, format_func=lambda c: DOSING_CONTROL_PARAMS[c]['label'], key=f"{rerun_key_prefix}_dose_chem")
+        mode = col2.selectbox("Controller", list(DOSING_CONTROL_PARAMS['mode_gains']), key=f"{rerun_key_prefix}_dose_mode")
+        days = col3.number_input("Duration (days)", 1, 3650, TREND_PARAMS['default_days'], key=f"{rerun_key_prefix}_dose_days")
+        step_minutes = col4.selectbox("Resolution (min)", TREND_PARAMS['step_minutes_options'],
+                                      index=TREND_PARAMS['step_minutes_options'].index(TREND_PARAMS['default_step_minutes']),
+                                      key=f"{rerun_key_prefix}_dose_step")
+
+        labels = {'kp': "Kp (mg/L per mg/L)", 'ki': "Ki (1/hr)", 'kd': "Kd (hr)", 'ff_gain': "Feed-forward Gain"}
+        n_values = st.number_input("Values per Gain", 1, 10, 4, key=f"{rerun_key_prefix}_dose_n")
+        used_gains = DOSING_CONTROL_PARAMS['mode_gains'][mode]
+        gain_values = {gain: np.zeros(1) for gain in labels}
+        for col, gain in zip(st.columns(len(used_gains)), used_gains):
+            lo, hi = DOSING_CONTROL_PARAMS['gain_ranges'][gain]
+            selected = col.slider(labels[gain], lo, hi, DOSING_CONTROL_PARAMS['default_gains'][gain], 0.05, key=f"{rerun_key_prefix}_dose_{gain}")
+            gain_values[gain] = np.unique(np.linspace(selected[0], selected[1], n_values))
+        tuning = dosing_tuning_grid(**gain_values)
+        n_sets = len(tuning['kp'])
+        n_steps = int(days * 24 * 60 / step_minutes)
+        result_key = f"{rerun_key_prefix}_dosing"
+
+        if n_steps > DOSING_CONTROL_PARAMS['max_steps'] or n_steps * n_sets > DOSING_CONTROL_PARAMS['max_simulation_values']:
+            st.warning(f"{n_sets:,} tuning sets x {n_steps:,} steps is too large to simulate; "
+                       "shorten the duration, coarsen the resolution or use fewer values per gain.")
+        elif st.button(f"Simulate {n_sets:,} Tuning Sets", key=f"{rerun_key_prefix}_dose_run"):
+            seed = int(canonical_input_hash(inputs)[:8], 16)
+            with st.spinner("Simulating dosing control..."):
+                sim = simulate_dosing_control(inputs, sizing, chemical, tuning, mode, n_steps, step_minutes, seed)
+                table = pd.DataFrame({**{labels[g]: tuning[g] for g in used_gains}, **sim['summary']})
+                # Compliance first, then chemical use
+                table = table.sort_values(['Time Above Limit (%)', 'Annual Chemical Use (kg/yr)']).reset_index(drop=True)
+                best = {g: table[labels[g]].iloc[:1].to_numpy() if g in used_gains else np.zeros(1) for g in tuning}
+                trace = simulate_dosing_control(inputs, sizing, chemical, best, mode, n_steps, step_minutes, seed, keep_traces=True)
+            st.session_state[result_key] = {'chemical': chemical, 'mode': mode, 'step_minutes': step_minutes, 'table': table, 'trace': trace}
+
+        if result_key not in st.session_state:
+            return
+        stored = st.session_state[result_key]
+        params = DOSING_CONTROL_PARAMS[stored['chemical']]
+        best = stored['table'].iloc[0]
+        steady_key = 'Alum Dose (kg/day)' if stored['chemical'] == 'alum' else 'Carbon Source Dose (kg/day)'
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Best-Set Chemical Use", f"{best['Annual Chemical Use (kg/yr)']:,.0f} kg/yr",
+                    f"{best['Annual Chemical Use (kg/yr)'] - results[steady_key] * 365:+,.0f} vs steady dose", delta_color='inverse')
+        col2.metric("Time Above Limit", f"{best['Time Above Limit (%)']:.1f}%")
+        col3.metric("Setpoint / Limit", f"{stored['trace']['setpoint']:.2f} / {stored['trace']['limit']:.2f} mg/L")
+        st.caption(f"{params['label']}, {stored['mode']}; sorted by time above limit, then chemical use.")
+        st.dataframe(stored['table'].style.format("{:,.2f}"), height=250)
+
+        traces = stored['trace']['traces']
+        start = pd.Timestamp(datetime.date.today().year, 1, 1)
+        step = pd.Timedelta(minutes=stored['step_minutes'])
+        for name, label in (('effluent', 'Effluent (mg/L)'), ('dose_kg_hr', 'Dose (kg/hr)')):
+            column = traces[name][:, 0]
+            idx = downsample_series(column, TREND_PARAMS['default_max_points'])
+            st.line_chart(pd.DataFrame({f"Best Set {label}": column[idx]}, index=start + step * idx), height=200)
 
-        vs_destroyed_kg_day = vs_in_kg_day * (vsr_eff / 100)
-        biogas_m3_day = vs_destroyed_kg_day * SOLIDS_PARAMS['biogas_yield_m3_kg_vsr']
-        
-        digested_sludge_kg_day = total_sludge_kg_day - vs_destroyed_kg_day
-        
-        cake_solids_pct = sizing['effluent_targets']['cake_solids']
-        if adjustments:
-            cake_solids_pct *= adjustments['dewatering_polymer_slider'] / 100
-        
-        cake_solids_pct = min(cake_solids_pct, 40)
-        final_cake_kg_day = digested_sludge_kg_day / (cake_solids_pct / 100)
-        dewatering_polymer_kg_day = (digested_sludge_kg_day / 1000) * SOLIDS_PARAMS['polymer_dose_dewatering_kg_ton']
-
-        return {
-            "Biogas Production (m³/day)": biogas_m3_day,
-            "Methane Production (m³/day)": biogas_m3_day * (SOLIDS_PARAMS['methane_content_percent'] / 100),
-            "Volatile Solids Reduction (%)": vsr_eff,
-            "Dewatered Cake Production (kg/day)": final_cake_kg_day,
-            "Thickening Polymer Consumption (kg/day)": thickening_polymer_kg_day,
-            "Dewatering Polymer Consumption (kg/day)": dewatering_polymer_kg_day
-        }
-
-    # --- Wastewater Simulation ---
-    effluent_targets = sizing['effluent_targets']
-    effluent_tkn = effluent_targets['tkn'] + (np.random.random() - 0.5) * 1
-    effluent_tp = effluent_targets['tp'] + (np.random.random() - 0.5) * 0.2
-    methanol_dose_kg = 0
-    alum_dose_kg = 0
+# ==============================================================================
+# --- Lifecycle Cost Engine ---
+# ==============================================================================
+def calculate_capex(sizing):
+    """Capital cost line items (USD) from a technology's sizing dict."""
+    unit_costs = COST_PARAMS['capex']
+    capex = {}
+    if 'total_volume' in sizing:
+        capex['Basins'] = sizing['total_volume'] * unit_costs['basin_usd_m3']
+    if 'eq' in sizing:
+        capex['EQ Basin'] = sizing['eq']['volume'] * unit_costs['basin_usd_m3']
+    if 'clarifier_area' in sizing:
+        capex['Clarifiers'] = sizing['clarifier_area'] * unit_costs['clarifier_usd_m2']
+    if 'membrane_area' in sizing:
+        capex['Membranes'] = sizing['membrane_area'] * unit_costs['membrane_usd_m2']
+    if 'media_volume' in sizing:
+        media_cost = unit_costs['scrubber_media_usd_m3'] if sizing['tech'] == 'Scrubber' else unit_costs['media_usd_m3']
+        capex['Media'] = sizing['media_volume'] * media_cost
+    if 'digester_volume' in sizing:
+        capex['Digester'] = sizing['digester_volume'] * unit_costs['digester_usd_m3']
+    if 'gbt_width_m' in sizing:
+        capex['Thickener'] = sizing['gbt_width_m'] * unit_costs['gbt_usd_m']
+    return capex
+
+def calculate_annual_opex(inputs, sizing, results):
+    """Annual operating quantities and base-price costs, split by price driver.
+
+    Energy is returned in kWh/yr so it can be re-priced per scenario;
+    chemicals and everything else are returned in USD/yr at base prices.
+    """
+    prices = COST_PARAMS['unit_prices']
+    airflow_m3_hr = results.get('Required Airflow (m³/hr)', 0)
+    if 'membrane_area' in sizing:
+        airflow_m3_hr += sizing['membrane_area'] * COST_PARAMS['mbr_scour_air_m3_m2_hr']
+    if sizing['tech'] == 'Scrubber':
+        airflow_m3_hr += inputs['air_flow_m3_hr']
+    energy_kwh_yr = airflow_m3_hr * 8760 * COST_PARAMS['blower_specific_energy_kwh_m3']
+
+    avg_flow_m3_s = inputs['avg_flow_m3_day'] / 86400
+    ras_flow_m3_s = results.get('RAS Design Flow (m³/hr)', 0) / 3600
+    pump_kw = 9.81 * (avg_flow_m3_s * results.get('EQ Pump TDH (m)', 0)
+                      + ras_flow_m3_s * results.get('RAS Pump TDH (m)', 0)) / COST_PARAMS['pump_efficiency']
+    energy_kwh_yr += pump_kw * 8760
+
+    chemicals_usd_day = (results.get('Alum Dose (kg/day)', 0) * prices['alum_usd_kg']
+                         + results.get('Carbon Source Dose (kg/day)', 0) * prices['carbon_usd_kg']
+                         + results.get('Thickening Polymer Consumption (kg/day)', 0) * prices['polymer_usd_kg']
+                         + results.get('Dewatering Polymer Consumption (kg/day)', 0) * prices['polymer_usd_kg'])
+    if sizing['tech'] == 'Scrubber':
+        for chemical in (inputs['acid_chemical'], inputs['caustic_chemical']):
+            chemicals_usd_day += results[f"{chemical} Consumption (kg/day)"] * prices[f"{chemical}_usd_kg"]
 
-    if inputs['use_methanol']:
-        target_tkn = 2.0 if sizing['tech'] in ['MBR', 'IFAS'] else 3.0
-        n_to_remove = (effluent_tkn - target_tkn) * inputs['avg_flow_m3_day'] / 1000
-        if n_to_remove > 0:
-            methanol_dose_kg = n_to_remove * CHEMICAL_FACTORS['methanol_to_n_ratio']
-            effluent_tkn = target_tkn
-    
-    if inputs['use_alum']:
-        target_tp = 0.5 if sizing['tech'] == 'MBR' else 0.8
-        p_to_remove = (effluent_tp - target_tp) * inputs['avg_flow_m3_day'] / 1000
-        if p_to_remove > 0:
-            alum_dose_kg = p_to_remove * CHEMICAL_FACTORS['alum_to_p_ratio']
-            effluent_tp = target_tp
-            
-    effluent_bod = max(0, effluent_targets['bod'] + (np.random.random() - 0.5) * 3)
-    effluent_tss = max(0, effluent_targets['tss'] + (np.random.random() - 0.5) * 4)
-
-    bod_removed_kg_day = (inputs['avg_bod'] - effluent_bod) * inputs['avg_flow_m3_day'] / 1000
-    vss_produced = (KINETIC_PARAMS['Y'] * bod_removed_kg_day) / (1 + KINETIC_PARAMS['kd'] * sizing.get('srt', 10))
-    tss_produced = vss_produced * KINETIC_PARAMS['TSS_VSS_ratio']
-    
-    p_removed_chemically_kg_day = alum_dose_kg / CHEMICAL_FACTORS['alum_to_p_ratio'] if alum_dose_kg > 0 else 0
-    chemical_sludge = p_removed_chemically_kg_day * 4.5
-    total_sludge = tss_produced + chemical_sludge
-
-    was_flow_m3d_design = (total_sludge * 1000) / (0.8 * sizing.get('mlss', 3500)) if sizing['tech'] != 'MBBR' else 0
-    ras_flow_m3d_design = inputs['avg_flow_m3_day'] * 0.75 if sizing['tech'] != 'MBBR' else 0
-    peak_flow_m3_hr_design = (inputs['avg_flow_m3_day'] * 2.5) / 24
-
-    if adjustments:
-        current_mlss = adjustments.get('adj_mlss', sizing.get('mlss', 3500))
-        was_flow_m3d_design = (total_sludge * 1000) / (0.8 * current_mlss)
-        was_flow_m3d = was_flow_m3d_design * (adjustments['was_flow_slider'] / 100)
-        ras_flow_m3d = ras_flow_m3d_design * (adjustments['ras_flow_slider'] / 100)
+    sludge_kg_day = results.get('Total Sludge Production (kg TSS/day)', 0)
+    if 'Dewatered Cake Production (kg/day)' in results:
+        cake_wet_tonnes_day = results['Dewatered Cake Production (kg/day)'] / 1000
     else:
-        was_flow_m3d = was_flow_m3d_design
-        ras_flow_m3d = ras_flow_m3d_design
+        cake_wet_tonnes_day = sludge_kg_day / (inputs['target_cake_solids'] / 100) / 1000
+    other_usd_yr = cake_wet_tonnes_day * 365 * prices['sludge_disposal_usd_wet_tonne']
+    if 'membrane_area' in sizing:
+        other_usd_yr += sizing['membrane_area'] * COST_PARAMS['capex']['membrane_usd_m2'] / COST_PARAMS['membrane_life_years']
+    other_usd_yr += sum(calculate_capex(sizing).values()) * COST_PARAMS['maintenance_fraction_of_capex']
 
-    n_removed_bio_kg_day = (inputs['avg_tkn'] - effluent_tkn) * inputs['avg_flow_m3_day'] / 1000
-    
-    oxygen_demand_kg_day = (bod_removed_kg_day * AERATION_PARAMS['O2_demand_BOD']) + (n_removed_bio_kg_day * AERATION_PARAMS['O2_demand_N'])
-    required_air_m3_day_design = oxygen_demand_kg_day / (AERATION_PARAMS['SOTE'] * AERATION_PARAMS['O2_in_air_mass_fraction'] * AERATION_PARAMS['air_density_kg_m3'])
-    
-    if adjustments:
-        required_air_m3_day = required_air_m3_day_design * (adjustments['air_flow_slider'] / 100)
-    else:
-        required_air_m3_day = required_air_m3_day_design
+    return {'energy_kwh_yr': energy_kwh_yr, 'chemicals_usd_yr': chemicals_usd_day * 365, 'other_usd_yr': other_usd_yr}
 
-    flow_conv_factor = (CONVERSION_FACTORS['flow'].get(f"{inputs['flow_unit_short']}_to_m3_day", 1) or 1)
-    
-    return {
-        'Effluent BOD (mg/L)': effluent_bod, 'Effluent TSS (mg/L)': effluent_tss,
-        'Effluent TKN (mg/L)': effluent_tkn, 'Effluent TP (mg/L)': effluent_tp,
-        f'RAS Flow ({inputs["flow_unit_short"]})': ras_flow_m3d / flow_conv_factor,
-        f'WAS Flow ({inputs["flow_unit_short"]})': was_flow_m3d / flow_conv_factor,
-        'Alum Dose (kg/day)': alum_dose_kg, 'Carbon Source Dose (kg/day)': methanol_dose_kg,
-        'Total Sludge Production (kg TSS/day)': total_sludge,
-        'Required Airflow (m³/hr)': required_air_m3_day / 24,
-        'EQ Peak Pump Rate (m³/hr)': peak_flow_m3_hr_design,
-        'RAS Design Flow (m³/hr)': ras_flow_m3d_design / 24,
-        'WAS Design Flow (m³/hr)': was_flow_m3d_design / 24,
-        'EQ Valve Cv': calculate_valve_cv(peak_flow_m3_hr_design),
-        'RAS Valve Cv': calculate_valve_cv(ras_flow_m3d_design / 24),
-        'WAS Valve Cv': calculate_valve_cv(was_flow_m3d_design / 24)
-    }
+def calculate_npv(capex, opex, discount_rates, energy_multipliers, chemical_multipliers, lifetimes):
+    """Lifecycle cost (present value, USD) broadcast over every scenario combination.
 
-def generate_pfd_dot(inputs, sizing, results):
-    """Generates a DOT string for the process flow diagram."""
-    tech = sizing['tech']
-    
-    if tech == 'Scrubber':
-        inlet_label = f"Inlet Air\\n{inputs['air_flow_m3_hr']:.0f} m³/hr\\n{inputs['h2s_in_ppm']} ppm H2S\\n{inputs['nh3_in_ppm']} ppm NH3"
-        outlet_label = f"Treated Air\\n{results['Outlet H2S (ppm)']:.1f} ppm H2S\\n{results['Outlet NH3 (ppm)']:.1f} ppm NH3"
-        acid_rate_key = f"{inputs['acid_chemical']} Dosing Rate (L/day)"
-        caustic_rate_key = f"{inputs['caustic_chemical']} Dosing Rate (L/day)"
-        dot = f"""
-        digraph G {{
-            rankdir=LR;
-            graph [fontname="Inter"];
-            node [shape=box, style="rounded,filled", fillcolor="#EBF4FF", fontname="Inter"];
-            edge [fontname="Inter", fontsize=10];
-            
-            InletAir [label="{inlet_label}"];
-            Scrubber [label="2-Stage Scrubber Vessel"];
-            TreatedAir [label="{outlet_label}"];
-            AcidChem [shape=oval, fillcolor="#D1FAE5", label="{inputs['acid_chemical']}\\n{results[acid_rate_key]:.1f} L/day"];
-            CausticChem [shape=oval, fillcolor="#FEF3C7", label="{inputs['caustic_chemical']}\\n{results[caustic_rate_key]:.1f} L/day"];
-            
-            InletAir -> Scrubber;
-            Scrubber -> TreatedAir;
-            AcidChem -> Scrubber;
-            CausticChem -> Scrubber;
-        }}
-        """
-        return dot
-    
-    if tech == 'Solids':
-        dot = f"""
-        digraph G {{
-            rankdir=LR;
-            graph [fontname="Inter"];
-            node [shape=box, style="rounded,filled", fillcolor="#EBF4FF", fontname="Inter"];
-            edge [fontname="Inter", fontsize=10];
-            
-            SludgeIn [label="Sludge from WWTP"];
-            Thickener [label="Sludge Thickener"];
-            Digester [label="Anaerobic Digester"];
-            Dewatering [label="Dewatering"];
-            Biosolids [label="Final Biosolids\\n{results['Dewatered Cake Production (kg/day)']:.0f} kg/day"];
-            Biogas [shape=oval, fillcolor="#FEF3C7", label="Biogas\\n{results['Biogas Production (m³/day)']:.0f} m³/day"];
-            ThickeningPolymer [shape=oval, fillcolor="#D1FAE5", label="Polymer\\n{results['Thickening Polymer Consumption (kg/day)']:.1f} kg/day"];
-            DewateringPolymer [shape=oval, fillcolor="#D1FAE5", label="Polymer\\n{results['Dewatering Polymer Consumption (kg/day)']:.1f} kg/day"];
-
-            SludgeIn -> Thickener;
-            Thickener -> Digester;
-            Digester -> Dewatering;
-            Dewatering -> Biosolids;
-            Digester -> Biogas;
-            ThickeningPolymer -> Thickener;
-            DewateringPolymer -> Dewatering;
-        }}
-        """
-        return dot
-
-    flow_unit_label = inputs['flow_unit_short']
-    influent_label = (f"Influent\\nQ={inputs['avg_flow_input']:.1f} {flow_unit_label}")
-    effluent_label = (f"Effluent\\nQ={inputs['avg_flow_input']:.1f} {flow_unit_label}")
-
-    dot = f"""
-    digraph G {{
-        rankdir=LR;
-        graph [fontname="Inter"];
-        node [shape=box, style="rounded,filled", fillcolor="#EBF4FF", fontname="Inter"];
-        edge [fontname="Inter", fontsize=10];
-        
-        Influent [label="{influent_label}"];
+    `capex` and each `opex` entry may be arrays over technologies; the result
+    has shape (technologies, rates, energy, chemical, lifetimes).
     """
-    
-    process_train = "EQ -> Anoxic -> Aerobic;" if tech != 'MBBR' else "EQ -> Aerobic;"
-    
-    dot += f"""
-        subgraph cluster_main {{
-            label = "{tech.upper()} Process";
-            style=filled;
-            color=lightgrey;
-            {process_train}
-        }}
+    capex = np.asarray(capex, dtype=float).reshape(-1, 1, 1, 1, 1)
+    energy_kwh = np.asarray(opex['energy_kwh_yr'], dtype=float).reshape(-1, 1, 1, 1, 1)
+    chemicals = np.asarray(opex['chemicals_usd_yr'], dtype=float).reshape(-1, 1, 1, 1, 1)
+    other = np.asarray(opex['other_usd_yr'], dtype=float).reshape(-1, 1, 1, 1, 1)
+    r = np.asarray(discount_rates, dtype=float).reshape(1, -1, 1, 1, 1)
+    e = np.asarray(energy_multipliers, dtype=float).reshape(1, 1, -1, 1, 1)
+    c = np.asarray(chemical_multipliers, dtype=float).reshape(1, 1, 1, -1, 1)
+    n = np.asarray(lifetimes, dtype=float).reshape(1, 1, 1, 1, -1)
+
+    safe_r = np.where(r == 0, 1, r)
+    annuity_factor = np.where(r == 0, n, (1 - (1 + safe_r) ** -n) / safe_r)
+    annual = energy_kwh * COST_PARAMS['unit_prices']['energy_usd_kwh'] * e + chemicals * c + other
+    return capex + annual * annuity_factor
+
+def rank_technologies(inputs, results_by_tech, discount_rates, energy_multipliers, chemical_multipliers, lifetimes):
+    """Ranks liquid treatment trains by lifecycle cost across a scenario grid.
+
+    Returns (summary DataFrame, NPV array shaped as in calculate_npv).
     """
-    
-    separator = "Clarifier" if tech != 'MBR' else "Membrane Tank"
-    
-    if tech != 'MBBR':
-        ras_flow = results[f'RAS Flow ({flow_unit_label})']
-        was_flow = results[f'WAS Flow ({flow_unit_label})']
-        dot += f'Aerobic -> {separator};'
-        dot += f'{separator} -> Effluent [label="{effluent_label}"];'
-        dot += f'{separator} -> WAS [style=dashed, label="WAS\\n{was_flow:.2f} {flow_unit_label}"];'
-        dot += f'{separator} -> RAS [style=dashed]; RAS -> Anoxic [style=dashed, label="RAS\\n{ras_flow:.1f} {flow_unit_label}"];'
-    else:
-        dot += f'Aerobic -> {separator}; {separator} -> Effluent [label="{effluent_label}"];'
+    techs = [t for t in ('cas', 'ifas', 'mbr', 'mbbr') if t in results_by_tech]
+    capex = [sum(calculate_capex(results_by_tech[t]['sizing']).values()) for t in techs]
+    opex_rows = [calculate_annual_opex(inputs, results_by_tech[t]['sizing'], results_by_tech[t]['results']) for t in techs]
+    opex = {key: [row[key] for row in opex_rows] for key in opex_rows[0]}
+
+    npv = calculate_npv(capex, opex, discount_rates, energy_multipliers, chemical_multipliers, lifetimes)
+    base_npv = calculate_npv(capex, opex, NPV_DEFAULTS['discount_rate'], NPV_DEFAULTS['energy_multiplier'],
+                             NPV_DEFAULTS['chemical_multiplier'], NPV_DEFAULTS['lifetime_years']).ravel()
+    ranks = npv.argsort(axis=0).argsort(axis=0) + 1
+    n_scenarios = npv[0].size
+
+    summary = pd.DataFrame({
+        'Capex (USD)': capex,
+        'Energy (kWh/yr)': opex['energy_kwh_yr'],
+        'Chemicals (USD/yr)': opex['chemicals_usd_yr'],
+        'Other Opex (USD/yr)': opex['other_usd_yr'],
+        'Base-Case NPV (USD)': base_npv,
+        'Median NPV (USD)': np.median(npv.reshape(len(techs), -1), axis=1),
+        'Ranked First (% of scenarios)': (ranks == 1).reshape(len(techs), -1).sum(axis=1) / n_scenarios * 100,
+        'Mean Rank': ranks.reshape(len(techs), -1).mean(axis=1)
+    }, index=[t.upper() for t in techs])
+    return summary.sort_values('Mean Rank'), npv
+
+@st.fragment
+def display_lifecycle_costs(inputs, results_by_tech):
+    """Renders the lifecycle cost comparison tab."""
+    st.header("Lifecycle Cost & NPV Comparison")
+    col1, col2 = st.columns(2)
+    rate_range = col1.slider("Discount Rate (%)", 0.0, 15.0, (3.0, 8.0), 0.5, key='npv_rates')
+    energy_range = col1.slider("Energy Price (× base)", 0.5, 3.0, (0.8, 1.5), 0.1, key='npv_energy')
+    chemical_range = col2.slider("Chemical Price (× base)", 0.5, 3.0, (0.8, 1.5), 0.1, key='npv_chemical')
+    life_range = col2.slider("Plant Lifetime (years)", 10, 50, (15, 30), 5, key='npv_lifetime')
+    steps = st.slider("Steps per Scenario Dimension", 2, 20, 8, 1, key='npv_steps')
+
+    discount_rates = np.linspace(*rate_range, steps) / 100
+    energy_multipliers = np.linspace(*energy_range, steps)
+    chemical_multipliers = np.linspace(*chemical_range, steps)
+    lifetimes = np.unique(np.linspace(*life_range, steps).round())
+
+    summary, npv = rank_technologies(inputs, results_by_tech, discount_rates, energy_multipliers, chemical_multipliers, lifetimes)
+    st.caption(f"{npv[0].size:,} scenarios evaluated. Base case: {NPV_DEFAULTS['discount_rate'] * 100:.0f}% discount rate, "
+               f"{NPV_DEFAULTS['lifetime_years']} years, base energy and chemical prices.")
+    st.dataframe(summary.style.format("{:,.0f}").format("{:.1f}", subset=['Ranked First (% of scenarios)', 'Mean Rank']))
+
+    with st.expander("Capital Cost Breakdown"):
+        capex_rows = {t.upper(): calculate_capex(results_by_tech[t]['sizing']) for t in results_by_tech}
+        st.dataframe(pd.DataFrame(capex_rows).T.fillna(0).style.format("{:,.0f}"))
 
-    if inputs['use_alum'] and results['Alum Dose (kg/day)'] > 0:
-        alum_dose = results['Alum Dose (kg/day)']
-        dot += f'Alum [shape=oval, fillcolor="#FEF3C7", label="Alum Dose\\n{alum_dose:.1f} kg/d"]; Alum -> Aerobic;'
-    
-    if inputs['use_methanol'] and results['Carbon Source Dose (kg/day)'] > 0:
-        methanol_dose = results['Carbon Source Dose (kg/day)']
-        dot += f'Methanol [shape=oval, fillcolor="#D1FAE5", label="Carbon Dose\\n{methanol_dose:.1f} kg/d"]; Methanol -> Anoxic;'
-        
-    dot += f"Influent -> EQ [label=\"Q={inputs['avg_flow_input']:.1f} {flow_unit_label}\"];"
-    dot += "}}"
-    return dot
-
-def generate_detailed_pdf_report(inputs, sizing, results):
-    pdf = PDF()
-    pdf.add_page()
-
-    pdf.chapter_title("1. Influent Design Criteria")
-    criteria_data = {
-        f"Average Influent Flow": f"{inputs['avg_flow_input']:.2f} {inputs['flow_unit_short']}",
-        "Average Influent BOD": f"{inputs['avg_bod']} mg/L", "Average Influent TSS": f"{inputs['avg_tss']} mg/L",
-        "Average Influent TKN": f"{inputs['avg_tkn']} mg/L", "Average Influent TP": f"{inputs['avg_tp']} mg/L",
-    }
-    if sizing['tech'] == 'Scrubber':
-        criteria_data = {
-            "Airflow to Treat": f"{inputs['air_flow_m3_hr']:.0f} m³/hr",
-            "Inlet H2S Concentration": f"{inputs['h2s_in_ppm']} ppm",
-            "Inlet NH3 Concentration": f"{inputs['nh3_in_ppm']} ppm",
-            "Acid Stage Chemical": inputs['acid_chemical'],
-            "Acid Concentration": f"{inputs['acid_conc']} %",
-            "Caustic Stage Chemical": inputs['caustic_chemical'],
-            "Caustic Concentration": f"{inputs['caustic_conc']} %"
-        }
-    pdf.chapter_body(criteria_data)
-
-    pdf.chapter_title("2. Equipment Sizing and Dimensions")
-    sizing_header = ["Unit", "Parameter", "Value", "Units"]
-    sizing_data = []
-    if sizing['tech'] != 'Scrubber' and sizing['tech'] != 'Solids':
-        sizing_data.extend([
-            ["Equalization", "Peak Pump Rate", f"{results['EQ Peak Pump Rate (m³/hr)']:.1f}", "m³/hr"],
-            ["Equalization", "Control Valve Cv", f"{results['EQ Valve Cv']:.1f}", ""],
-            ["RAS", "Design Flow", f"{results['RAS Design Flow (m³/hr)']:.1f}", "m³/hr"],
-            ["RAS", "Control Valve Cv", f"{results['RAS Valve Cv']:.1f}", ""],
-            ["WAS", "Design Flow", f"{results['WAS Design Flow (m³/hr)']:.1f}", "m³/hr"],
-            ["WAS", "Control Valve Cv", f"{results['WAS Valve Cv']:.1f}", ""],
-        ])
-    if sizing['tech'] == 'Scrubber':
-        sizing_data.extend([
-            ["Acid Dosing Pump", "Capacity", f"{results['Acid Dosing Pump Capacity (L/hr)']:.2f}", "L/hr"],
-            ["Caustic Dosing Pump", "Capacity", f"{results['Caustic Dosing Pump Capacity (L/hr)']:.2f}", "L/hr"]
-        ])
-    if sizing['tech'] == 'Solids':
-        sizing_data.extend([
-            ["Thickener", "GBT Width", f"{sizing['gbt_width_m']:.1f}", "m"]
-        ])
-    for tank_name, dims in sizing['dimensions'].items():
-        vol_key = [k for k in sizing if tank_name.split(' ')[0].lower() in k and 'volume' in k]
-        if vol_key:
-            sizing_data.append([tank_name, "Volume", f"{sizing[vol_key[0]]:,.0f}", "m³"])
-        for dim_name, dim_val in dims.items():
-            sizing_data.append([tank_name, dim_name.split(' ')[0], dim_val, dim_name.split(' ')[1].replace('(', '').replace(')', '')])
-    pdf.create_table(sizing_header, sizing_data, col_widths=[45, 45, 45, 45])
-
-    pdf.chapter_title("3. Process Flow Diagram")
-    dot_string = generate_pfd_dot(inputs, sizing, results)
-    s = Source(dot_string, format="png")
-    
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_file:
-        s.render(os.path.splitext(tmp_file.name)[0], cleanup=True)
-        image_path = tmp_file.name
-    
-    pdf.image(image_path, x=10, w=pdf.w - 20)
-    os.remove(image_path)
-    
-    pdf.ln(5)
+# ==============================================================================
+# --- Live Plant Data Replay ---
+# ==============================================================================
+class RingBuffer:
+    """Fixed-capacity buffer of float records; memory is allocated once and never grows."""
+
+    def __init__(self, capacity, fields):
+        self.capacity = capacity
+        self.fields = list(fields)
+        self.data = np.full((capacity, len(self.fields)), np.nan)
+        self.next_index = 0
+        self.size = 0
+
+    def extend(self, rows):
+        rows = np.asarray(rows, dtype=float).reshape(-1, len(self.fields))[-self.capacity:]
+        positions = (self.next_index + np.arange(len(rows))) % self.capacity
+        self.data[positions] = rows
+        self.next_index = (self.next_index + len(rows)) % self.capacity
+        self.size = min(self.size + len(rows), self.capacity)
+
+    def latest(self, n=None):
+        """Returns the newest n records, oldest first, as a DataFrame."""
+        n = self.size if n is None else min(n, self.size)
+        positions = (self.next_index - n + np.arange(n)) % self.capacity
+        return pd.DataFrame(self.data[positions], columns=self.fields)
+
+def parse_plant_lines(lines, header=None):
+    """Parses CSV or JSONL plant readings into dicts; returns (readings, csv_header)."""
+    readings = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('{'):
+            try:
+                readings.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+        elif header is None:
+            header = [h.strip() for h in next(csv.reader([line]))]
+        else:
+            readings.append(dict(zip(header, next(csv.reader([line])))))
+    return readings, header
+
+def resolve_replay_path(path):
+    """Absolute path of a replay file, which must lie inside the plant data directory."""
+    root = os.path.realpath(REPLAY_PARAMS['data_dir'])
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise ValueError(f"plant data files must be inside {root}")
+    return resolved
+
+def resolve_replay_address(address):
+    """(ip, port) of a replay socket, which must resolve to a loopback address only."""
+    host, sep, port = address.strip().rpartition(':')
+    if not sep:
+        raise ValueError("socket address must be host:port")
+    infos = socket.getaddrinfo(host.strip('[]'), int(port), type=socket.SOCK_STREAM)
+    ips = [info[4][0] for info in infos]
+    if not all(ipaddress.ip_address(ip).is_loopback for ip in ips):
+        raise ValueError("plant data sockets must be on this machine (loopback addresses only)")
+    return ips[0], int(port)  # Connect to the checked address rather than resolving again
+
+def drop_oversized_line(data, state):
+    """Discards a line longer than max_read_bytes, which would otherwise never complete.
+
+    Returns the data following the discarded line; state['discarding'] stays
+    set while its newline has not arrived yet, and state['skipped_lines']
+    counts every line dropped.
+    """
+    if not state['discarding'] and (len(data) < REPLAY_PARAMS['max_read_bytes'] or b'\n' in data):
+        return data
+    if not state['discarding']:
+        state['skipped_lines'] += 1
+    end = data.find(b'\n') + 1
+    state['discarding'] = end == 0
+    return data[end:] if end else b''
+
+def tail_plant_file(path, state):
+    """Reads the complete lines appended to a CSV/JSONL file since the last poll."""
+    with open(resolve_replay_path(path), 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() < state['offset']:  # File was truncated or rotated
+            state['offset'], state['header'], state['discarding'] = 0, None, False
+        f.seek(state['offset'])
+        chunk = f.read(REPLAY_PARAMS['max_read_bytes'])
+    kept = drop_oversized_line(chunk, state)
+    state['offset'] += len(chunk) - len(kept)
+    complete = kept[:kept.rfind(b'\n') + 1]
+    state['offset'] += len(complete)
+    readings, state['header'] = parse_plant_lines(complete.decode('utf-8', errors='replace').splitlines(), state['header'])
+    return readings
+
+def read_plant_socket(address, state):
+    """Drains newline-delimited readings from a local SCADA stand-in socket."""
+    if state.get('socket') is None:
+        state['socket'] = socket.create_connection(resolve_replay_address(address), timeout=REPLAY_PARAMS['socket_timeout_s'])
+    raw = state.get('partial', b'')
+    try:
+        while len(raw) < REPLAY_PARAMS['max_read_bytes']:
+            data = state['socket'].recv(65536)
+            if not data:
+                close_replay_source(state)
+                break
+            raw += data
+    except socket.timeout:
+        pass
+    raw = drop_oversized_line(raw, state)
+    cut = raw.rfind(b'\n') + 1
+    state['partial'] = raw[cut:]
+    readings, state['header'] = parse_plant_lines(raw[:cut].decode('utf-8', errors='replace').splitlines(), state['header'])
+    return readings
+
+def close_replay_source(state):
+    if state.get('socket') is not None:
+        state['socket'].close()
+        state['socket'] = None
+
+def _reading_value(reading, field):
+    try:
+        return float(reading.get(field, np.nan))
+    except (TypeError, ValueError):
+        return np.nan
+
+def simulate_replay_readings(inputs, sizing, readings, state, adjustments=None):
+    """Runs simulate_process on each new reading and returns rows for the replay buffer."""
+    flow_factor = CONVERSION_FACTORS['flow'].get(f"{inputs['flow_unit_short']}_to_m3_day", 1)
+    rows = []
+    for reading in readings:
+        step_inputs = dict(inputs)
+        for field, key in REPLAY_INFLUENT_FIELDS.items():
+            value = _reading_value(reading, field)
+            if not np.isnan(value):
+                step_inputs[key] = value * flow_factor if field == 'Flow' else value
+        results = simulate_process(step_inputs, sizing, adjustments)
+
+        try:
+            timestamp = pd.Timestamp(reading['timestamp']).timestamp()
+        except (KeyError, TypeError, ValueError):
+            timestamp = float(state['sequence'])
+        state['sequence'] += 1
+
+        rows.append([timestamp]
+                    + [results[key] for key in REPLAY_EFFLUENT_FIELDS.values()]
+                    + [_reading_value(reading, field) for field in REPLAY_EFFLUENT_FIELDS])
+    return rows
+
+def replay_buffer_fields():
+    params = [key.split(' ')[1] for key in REPLAY_EFFLUENT_FIELDS.values()]
+    return ['time'] + [f"Simulated {p}" for p in params] + [f"Measured {p}" for p in params]
+
+def display_live_replay(inputs, sizing, rerun_key_prefix):
+    """Tails local plant data into the simulation and compares simulated vs measured effluent."""
+    with st.expander("Live Plant Data Replay"):
+        source_type = st.radio("Data Source", ['File (CSV/JSONL)', 'Socket (host:port)'], horizontal=True, key=f"{rerun_key_prefix}_replay_source")
+        is_file = source_type.startswith('File')
+        location = st.text_input("File Path" if is_file else "Socket Address", key=f"{rerun_key_prefix}_replay_location",
+                                 placeholder="plant_data.csv" if is_file else "127.0.0.1:5020")
+        window = st.slider("Rolling Window (readings)", 10, REPLAY_PARAMS['buffer_capacity'], 96, 2, key=f"{rerun_key_prefix}_replay_window")
+        st.caption("Columns: timestamp, " + ", ".join(list(REPLAY_INFLUENT_FIELDS) + list(REPLAY_EFFLUENT_FIELDS)))
+        st.caption(f"Files are read from {os.path.realpath(REPLAY_PARAMS['data_dir'])}; sockets must be on this machine.")
+
+        state = st.session_state.replay_state.get(rerun_key_prefix)
+        if state is None or state['source'] != (source_type, location):
+            if state is not None:
+                close_replay_source(state)
+            state = {
+                'source': (source_type, location), 'offset': 0, 'header': None, 'sequence': 0,
+                'discarding': False, 'skipped_lines': 0,
+                'buffer': RingBuffer(REPLAY_PARAMS['buffer_capacity'], replay_buffer_fields())
+            }
+            st.session_state.replay_state[rerun_key_prefix] = state
+
+        if st.button("Poll Plant Data", key=f"{rerun_key_prefix}_replay_poll") and location:
+            skipped = state['skipped_lines']
+            try:
+                readings = tail_plant_file(location, state) if is_file else read_plant_socket(location, state)
+            except (OSError, ValueError) as e:
+                st.error(f"Error reading plant data: {e}")
+                readings = []
+            if state['skipped_lines'] > skipped:
+                st.warning(f"Skipped {state['skipped_lines'] - skipped} line(s) longer than {REPLAY_PARAMS['max_read_bytes']:,} bytes.")
+            # Only the newest readings can survive in the buffer, so skip simulating the rest
+            readings = readings[-REPLAY_PARAMS['buffer_capacity']:]
+            adjustments = st.session_state.rerun_adjustments.get(rerun_key_prefix)
+            state['buffer'].extend(simulate_replay_readings(inputs, sizing, readings, state, adjustments))
+            st.success(f"Received {len(readings)} new readings.")
+
+        if state['buffer'].size == 0:
+            return
+        window_df = state['buffer'].latest(window)
+        if window_df['time'].iloc[0] > 1e8:
+            window_df['time'] = pd.to_datetime(window_df['time'], unit='s')
+        window_df = window_df.set_index('time')
+
+        params = [key.split(' ')[1] for key in REPLAY_EFFLUENT_FIELDS.values()]
+        cols = st.columns(len(params))
+        for col, param in zip(cols, params):
+            error = (window_df[f"Simulated {param}"] - window_df[f"Measured {param}"]).abs().mean()
+            col.metric(f"{param} Mean Abs. Error", "n/a" if np.isnan(error) else f"{error:.2f} mg/L")
+        param = st.selectbox("Effluent Parameter", params, key=f"{rerun_key_prefix}_replay_param")
+        st.line_chart(window_df[[f"Simulated {param}", f"Measured {param}"]])
+
+# ==============================================================================
+# --- Memoized Rendering Helpers ---
+# ==============================================================================
+@st.cache_data(show_spinner="Building PDF report...", max_entries=64)
+def cached_pdf_report(inputs, sizing, results):
+    return generate_detailed_pdf_report(inputs, sizing, results)
 
-    pdf.chapter_title("4. Performance & Operational Summary")
-    perf_header = ["Parameter", "Value", "Units"]
-    perf_data = []
-    for key, val in results.items():
-        if isinstance(val, (int, float)) and val > 0.01:
-            unit = key.split('(')[-1].replace(')', '') if '(' in key else 'kg/day'
-            param = key.split('(')[0].strip()
-            perf_data.append([param, f"{val:.2f}", unit])
-    pdf.create_table(perf_header, perf_data, col_widths=[90, 45, 45])
+@st.cache_data(show_spinner=False, max_entries=64)
+def cached_plant_hydraulics(inputs, sizing, ras_flow_m3_hr, was_flow_m3_hr):
+    return calculate_plant_hydraulics(inputs, sizing, ras_flow_m3_hr, was_flow_m3_hr)
 
-    return pdf.output(dest='S').encode('latin-1')
+@st.cache_data(show_spinner=False, max_entries=256)
+def cached_pfd_dot(inputs, sizing, results):
+    return generate_pfd_dot(inputs, sizing, results)
 
+@st.fragment
 def display_output(tech_name, inputs, sizing, results, rerun_key_prefix):
-    """Renders the output for a single technology tab."""
+    """Renders the output for a single technology tab.
+
+    Runs as a fragment, so widget interactions inside a tab rerun only that
+    tab; the PDF, PFD and hydraulics are memoized across reruns.
+    """
     st.header(f"{tech_name} Design Summary")
     
     is_us = 'US Customary' in inputs['flow_unit_name']
@@ -775,7 +1051,7 @@ def display_output(tech_name, inputs, sizing, results, rerun_key_prefix):
 
     with st.expander("View Initial Design Details"):
         st.subheader("Process Flow Diagram (Initial Design)")
-        pfd_dot_string = generate_pfd_dot(inputs, sizing, results)
+        pfd_dot_string = cached_pfd_dot(inputs, sizing, results)
         st.graphviz_chart(pfd_dot_string)
 
         if tech_name in ['Solids Handling', 'Air Scrubber']:
@@ -797,12 +1073,37 @@ def display_output(tech_name, inputs, sizing, results, rerun_key_prefix):
             st.dataframe(pd.DataFrame(dims_data).set_index('Tank'))
 
             st.subheader("Pump & Blower Sizing")
+            psi_to_m = CONVERSION_FACTORS['pressure']['psi_to_m_water']
             pump_data = {
-                "EQ Pump": {"Design Flow (m³/hr)": results['EQ Peak Pump Rate (m³/hr)'], "Design Pressure (psi)": 20, "Valve Cv": results['EQ Valve Cv']},
-                "RAS Pump": {"Design Flow (m³/hr)": results['RAS Design Flow (m³/hr)'], "Design Pressure (psi)": 20, "Valve Cv": results['RAS Valve Cv']},
-                "WAS Pump": {"Design Flow (m³/hr)": results['WAS Design Flow (m³/hr)'], "Design Pressure (psi)": 20, "Valve Cv": results['WAS Valve Cv']}
+                "EQ Pump": {"Design Flow (m³/hr)": results['EQ Peak Pump Rate (m³/hr)'], "Design Pressure (psi)": results['EQ Pump TDH (m)'] / psi_to_m, "Valve Cv": results['EQ Valve Cv']},
+                "RAS Pump": {"Design Flow (m³/hr)": results['RAS Design Flow (m³/hr)'], "Design Pressure (psi)": results['RAS Pump TDH (m)'] / psi_to_m, "Valve Cv": results['RAS Valve Cv']},
+                "WAS Pump": {"Design Flow (m³/hr)": results['WAS Design Flow (m³/hr)'], "Design Pressure (psi)": results['WAS Pump TDH (m)'] / psi_to_m, "Valve Cv": results['WAS Valve Cv']}
             }
             st.dataframe(pd.DataFrame(pump_data).T.style.format("{:.2f}"))
+
+            hydraulics = cached_plant_hydraulics(inputs, sizing, results['RAS Design Flow (m³/hr)'], results['WAS Design Flow (m³/hr)'])
+            st.subheader("Hydraulic Profile")
+            st.caption("Water surface elevation above the effluent channel (m)")
+            profile_df = pd.DataFrame(hydraulics['profile'], index=list(FLOW_CONDITIONS)).T
+            st.dataframe(profile_df.style.format("{:.2f}"))
+
+            st.subheader("Pump & Valve Selection")
+            selection_data = {}
+            for name, system in hydraulics['pumps'].items():
+                if system is None:
+                    continue
+                pump, valve = system['pump'], system['valve']
+                pipe_mm = f"{system['pipe_diameter_m'] * 1000:.0f}"
+                row = {
+                    "Pump Model": "No catalog pump" if pump is None else f"{pump['count']} x {pump['model']}" if pump['count'] > 1 else pump['model'],
+                    "Operating Point (m³/hr)": "-" if pump is None else f"{system['operating_flow_m3_hr']:.1f}",
+                    "Pipe Diameter (mm)": f"{system['pipe_count']} x {pipe_mm}" if system['pipe_count'] > 1 else pipe_mm,
+                    "Control Valve": f"{valve['count']} x {valve['model']}" if valve['count'] > 1 else valve['model']
+                }
+                for condition, opening in zip(FLOW_CONDITIONS, system['valve_opening']):
+                    row[f"Valve Opening @ {condition} (%)"] = "Pump short" if np.isnan(opening) else f"{opening * 100:.0f}"
+                selection_data[f"{name} Pump"] = row
+            st.dataframe(pd.DataFrame(selection_data).T)
         elif tech_name == 'Air Scrubber':
             st.subheader("Chemical Dosing System")
             acid_rate_key = f"{inputs['acid_chemical']} Dosing Rate (L/day)"
@@ -829,13 +1130,28 @@ def display_output(tech_name, inputs, sizing, results, rerun_key_prefix):
         results_df = results_df[results_df.apply(lambda x: isinstance(x.iloc[0], (int, float)) and x.iloc[0] > 0.01, axis=1)]
         st.dataframe(results_df.style.format("{:,.2f}"))
 
-        pdf_data = generate_detailed_pdf_report(inputs, sizing, results)
+        pdf_data = cached_pdf_report(inputs, sizing, results)
         st.download_button(
             label="⬇️ Download Initial Design Report (PDF)",
             data=pdf_data,
             file_name=f"AquaGenius_{tech_name.replace(' ', '_')}_Initial_Report.pdf",
             mime="application/pdf"
         )
+
+        if tech_name not in ['Air Scrubber', 'Solids Handling']:
+            appendix_key = f"{rerun_key_prefix}_appendix_pdf"
+            if st.button("Build Report with Hourly Time-Series Appendix", key=f"{rerun_key_prefix}_appendix_build"):
+                with st.spinner("Building report..."):
+                    series = load_trend_series(st.session_state.simulation_data.get('run_id'), rerun_key_prefix, inputs, sizing, 365, 60)
+                    st.session_state[appendix_key] = generate_detailed_pdf_report(inputs, sizing, results, appendix=build_timeseries_appendix(series, 60))
+            if appendix_key in st.session_state:
+                st.download_button(
+                    label="⬇️ Download Report with Time-Series Appendix (PDF)",
+                    data=st.session_state[appendix_key],
+                    file_name=f"AquaGenius_{tech_name.replace(' ', '_')}_Report_with_Appendix.pdf",
+                    mime="application/pdf",
+                    key=f"{rerun_key_prefix}_appendix_download"
+                )
     
     st.markdown("---")
     st.header("Operational Adjustments & Re-run")
@@ -852,6 +1168,7 @@ def display_output(tech_name, inputs, sizing, results, rerun_key_prefix):
             adjustments = {'fan_speed_slider': adj_fan_speed, 'acid_pump_slider': adj_acid_pump, 'caustic_pump_slider': adj_caustic_pump}
             rerun_results = simulate_process(inputs, sizing, adjustments)
             st.session_state.rerun_results[rerun_key_prefix] = rerun_results
+            st.session_state.rerun_adjustments[rerun_key_prefix] = adjustments
     elif tech_name == 'Solids Handling':
         thickening_polymer_key = f"{rerun_key_prefix}_thickening_polymer_slider"
         mixing_key = f"{rerun_key_prefix}_mixing_slider"
@@ -864,6 +1181,7 @@ def display_output(tech_name, inputs, sizing, results, rerun_key_prefix):
             adjustments = {'digester_mixing_slider': adj_mixing, 'dewatering_polymer_slider': adj_dewatering_polymer}
             rerun_results = simulate_process(inputs, sizing, adjustments)
             st.session_state.rerun_results[rerun_key_prefix] = rerun_results
+            st.session_state.rerun_adjustments[rerun_key_prefix] = adjustments
     else: # CAS, IFAS, MBR
         eq_key = f"{rerun_key_prefix}_eq_slider"
         ras_key = f"{rerun_key_prefix}_ras_slider"
@@ -872,10 +1190,12 @@ def display_output(tech_name, inputs, sizing, results, rerun_key_prefix):
         mlss_key = f"{rerun_key_prefix}_mlss_slider"
         mlvss_key = f"{rerun_key_prefix}_mlvss_slider"
 
+        kinetic, _ = get_process_params(inputs)
+
         def update_mlvss():
-            st.session_state[mlvss_key] = st.session_state[mlss_key] * KINETIC_PARAMS['VSS_TSS_ratio']
+            st.session_state[mlvss_key] = st.session_state[mlss_key] * kinetic['VSS_TSS_ratio']
         def update_mlss():
-            st.session_state[mlss_key] = st.session_state[mlvss_key] / KINETIC_PARAMS['VSS_TSS_ratio']
+            st.session_state[mlss_key] = st.session_state[mlvss_key] / kinetic['VSS_TSS_ratio']
 
         adj_eq_flow = st.slider("EQ Pump Flow (% of Design)", 0, 150, 100, 5, key=eq_key)
         adj_ras_flow = st.slider("RAS Pump Flow (% of Design)", 0, 150, 100, 5, key=ras_key)
@@ -885,7 +1205,7 @@ def display_output(tech_name, inputs, sizing, results, rerun_key_prefix):
         # MLSS/MLVSS Sliders
         if tech_name in ['CAS', 'IFAS', 'MBR']:
             adj_mlss = st.slider("MLSS (mg/L)", 1500, 12000, sizing['mlss'], 100, key=mlss_key, on_change=update_mlvss)
-            adj_mlvss = st.slider("MLVSS (mg/L)", 1000, 10000, int(sizing['mlss'] * KINETIC_PARAMS['VSS_TSS_ratio']), 100, key=mlvss_key, on_change=update_mlss)
+            adj_mlvss = st.slider("MLVSS (mg/L)", 1000, 10000, int(sizing['mlss'] * kinetic['VSS_TSS_ratio']), 100, key=mlvss_key, on_change=update_mlss)
 
         if st.button("Re-run Simulation with Adjustments", key=f"rerun_{rerun_key_prefix}"):
             adjustments = {
@@ -897,6 +1217,7 @@ def display_output(tech_name, inputs, sizing, results, rerun_key_prefix):
 
             rerun_results = simulate_process(inputs, sizing, adjustments)
             st.session_state.rerun_results[rerun_key_prefix] = rerun_results
+            st.session_state.rerun_adjustments[rerun_key_prefix] = adjustments
 
     if rerun_key_prefix in st.session_state.rerun_results:
         rerun_data = st.session_state.rerun_results[rerun_key_prefix]
@@ -906,34 +1227,333 @@ def display_output(tech_name, inputs, sizing, results, rerun_key_prefix):
         st.dataframe(rerun_df.style.format("{:,.2f}"))
 
         st.subheader("Adjusted Process Flow Diagram")
-        adjusted_pfd_dot = generate_pfd_dot(inputs, sizing, rerun_data)
+        adjusted_pfd_dot = cached_pfd_dot(inputs, sizing, rerun_data)
         st.graphviz_chart(adjusted_pfd_dot)
 
+    if tech_name in ['CAS', 'IFAS', 'MBR']:
+        display_nitrification_check(inputs, sizing, rerun_key_prefix)
+    if tech_name not in ['Air Scrubber', 'Solids Handling']:
+        display_eq_basin(inputs, sizing, rerun_key_prefix)
+        display_trend_charts(inputs, sizing, rerun_key_prefix)
+        display_dosing_control(inputs, sizing, results, rerun_key_prefix)
+        display_live_replay(inputs, sizing, rerun_key_prefix)
+
 
 # ==============================================================================
-# --- Main App Flow ---
+# --- Design Run Store ---
 # ==============================================================================
-if run_button:
-    inputs = get_inputs()
-    results_by_tech = {}
-    for tech in ['cas', 'ifas', 'mbr', 'mbbr', 'scrubber', 'solids']:
-        sizing_func = globals()[f"calculate_{tech}_sizing"]
-        sizing = sizing_func(inputs)
-        results = simulate_process(inputs, sizing)
-        results_by_tech[tech] = {'sizing': sizing, 'results': results}
-    
+# Metrics copied out of each technology's results into indexed columns for fast comparison
+RUN_STORE_METRICS = {
+    'total_volume_m3': ('sizing', 'total_volume'),
+    'required_airflow_m3_hr': ('results', 'Required Airflow (m³/hr)'),
+    'total_sludge_kg_day': ('results', 'Total Sludge Production (kg TSS/day)'),
+    'effluent_tkn_mg_l': ('results', 'Effluent TKN (mg/L)'),
+    'effluent_tp_mg_l': ('results', 'Effluent TP (mg/L)'),
+    'biogas_m3_day': ('results', 'Biogas Production (m³/day)')
+}
+
+def canonical_input_hash(inputs):
+    """Stable SHA-256 of the design inputs and model version, independent of key order."""
+    payload = {'model_version': RUN_STORE_PARAMS['model_version'], 'inputs': inputs}
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=float)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def open_run_store():
+    """Opens the local SQLite run store, creating the schema on first use."""
+    os.makedirs(RUN_STORE_PARAMS['directory'], exist_ok=True)
+    conn = sqlite3.connect(os.path.join(RUN_STORE_PARAMS['directory'], 'runs.db'))
+    metric_columns = ", ".join(f"{name} REAL" for name in RUN_STORE_METRICS)
+    conn.executescript(f"""
+        CREATE TABLE IF NOT EXISTS runs (
+            run_id INTEGER PRIMARY KEY, input_hash TEXT UNIQUE NOT NULL, plant TEXT,
+            created_at TEXT NOT NULL, inputs_json TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS run_techs (
+            run_id INTEGER NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE, tech TEXT NOT NULL,
+            {metric_columns}, data_json TEXT NOT NULL, PRIMARY KEY (run_id, tech)
+        );
+        CREATE TABLE IF NOT EXISTS run_arrays (
+            run_id INTEGER NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE, name TEXT NOT NULL,
+            path TEXT NOT NULL, PRIMARY KEY (run_id, name)
+        );
+        CREATE TABLE IF NOT EXISTS calibrations (
+            calibration_id INTEGER PRIMARY KEY, plant TEXT, created_at TEXT NOT NULL,
+            n_rows INTEGER NOT NULL, data_hash TEXT NOT NULL, result_json TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_calibrations_plant ON calibrations(plant, created_at);
+        CREATE INDEX IF NOT EXISTS idx_runs_plant ON runs(plant, created_at);
+        CREATE INDEX IF NOT EXISTS idx_runs_created ON runs(created_at);
+        CREATE INDEX IF NOT EXISTS idx_run_techs_tech ON run_techs(tech);
+    """)
+    return conn
+
+def save_run(inputs, results_by_tech, input_hash=None):
+    """Persists a design run and returns its run_id (the existing id for a repeated input hash)."""
+    input_hash = input_hash or canonical_input_hash(inputs)
+    with contextlib.closing(open_run_store()) as conn, conn:
+        conn.execute("INSERT OR IGNORE INTO runs (input_hash, plant, created_at, inputs_json) VALUES (?, ?, ?, ?)",
+                     (input_hash, inputs.get('plant_name'), datetime.datetime.now().isoformat(timespec='seconds'),
+                      json.dumps(inputs, default=float)))
+        run_id = conn.execute("SELECT run_id FROM runs WHERE input_hash = ?", (input_hash,)).fetchone()[0]
+        for tech, data in results_by_tech.items():
+            metrics = [data[source].get(key) for source, key in RUN_STORE_METRICS.values()]
+            conn.execute(f"INSERT OR REPLACE INTO run_techs (run_id, tech, {', '.join(RUN_STORE_METRICS)}, data_json) "
+                         f"VALUES (?, ?, {', '.join('?' * len(RUN_STORE_METRICS))}, ?)",
+                         [run_id, tech] + metrics + [json.dumps(data, default=float)])
+    return run_id
+
+def load_run(input_hash=None, run_id=None):
+    """Loads a stored run as (run_id, inputs, results_by_tech), or None if absent."""
+    with contextlib.closing(open_run_store()) as conn, conn:
+        if run_id is None:
+            row = conn.execute("SELECT run_id, inputs_json FROM runs WHERE input_hash = ?", (input_hash,)).fetchone()
+        else:
+            row = conn.execute("SELECT run_id, inputs_json FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        techs = [] if row is None else conn.execute("SELECT tech, data_json FROM run_techs WHERE run_id = ?", (row[0],)).fetchall()
+    if row is None:
+        return None
+    return row[0], json.loads(row[1]), {tech: json.loads(data) for tech, data in techs}
+
+def query_runs(plant=None, tech=None, since=None, until=None, limit=None):
+    """Returns one row per stored (run, technology) matching the filters, newest first."""
+    clauses, params = [], []
+    for column, op, value in (('r.plant', '=', plant), ('t.tech', '=', tech),
+                              ('r.created_at', '>=', since), ('r.created_at', '<', until)):
+        if value is not None:
+            clauses.append(f"{column} {op} ?")
+            params.append(value)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    sql = (f"SELECT r.run_id, r.plant, r.created_at, t.tech, {', '.join('t.' + m for m in RUN_STORE_METRICS)} "
+           f"FROM runs r JOIN run_techs t ON t.run_id = r.run_id {where} "
+           f"ORDER BY r.created_at DESC, r.run_id DESC LIMIT ?")
+    with contextlib.closing(open_run_store()) as conn, conn:
+        df = pd.read_sql_query(sql, conn, params=params + [limit or RUN_STORE_PARAMS['history_limit']])
+    return df
+
+def save_run_array(run_id, name, array):
+    """Writes a bulk result array next to the store as .npy and registers it with the run."""
+    array_dir = os.path.join(RUN_STORE_PARAMS['directory'], 'arrays', str(run_id))
+    os.makedirs(array_dir, exist_ok=True)
+    path = os.path.join(array_dir, f"{name}.npy")
+    np.save(path, np.asarray(array))
+    with contextlib.closing(open_run_store()) as conn, conn:
+        conn.execute("INSERT OR REPLACE INTO run_arrays (run_id, name, path) VALUES (?, ?, ?)", (run_id, name, path))
+    prune_run_arrays(keep=path)
+
+def load_run_array(run_id, name):
+    """Memory-maps a stored bulk array, or returns None if the run has none by that name."""
+    with contextlib.closing(open_run_store()) as conn, conn:
+        row = conn.execute("SELECT path FROM run_arrays WHERE run_id = ? AND name = ?", (run_id, name)).fetchone()
+    if row is None or not os.path.exists(row[0]):
+        return None
+    os.utime(row[0])  # Marks the array as recently used for prune_run_arrays
+    return np.load(row[0], mmap_mode='r')
+
+def prune_run_arrays(max_bytes=None, keep=None):
+    """Deletes the least recently used stored arrays until they fit in the array budget."""
+    max_bytes = RUN_STORE_PARAMS['max_array_bytes'] if max_bytes is None else max_bytes
+    with contextlib.closing(open_run_store()) as conn, conn:
+        rows = conn.execute("SELECT run_id, name, path FROM run_arrays").fetchall()
+        present = [(os.path.getmtime(path), os.path.getsize(path), run_id, name, path) for run_id, name, path in rows if os.path.exists(path)]
+        stale = [(run_id, name) for run_id, name, path in rows if not os.path.exists(path)]
+        total = sum(size for _, size, *_ in present)
+        for _, size, run_id, name, path in sorted(present):
+            if total <= max_bytes:
+                break
+            if path == keep:
+                continue
+            os.remove(path)
+            stale.append((run_id, name))
+            total -= size
+        conn.executemany("DELETE FROM run_arrays WHERE run_id = ? AND name = ?", stale)
+
+# ==============================================================================
+# --- Kinetic Calibration ---
+# ==============================================================================
+# Plant history column -> meaning (Flow in the selected unit system)
+CALIBRATION_FIELDS = {
+    'Flow': 'Influent flow', 'BOD': 'Influent BOD (mg/L)', 'TKN': 'Influent TKN (mg/L)',
+    'Eff_BOD': 'Effluent BOD (mg/L)', 'Eff_TKN': 'Effluent TKN (mg/L)',
+    'Sludge': 'Sludge production (kg TSS/day)', 'Airflow': 'Process airflow (m³/hr)',
+    'SRT': 'SRT (days, optional)'
+}
+
+def prepare_calibration_data(history_df, flow_factor, default_srt):
+    """Vectorized derived loads for calibration.predict from a plant history table."""
+    history = history_df.apply(pd.to_numeric, errors='coerce')
+    flow_m3_day = history['Flow'].to_numpy() * flow_factor
+    bod_removed = (history['BOD'] - history['Eff_BOD']).to_numpy() * flow_m3_day / 1000
+    n_removed = (history['TKN'] - history['Eff_TKN']).to_numpy() * flow_m3_day / 1000
+    srt = history['SRT'].fillna(default_srt).to_numpy() if 'SRT' in history else np.full(len(history), default_srt)
+    sludge = history['Sludge'].to_numpy(dtype=float) if 'Sludge' in history else np.full(len(history), np.nan)
+    airflow = history['Airflow'].to_numpy(dtype=float) if 'Airflow' in history else np.full(len(history), np.nan)
+    keep = np.isfinite(bod_removed) & np.isfinite(n_removed)
+    return {
+        'bod_removed_kg_day': bod_removed[keep], 'srt_days': srt[keep],
+        'o2_demand_kg_day': bod_removed[keep] * AERATION_PARAMS['O2_demand_BOD'] + n_removed[keep] * AERATION_PARAMS['O2_demand_N'],
+        'air_o2_kg_m3': AERATION_PARAMS['O2_in_air_mass_fraction'] * AERATION_PARAMS['air_density_kg_m3'],
+        'sludge_kg_day': sludge[keep], 'airflow_m3_hr': airflow[keep],
+        'sludge_scale': np.nanmean(sludge[keep]) if np.isfinite(sludge[keep]).any() else 1.0,
+        'airflow_scale': np.nanmean(airflow[keep]) if np.isfinite(airflow[keep]).any() else 1.0
+    }
+
+def history_hash(history_df, n_rows=None):
+    rows = history_df if n_rows is None else history_df.iloc[:n_rows]
+    return hashlib.sha256(rows.to_csv(index=False).encode('utf-8')).hexdigest()
+
+def load_latest_calibration(plant):
+    with contextlib.closing(open_run_store()) as conn, conn:
+        row = conn.execute("SELECT n_rows, data_hash, result_json FROM calibrations WHERE plant = ? "
+                           "ORDER BY created_at DESC, calibration_id DESC LIMIT 1", (plant,)).fetchone()
+    return None if row is None else {'n_rows': row[0], 'data_hash': row[1], 'result': json.loads(row[2])}
+
+def run_calibration(plant, history_df, flow_factor, default_srt, n_starts, workers):
+    """Calibrates against plant history, reusing the plant's previous calibration where possible.
+
+    Identical history returns the stored result. History that extends the
+    previously calibrated rows is fitted warm-started from the previous
+    optimum with a quarter of the starts; anything else gets a full
+    multi-start search.
+    """
+    previous = load_latest_calibration(plant)
+    full_hash = history_hash(history_df)
+    if previous and previous['data_hash'] == full_hash:
+        return dict(previous['result'], mode='cached')
+
+    warm_start, mode = None, 'full'
+    if previous and previous['n_rows'] < len(history_df) and history_hash(history_df, previous['n_rows']) == previous['data_hash']:
+        warm_start = [previous['result']['params'][name] for name in calibration.PARAM_NAMES]
+        n_starts, mode = max(n_starts // 4, 2), 'incremental'
+
+    prior = [KINETIC_PARAMS.get(name, AERATION_PARAMS.get(name)) for name in calibration.PARAM_NAMES]
+    data = prepare_calibration_data(history_df, flow_factor, default_srt)
+    result = calibration.calibrate(data, prior, n_starts=n_starts, workers=workers, warm_start=warm_start)
+    result['n_rows'] = len(history_df)
+
+    with contextlib.closing(open_run_store()) as conn, conn:
+        conn.execute("INSERT INTO calibrations (plant, created_at, n_rows, data_hash, result_json) VALUES (?, ?, ?, ?, ?)",
+                     (plant, datetime.datetime.now().isoformat(timespec='seconds'), len(history_df), full_hash, json.dumps(result)))
+    return dict(result, mode=mode)
+
+def display_calibration_panel():
+    """Fits kinetic and aeration parameters to uploaded plant history."""
+    with st.expander("🔬 Kinetic Parameter Calibration"):
+        history_file = st.file_uploader("Upload Plant History CSV", type=['csv'], key='calibration_file')
+        st.caption("Columns: " + ", ".join(f"{k} ({v})" for k, v in CALIBRATION_FIELDS.items()))
+        cpu_count = os.cpu_count() or 1
+        col1, col2, col3 = st.columns(3)
+        default_srt = col1.number_input("Default SRT (days)", 2.0, 40.0, 10.0, 0.5, key='calibration_srt')
+        n_starts = col2.slider("Optimizer Starts", 4, 128, 32, 4, key='calibration_starts')
+        workers = col3.number_input("Worker Processes", 1, 64, min(4, cpu_count), 1, key='calibration_workers')
+
+        if st.button("Calibrate Parameters", key='calibration_run') and history_file is not None:
+            try:
+                history_df = pd.read_csv(history_file)
+                missing = [c for c in ('Flow', 'BOD', 'TKN', 'Eff_BOD', 'Eff_TKN') if c not in history_df]
+                if missing:
+                    raise ValueError(f"missing columns {', '.join(missing)}")
+                flow_unit_short = get_inputs()['flow_unit_short']
+                flow_factor = CONVERSION_FACTORS['flow'].get(f"{flow_unit_short}_to_m3_day", 1)
+                with st.spinner("Calibrating..."):
+                    st.session_state.calibration = run_calibration(plant_name, history_df, flow_factor, default_srt, n_starts, workers)
+                st.rerun()
+            except (ValueError, KeyError, sqlite3.Error, np.linalg.LinAlgError) as e:
+                st.error(f"Error calibrating parameters: {e}")
+            except BrokenProcessPool as e:
+                st.error(f"A calibration worker process died ({e}); try fewer worker processes.")
+
+        result = st.session_state.calibration
+        if result:
+            st.write(f"Calibrated on {result['n_rows']:,} rows ({result['mode']}); "
+                     f"{result['starts_at_optimum']} of {result['n_starts']} starts reached the optimum.")
+            defaults = dict(KINETIC_PARAMS, **AERATION_PARAMS)
+            params_df = pd.DataFrame({'Textbook': {k: defaults[k] for k in result['params']}, 'Calibrated': result['params']})
+            st.dataframe(params_df.style.format("{:.3f}"))
+            col1, col2 = st.columns(2)
+            col1.metric("Sludge RMSE", f"{result['sludge_rmse_kg_day']:.0f} kg/day")
+            col2.metric("Airflow RMSE", f"{result['airflow_rmse_m3_hr']:.0f} m³/hr")
+            st.caption("Enable 'Use Calibrated Kinetic Parameters' in the sidebar and regenerate the design to apply them.")
+
+def set_simulation_data(inputs, results_by_tech, run_id=None):
     st.session_state.simulation_data = {
-        'inputs': inputs, 'results_by_tech': results_by_tech
+        'inputs': inputs, 'results_by_tech': results_by_tech, 'run_id': run_id
     }
     st.session_state.rerun_results = {} # Clear re-run results on new simulation
+    st.session_state.rerun_adjustments = {}
+    for replay in st.session_state.replay_state.values():
+        close_replay_source(replay)
+    st.session_state.replay_state = {}
+
+def display_run_history():
+    """Lists stored design runs for querying, comparing and reloading."""
+    with st.expander("📚 Design Run History"):
+        try:
+            all_runs = query_runs()
+        except sqlite3.Error as e:
+            st.error(f"Error reading run store: {e}")
+            return
+        if all_runs.empty:
+            st.info("No stored design runs yet.")
+            return
+
+        col1, col2, col3 = st.columns(3)
+        plant = col1.selectbox("Plant", ['All'] + sorted(all_runs['plant'].dropna().unique()), key='history_plant')
+        tech = col2.selectbox("Technology", ['All'] + sorted(all_runs['tech'].unique()), key='history_tech')
+        since = col3.date_input("Since", value=None, key='history_since')
+        runs = query_runs(plant=None if plant == 'All' else plant, tech=None if tech == 'All' else tech,
+                          since=since.isoformat() if since else None)
+        st.dataframe(runs.set_index('run_id'), use_container_width=True)
+
+        run_ids = list(dict.fromkeys(runs['run_id']))
+        if run_ids:
+            selected = st.selectbox("Run", run_ids, key='history_run_id')
+            if st.button("Load Stored Design", key='history_load'):
+                stored = load_run(run_id=selected)
+                if stored:
+                    run_id, stored_inputs, stored_results = stored
+                    set_simulation_data(stored_inputs, stored_results, run_id)
+                    st.rerun()
+
+
+# ==============================================================================
+# --- Main App Flow ---
+# ==============================================================================
+if run_button:
+    inputs = get_inputs()
+    input_hash = canonical_input_hash(inputs)
+    try:
+        stored = load_run(input_hash=input_hash)
+    except sqlite3.Error as e:
+        st.warning(f"Run store unavailable: {e}")
+        stored = None
+
+    if stored:
+        run_id, _, results_by_tech = stored
+        st.toast("Identical inputs found in the run store; loaded stored design.")
+    else:
+        results_by_tech = {}
+        for tech in ['cas', 'ifas', 'mbr', 'mbbr', 'scrubber', 'solids']:
+            sizing_func = getattr(process_design, f"calculate_{tech}_sizing")
+            sizing = sizing_func(inputs)
+            results = simulate_process(inputs, sizing)
+            results_by_tech[tech] = {'sizing': sizing, 'results': results}
+        try:
+            run_id = save_run(inputs, results_by_tech, input_hash)
+        except sqlite3.Error as e:
+            st.warning(f"Could not save run: {e}")
+            run_id = None
+
+    set_simulation_data(inputs, results_by_tech, run_id)
+
+display_calibration_panel()
 
 if st.session_state.simulation_data:
     stored_data = st.session_state.simulation_data
     inputs = stored_data['inputs']
     results_by_tech = stored_data['results_by_tech']
     
-    cas_tab, ifas_tab, mbr_tab, mbbr_tab, scrubber_tab, solids_tab = st.tabs([
-        "🔹 CAS", "🔸 IFAS", "🟢 MBR", "🔺 MBBR", "💨 Air Scrubber", "🧱 Solids Handling"
+    cas_tab, ifas_tab, mbr_tab, mbbr_tab, scrubber_tab, solids_tab, cost_tab = st.tabs([
+        "🔹 CAS", "🔸 IFAS", "🟢 MBR", "🔺 MBBR", "💨 Air Scrubber", "🧱 Solids Handling", "💲 Lifecycle Cost"
     ])
 
     with cas_tab:
@@ -959,5 +1579,10 @@ if st.session_state.simulation_data:
     with solids_tab:
         data = results_by_tech['solids']
         display_output('Solids Handling', inputs, data['sizing'], data['results'], 'solids')
+
+    with cost_tab:
+        display_lifecycle_costs(inputs, results_by_tech)
 else:
     st.info("Please configure your influent criteria in the sidebar and click 'Generate Design & Simulate'")
+
+display_run_history()